@@ -1,6 +1,6 @@
 from flask import Flask
 from app.core.configure import init
-from app.core.db import fake_db_command, init_db
+from app.core.db import backfill_last_message_command, count_costumer_tickets_command, count_unreaded_command, fake_db_command, import_costumers_command, init_db, migrate_read_state_command, normalize_costumer_names_command, rebuild_role_masks_command, unique_city_command, unique_user_team_command
 from config.config import config
 
 
@@ -11,5 +11,14 @@ def create_app(mode='production'):
     init(app)
     app.cli.add_command(fake_db_command)
     app.cli.add_command(init_db)
+    app.cli.add_command(migrate_read_state_command)
+    app.cli.add_command(count_unreaded_command)
+    app.cli.add_command(rebuild_role_masks_command)
+    app.cli.add_command(backfill_last_message_command)
+    app.cli.add_command(unique_user_team_command)
+    app.cli.add_command(unique_city_command)
+    app.cli.add_command(count_costumer_tickets_command)
+    app.cli.add_command(normalize_costumer_names_command)
+    app.cli.add_command(import_costumers_command)
     
     return app
\ No newline at end of file
@@ -7,6 +7,9 @@ from werkzeug.urls import url_parse
 from app.forms.login import LoginForm
 from app.models.security import LoginSession, User, Role
 from app.core.db import db
+from app.core.hashing import HashingBusy
+from app.core.throttle import login_throttle
+from app.core.sessions import session_registry
 
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
@@ -19,36 +22,47 @@ def login():
         return redirect(url_for('main.index'))
     login = LoginForm()
     if login.validate_on_submit():
+        if login_throttle.blocked(login.username.data, request.remote_addr):
+            flash('Muitas tentativas de acesso, aguarde alguns minutos', category='danger')
+            return render_template('login.html', form=login, title='Login'), 429
         user = User.query.filter_by(username=login.username.data).first()
-        if user is None or not user.check_password(login.password.data):
+        try:
+            valid = user is not None and user.verify_and_upgrade_password(login.password.data)
+        except HashingBusy:
+            flash('Muitos acessos no momento, tente novamente em instantes', category='warning')
+            return render_template('login.html', form=login, title='Login'), 503
+        if not valid:
+            login_throttle.fail(login.username.data, request.remote_addr)
             flash('Senha ou usuário inválido', category='danger')
             return render_template('login.html', form=login, title='Login')
+        login_throttle.reset(login.username.data)
         if not user.is_active:
             flash('Usuário inativo', category='danger')
             return redirect(url_for('auth.login'))
         if user.is_temp_password:
             flash('É necessário alterar sua senha', category='warning')
             return redirect(url_for('auth.temp_password'))
-        login_session = LoginSession()
-        login_session.user_id = user.id
-        user.login_count += 1
+        if not hasattr(g, 'ip_id'):
+            return abort(500)
+        now = datetime.utcnow()
+        login_session = LoginSession(id=uuid4(), user_id=user.id, network_id=g.ip_id, last_seen_at=now)
+        user.login_count = User.login_count + 1
         if session.get('uuid', False) is False:
             session['uuid'] =  uuid4()
         user.fs_uniquifier = session['uuid']
-        if hasattr(g, 'ip_id'):
-            login_session.network_id = g.ip_id
-        else:
-            return abort(500)
-        user.last_seen = datetime.utcnow()
-        login_user(user, remember=login.remember_me.data)
+        user.current_login_network_id = g.ip_id
+        user.last_seen = now
         db.session.add(login_session)
         try:
             db.session.commit()
         except Exception as e:
+            db.session.rollback()
             app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
             app.logger.error(e)
-            logout_user()
             return redirect(url_for('auth.login'))
+        session['login_session_id'] = str(login_session.id)
+        session_registry.activate(user.id, session['uuid'], login_session.id)
+        login_user(user, remember=login.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc != '':
             next_page = url_for('main.index')
@@ -58,5 +72,7 @@ def login():
 
 @bp.route('/logout/')
 def logout():
+    if current_user.is_authenticated:
+        session_registry.deactivate(current_user.id, current_user.fs_uniquifier)
     logout_user()
     return redirect(url_for('main.index'))
\ No newline at end of file
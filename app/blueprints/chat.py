@@ -1,8 +1,8 @@
 from datetime import datetime
-from flask import Blueprint, abort, flash, redirect, render_template, session, url_for, request, g, current_app as app, copy_current_request_context
+from flask import Blueprint, abort, flash, jsonify, redirect, render_template, session, url_for, request, g, current_app as app, copy_current_request_context
 from flask_login import current_user, login_required
 from app.core.extesions import socketio
-from uuid import uuid4
+from uuid import UUID, uuid4
 from flask_socketio import SocketIO, emit, join_room, leave_room, close_room, rooms, disconnect
 from app.models.chat import Message
 
@@ -10,6 +10,7 @@ from app.core.db import db
 from app.models.network import Network
 from app.models.team import Team
 from app.utils.route import authenticated_only
+from app.utils.kernel import decode_cursor, encode_cursor, highlight
 from threading import Lock
 
 
@@ -23,7 +24,7 @@ socketio = app.extensions.get('socketio')
 @bp.route('/index')
 @login_required
 def index():
-    return render_template('chat.html')
+    return render_template('chat.html', teams=Team.sidebar_for(current_user))
 
 
 @bp.route('/team/<uuid:id>')
@@ -33,11 +34,59 @@ def team(id:uuid4):
     if not team.has_user(current_user):
         flash('Você não participa desse grupo, solicite ao administrador.', category='warning')
         return redirect(url_for('chat.index'))
-    session['room'] = str(team.id)
-    session['name'] = current_user.name
-    socketio.emit('join', { 'room': session['room']});
     team.add_view_message(current_user)
-    return render_template('chat.html', team=team, async_mode=socketio.async_mode)
+    messages = team.messages_before(limit=app.config.get('CHAT_PAGE_SIZE'))
+    return render_template('chat.html', team=team, teams=Team.sidebar_for(current_user),
+                           messages=messages[::-1], cursor=history_cursor(messages, app.config.get('CHAT_PAGE_SIZE')),
+                           async_mode=socketio.async_mode)
+
+
+@bp.route('/team/<uuid:id>/messages')
+@login_required
+def team_messages(id:uuid4):
+    team = Team.query.filter(Team.id == id).first_or_404()
+    if not team.has_user(current_user):
+        return jsonify(success=False, message='Você não participa desse grupo'), 403
+    limit = request.args.get('limit', app.config.get('CHAT_PAGE_SIZE'), type=int)
+    limit = max(1, min(limit, app.config.get('CHAT_PAGE_SIZE_MAX')))
+    before = request.args.get('before')
+    try:
+        before = None if before is None else decode_cursor(before)
+    except ValueError:
+        return jsonify(success=False, message='Cursor inválido'), 400
+    messages = team.messages_before(before, limit)
+    return jsonify(success=True, messages=[message.to_dict() for message in messages],
+                   cursor=history_cursor(messages, limit))
+
+
+@bp.route('/search')
+@login_required
+def search():
+    query = request.args.get('q', '')
+    team = None
+    if request.args.get('team'):
+        team = Team.query.filter(Team.id == request.args.get('team', type=UUID)).first_or_404()
+    limit = app.config.get('CHAT_PAGE_SIZE')
+    before = request.args.get('before')
+    try:
+        before = None if before is None else decode_cursor(before)
+    except ValueError:
+        return jsonify(success=False, message='Cursor inválido'), 400
+    messages = Message.search(current_user, query, team=team, before=before, limit=limit)
+    hits = []
+    for message in messages:
+        hit = message.to_dict()
+        hit.update({'team_id': str(message.team_id), 'team': message.team.name,
+                    'highlight': str(highlight(message.message, query.strip()))})
+        hits.append(hit)
+    return jsonify(success=True, messages=hits, cursor=history_cursor(messages, limit))
+
+
+def history_cursor(messages: list, limit: int):
+    """Cursor for the page after `messages` or None when there is no older message"""
+    if len(messages) < limit:
+        return None
+    return encode_cursor(messages[-1].create_at, messages[-1].id)
 
 
 
@@ -0,0 +1,18 @@
+from flask import Blueprint, jsonify, request
+from flask_login import login_required
+
+from app.core.costumersearch import costumer_search
+from app.models.base import BaseRole
+from app.utils.route import roles_accepted
+
+bp = Blueprint('costumer', __name__, url_prefix='/costumer')
+
+
+@bp.route('/search')
+@login_required
+@roles_accepted(BaseRole.SUPPORT, BaseRole.ADMIN)
+def search():
+    """Autocomplete of costumers by CPF, phone, email or part of the name, `q` is the typed text"""
+    limit = request.args.get('limit', None, type=int)
+    costumers = costumer_search.search(request.args.get('q', ''), limit)
+    return jsonify(success=True, costumers=costumers)
@@ -1,11 +1,17 @@
 from uuid import uuid4
 from flask import Blueprint, abort, jsonify, redirect, render_template, session, url_for, request, current_app as app, g
-from flask_login import login_required
-from flask_security import roles_accepted
+from flask_login import current_user, login_required
 from app.core.db import db
 from app.models.network import Network
-from app.utils.route import counter
-from app.core.extesions import login
+from app.utils.route import counter, roles_accepted
+from app.core.extesions import broadcaster, login, rate_limiter
+from app.models.base import BaseRole
+from app.core.hashing import hashing_pool
+from app.core.throttle import login_throttle
+from app.core.activity import activity_tracker
+from app.core.sessions import session_registry
+from app.core.usercache import user_cache
+from app.core.assignment import assignment_engine
 
 bp = Blueprint('main', __name__, url_prefix='/')
 
@@ -37,6 +43,8 @@ def before_app_request():
                 g.ip_id = ip.id
             else:
                 g.ip_id = ip.id
+        if current_user.is_authenticated:
+            activity_tracker.touch(current_user.id, session.get('login_session_id'))
 @bp.teardown_request
 def teardown_request(exception):
     if not exception is None:
@@ -78,4 +86,24 @@ def unauthorized():
 @login_required
 # @roles_accepted('admin', 'support')
 def adm():
-    return render_template('base/base.html')
\ No newline at end of file
+    return render_template('base/base.html')
+
+@bp.route('/stats/socket/')
+@login_required
+@roles_accepted(BaseRole.ADMIN)
+def socket_stats():
+    return jsonify(dict(rate_limiter.stats(), broadcast=broadcaster.stats()))
+
+@bp.route('/stats/auth/')
+@login_required
+@roles_accepted(BaseRole.ADMIN)
+def auth_stats():
+    return jsonify({'hashing': hashing_pool.report(), 'throttle': login_throttle.stats(),
+                    'activity': dict(activity_tracker.stats, pending=len(activity_tracker.users)),
+                    'sessions': session_registry.stats(), 'user_cache_fallbacks': dict(user_cache.fallbacks)})
+
+@bp.route('/stats/tickets/')
+@login_required
+@roles_accepted(BaseRole.ADMIN)
+def ticket_stats():
+    return jsonify({'assignment': assignment_engine.report()})
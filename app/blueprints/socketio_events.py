@@ -3,10 +3,17 @@ from flask_socketio import SocketIO, emit, join_room, leave_room, close_room, ro
 from flask import abort, copy_current_request_context, current_app as app, g, session, request, url_for
 from flask_login import current_user
 from app.models.chat import Message
+from app.models.security import User
 from app.models.network import Network
 from app.core.db import db
-
-from app.utils.route import authenticated_only
+from app.core.broadcast import static_url
+from app.core.extesions import broadcaster, message_writer, rate_limiter, room_registry
+from app.core.rooms import user_room
+from app.core.activity import activity_tracker
+from app.core.sessions import session_registry
+from uuid import UUID, uuid4
+
+from app.utils.route import authenticated_only, rate_limited
 from threading import Lock
 thread = None
 thread_lock = Lock()
@@ -22,80 +29,198 @@ def background_thread():
 
 
 
+def network_id():
+    """Id of the `Network` of the socket, cached in the session"""
+    if session.get('ip_id') is None:
+        ip = Network.query.filter(
+            Network.ip == request.remote_addr).first()
+        if ip is None:
+            ip = Network()
+            ip.ip = request.remote_addr
+            db.session.add(ip)
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(app.config.get(
+                    '_ERRORS').get('DB_COMMIT_ERROR'))
+                app.logger.error(e)
+                return None
+        session['ip_id'] = ip.id
+    return session['ip_id']
+
+
+@socketio.on('connect', namespace='/chat')
+def connected():
+    """Every socket of a user joins the user room, used by direct messages.
+    The unread direct messages are sent in one `inbox` event.
+    Sockets are attached to the active session, so a new login can disconnect them."""
+    if current_user.is_authenticated:
+        if not session_registry.add_sid(current_user.id, current_user.fs_uniquifier, request.sid):
+            return False
+        join_room(user_room(current_user.id))
+        activity_tracker.touch(current_user.id, session.get('login_session_id'))
+        inbox = Message.inbox(current_user)
+        if inbox:
+            emit('inbox', {'messages': [message.to_dict() for message in inbox],
+                           'unreaded': current_user.unreaded_messages})
+
+
 @socketio.on('joined', namespace='/chat')
 @authenticated_only
+@rate_limited('joined')
 def joined(message):
-    """Sent by clients when they enter a room.
-    A status message is broadcast to all people in the room."""
+    """Sent by clients when they enter a team room, with the `team_id`.
+    The membership is validated and a status message is broadcast to all people in the room."""
     if current_user.is_authenticated:
-        room = session.get('room')
-        name = session.get('name')
+        try:
+            team_id = UUID(str(message.get('team_id')))
+        except ValueError:
+            return False
+        if team_id not in current_user.team_ids:
+            return False
+        room = str(team_id)
+        for previous in room_registry.rooms_of(request.sid) - {room}:
+            leave_room(previous)
+            room_registry.leave(request.sid, previous)
         join_room(room)
-        emit('status', {'name':name}, room=room)
+        session['room'] = room
+        session['name'] = current_user.name
+        members = room_registry.join(request.sid, room)
+        emit('status', {'name': current_user.name, **room_registry.status(members)}, room=room)
+        return True
     else:
-        print("erro")
         return False
 
 
+@socketio.on('disconnect', namespace='/chat')
+def disconnected():
+    room_registry.disconnect(request.sid)
+    rate_limiter.forget(request.sid)
+    if current_user.is_authenticated:
+        session_registry.remove_sid(current_user.id, request.sid)
+
+
 @socketio.on('message_team', namespace='/chat')
 @authenticated_only
+@rate_limited('message_team')
 def text(message):
     """Sent by a client when the user entered a new message.
-    The message is sent to all people in the room."""
-    print(message)
+    The message is sent to all people in the room.
+    Returns an acknowledgement with `ok` and the `message_id`."""
     if current_user.is_authenticated:
-        if not hasattr(g, 'id_id'):
-            ip = Network.query.filter(
-                Network.ip == request.remote_addr).first()
-            if ip is None:
-                ip = Network()
-                ip.ip = request.remote_addr
-                db.session.add(ip)
-                try:
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    app.logger.error(app.config.get(
-                        '_ERRORS').get('DB_COMMIT_ERROR'))
-                    app.logger.error(e)
-                    return abort(500)
-                g.ip_id = ip.id
-            else:
-                g.ip_id = ip.id
+        if network_id() is None:
+            return {'ok': False}
         room = session.get('room')
-        msg = Message()
-        msg.message = message['data']
-        msg.create_network_id = g.ip_id
-        msg.user_sender_id = current_user.id
-        msg.team_id = session.get('room')
+        if room is None:
+            return {'ok': False}
+        # the id given by the client only correlates the acknowledgements, the row id is always new
+        client_id = str(message['id'])[:64] if message.get('id') else None
+        message_id = uuid4()
+        row = {'id': message_id,
+            'message': message['data'],
+            'create_network_id': session['ip_id'],
+            'user_sender_id': current_user.id,
+            'team_id': room,
+            'create_at': datetime.utcnow()}
+        if message_writer.enabled:
+            if not message_writer.put(row, request.sid, request.namespace, client_id):
+                return {'ok': False, 'message_id': str(message_id), 'client_id': client_id}
+        else:
+            try:
+                db.session.add(Message(**row))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+                app.logger.error(e)
+                return {'ok': False, 'message_id': str(message_id), 'client_id': client_id}
+        msg_dict = {'username': current_user.username,
+            'name': current_user.name,
+            'timestamp': row['create_at'].isoformat(),
+            'message_id': str(message_id),
+            'message': message['data'],
+            'avatar': static_url('images/profile.png')
+            }
+        sids = room_registry.sids(room)
+        slow = rate_limiter.slow_consumers(socketio.server, sids, request.namespace, 'message')
+        broadcaster.emit(socketio, 'message', msg_dict, room, request.namespace, len(sids) - len(slow), skip_sid=slow)
+        return {'ok': True, 'message_id': str(message_id), 'client_id': client_id}
+    else:
+        return False
+
+
+@socketio.on('direct_message', namespace='/chat')
+@authenticated_only
+@rate_limited('direct_message')
+def direct_message(message):
+    """Sent by a client with the recipient id in `to`.
+    The message is sent to every socket of the recipient and of the sender, recipients
+    that are offline receive it in the `inbox` of their next connection."""
+    if current_user.is_authenticated:
+        try:
+            to = UUID(str(message.get('to')))
+        except ValueError:
+            return {'ok': False}
+        client_id = str(message['id'])[:64] if message.get('id') else None
+        message_id = uuid4()
+        if to == current_user.id or network_id() is None:
+            return {'ok': False}
+        recipient = User.query.filter(User.id == to, User.active.is_(True)).first()
+        if recipient is None:
+            return {'ok': False}
+        direct = Message(id=message_id,
+            message=message['data'],
+            create_network_id=session['ip_id'],
+            user_sender_id=current_user.id,
+            user_destiny_id=recipient.id,
+            create_at=datetime.utcnow())
+        db.session.add(direct)
         try:
-            db.session.add(msg)
             db.session.commit()
         except Exception as e:
+            db.session.rollback()
             app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
             app.logger.error(e)
-            raise Exception('Não foi possível salvar a mensagem')
-        msg_dict = {'username': current_user.username,
-            'name': current_user.name,
-            'timestamp': datetime.utcnow().isoformat(),
-            'message_id': str(msg.id),
-            'message': message['data'],
-            'avatar': url_for("static", filename="images/profile.png")
-            }
-        emit('message', msg_dict, room=room)
+            return {'ok': False, 'message_id': str(message_id), 'client_id': client_id}
+        payload = dict(direct.to_dict(), to=str(recipient.id))
+        emit('direct_message', payload, to=[user_room(recipient.id), user_room(current_user.id)])
+        return {'ok': True, 'message_id': str(message_id), 'client_id': client_id}
+    else:
+        return False
+
+
+@socketio.on('read_direct', namespace='/chat')
+@authenticated_only
+def read_direct(message):
+    """Sent by a client with the `ids` of the direct messages it displayed.
+    Returns the number of unread direct messages left."""
+    if current_user.is_authenticated:
+        try:
+            ids = [UUID(str(id)) for id in message.get('ids', [])[:100]]
+        except ValueError:
+            return False
+        try:
+            Message.mark_read(current_user, ids)
+        except Exception:
+            return False
+        return {'unreaded': current_user.unreaded_messages}
     else:
         return False
 
 
 @socketio.on('left', namespace='/chat')
-# @authenticated_only
+@authenticated_only
 def left(message):
     """Sent by clients when they leave a room.
     A status message is broadcast to all people in the room."""
     if current_user.is_authenticated:
-        room = session.get('room')
+        room = session.pop('room', None)
+        if room is None:
+            return False
         leave_room(room)
-        emit('status', {'msg': f"{session.get('name')}  has left the room."}, room=room)
+        members = room_registry.leave(request.sid, room)
+        emit('status', {'msg': f"{current_user.name}  has left the room.", **room_registry.status(members)}, room=room)
     else:
         return False
 
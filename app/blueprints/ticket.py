@@ -11,7 +11,6 @@ from flask import (
     current_app as app,
 )
 from flask_login import current_user, login_required
-from flask_security import roles_accepted
 from uuid import uuid4
 from app.models.ticket import Ticket, TicketStage, TicketStageEvent
 
@@ -19,6 +18,7 @@ from app.core.db import db
 from app.models.network import Network
 from app.models.team import Team
 from app.models.base import BaseRole
+from app.utils.route import roles_accepted
 bp = Blueprint("ticket", __name__, url_prefix="/ticket")
 
 
@@ -0,0 +1,105 @@
+import atexit
+from datetime import datetime
+from threading import Lock
+from typing import Optional
+import uuid
+
+from flask import Flask
+from sqlalchemy.dialects.postgresql import UUID
+
+from app.core.db import db
+
+
+class ActivityTracker(object):
+    """Coalesces `User.last_seen` and `LoginSession.last_seen_at` updates.
+
+    Requests and socket events only record the time in memory, a background
+    task writes the latest time of each user and session every
+    `ACTIVITY_FLUSH_INTERVAL` seconds with one UPDATE per table.
+    """
+
+    def __init__(self) -> None:
+        self.app = None
+        self.lock = Lock()
+        self.users = {}
+        self.sessions = {}
+        self.interval = 30
+        self.enabled = False
+        self.stats = {'touches': 0, 'flushes': 0, 'users': 0, 'sessions': 0, 'failed': 0}
+
+    def init_app(self, app: Flask, socketio) -> None:
+        self.app = app
+        self.interval = app.config.get('ACTIVITY_FLUSH_INTERVAL', self.interval)
+        self.enabled = app.config.get('ACTIVITY_TRACKER', True)
+        if self.enabled:
+            socketio.start_background_task(self._run, socketio)
+            atexit.register(self.shutdown)
+
+    def touch(self, user_id: uuid.UUID, session_id: Optional[uuid.UUID] = None) -> None:
+        """Record that `user_id` and its `LoginSession` were seen now"""
+        if not self.enabled:
+            return
+        now = datetime.utcnow()
+        with self.lock:
+            self.users[user_id] = now
+            if session_id is not None:
+                self.sessions[uuid.UUID(str(session_id))] = now
+            self.stats['touches'] += 1
+
+    def flush(self) -> int:
+        """Write the pending times, returns the number of users updated"""
+        with self.lock:
+            users, self.users = self.users, {}
+            sessions, self.sessions = self.sessions, {}
+        if not users and not sessions:
+            return 0
+        from app.models.security import LoginSession, User
+
+        try:
+            if users:
+                db.session.execute(self._update(User.__table__, 'last_seen', users))
+            if sessions:
+                db.session.execute(self._update(LoginSession.__table__, 'last_seen_at', sessions))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.error(self.app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+            self.app.logger.error(e)
+            self.stats['failed'] += 1
+            with self.lock:
+                for pending, flushed in ((self.users, users), (self.sessions, sessions)):
+                    for key, seen in flushed.items():
+                        pending.setdefault(key, seen)
+            return 0
+        self.stats['flushes'] += 1
+        self.stats['users'] += len(users)
+        self.stats['sessions'] += len(sessions)
+        return len(users)
+
+    @staticmethod
+    def _update(table, column: str, times: dict):
+        values = db.values(
+            db.column('id', UUID(as_uuid=True)),
+            db.column('seen', db.DateTime(timezone=True)),
+            name='seen',
+        ).data(list(times.items()))
+        return (
+            db.update(table)
+            .where(table.c.id == values.c.id)
+            .values({column: db.func.greatest(table.c[column], values.c.seen),
+                     'update_at': table.c.update_at})
+        )
+
+    def shutdown(self) -> None:
+        if self.app is not None:
+            with self.app.app_context():
+                self.flush()
+
+    def _run(self, socketio) -> None:
+        while True:
+            socketio.sleep(self.interval)
+            with self.app.app_context():
+                self.flush()
+
+
+activity_tracker = ActivityTracker()
@@ -0,0 +1,273 @@
+from collections import Counter, OrderedDict
+from threading import Lock
+from typing import Iterable, Optional
+import uuid
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.utils.kernel import only_numbers
+
+PENDING_KEY = 'address_pending'
+
+STATES = {
+    'AC': 'Acre',
+    'AL': 'Alagoas',
+    'AP': 'Amapá',
+    'AM': 'Amazonas',
+    'BA': 'Bahia',
+    'CE': 'Ceará',
+    'DF': 'Distrito Federal',
+    'ES': 'Espírito Santo',
+    'GO': 'Goiás',
+    'MA': 'Maranhão',
+    'MT': 'Mato Grosso',
+    'MS': 'Mato Grosso do Sul',
+    'MG': 'Minas Gerais',
+    'PA': 'Pará',
+    'PB': 'Paraíba',
+    'PR': 'Paraná',
+    'PE': 'Pernambuco',
+    'PI': 'Piauí',
+    'RJ': 'Rio de Janeiro',
+    'RN': 'Rio Grande do Norte',
+    'RS': 'Rio Grande do Sul',
+    'RO': 'Rondônia',
+    'RR': 'Roraima',
+    'SC': 'Santa Catarina',
+    'SP': 'São Paulo',
+    'SE': 'Sergipe',
+    'TO': 'Tocantins',
+}
+
+# lengths of `AddressType.type`, `Address.name` and `City.city`
+MAX_LENGTHS = {'type': 32, 'name': 128, 'city': 256}
+MAX_NUMBER = 2 ** 31 - 1
+LOWER_WORDS = {'a', 'as', 'da', 'das', 'de', 'di', 'do', 'dos', 'e', 'o', 'os'}
+
+
+def title_case(value: str) -> str:
+    """`value` capitalized word by word, with the linking words in lower case: 'RIO DE JANEIRO' -> 'Rio de Janeiro'"""
+    return ' '.join(
+        word if idx and word in LOWER_WORDS else word[:1].upper() + word[1:]
+        for idx, word in enumerate(value.lower().split(' '))
+    )
+
+
+def fold(key: tuple) -> tuple:
+    """Case-insensitive form of a key of `AddressResolver`"""
+    return tuple(value.lower() if isinstance(value, str) else value for value in key)
+
+
+def normalize_address(row: dict) -> dict:
+    """Normalized copy of an address with `postcode`, `type`, `name`, `number`, `city` and `uf`
+
+    The address type and the city are title cased, so the same reference row
+    is used whatever the case of the input.
+
+    Raises:
+        ValueError: when a field is missing, too long or invalid, with the message for the user
+    """
+    postcode = only_numbers(row.get('postcode') or '')
+    if len(postcode) != 8:
+        raise ValueError('CEP inválido')
+    uf = (row.get('uf') or '').strip().upper()
+    if uf not in STATES:
+        raise ValueError('UF inválida')
+    fields = {key: ' '.join((row.get(key) or '').split()) for key in ('type', 'name', 'city')}
+    for key, message in (('type', 'Tipo de endereço vazio'), ('name', 'Logradouro vazio'), ('city', 'Cidade vazia')):
+        if not fields[key]:
+            raise ValueError(message)
+    fields['type'], fields['city'] = title_case(fields['type']), title_case(fields['city'])
+    for key, message in (('type', 'Tipo de endereço muito longo'), ('name', 'Logradouro muito longo'),
+                         ('city', 'Cidade muito longa')):
+        if len(fields[key]) > MAX_LENGTHS[key]:
+            raise ValueError(message)
+    number = int(only_numbers(str(row.get('number') or '')) or 0)
+    if number > MAX_NUMBER:
+        raise ValueError('Número inválido')
+    return dict(fields, postcode=postcode, uf=uf, number=number)
+
+
+class AddressResolver(object):
+    """Ids of the address reference rows: postcodes, states, cities and address types.
+
+    The id of each key is kept in memory, so resolving the addresses of a
+    form or of an import chunk makes no query when the keys were seen before.
+    The missing keys of a whole batch are selected with one query per table
+    and the ones that do not exist are created with one upsert per table.
+    Ids of rows created in a transaction are only kept after it commits.
+    Each map keeps the `ADDRESS_CACHE_SIZE` keys used most recently. Keys are
+    normalized by `normalize_address` and rows created with other cases
+    before are matched ignoring case.
+    """
+
+    KINDS = ('state', 'postcode', 'type', 'city')
+
+    def __init__(self, size: int = 100000) -> None:
+        self.size = size
+        self.lock = Lock()
+        self.maps = {kind: OrderedDict() for kind in self.KINDS}
+        self.stats = Counter()
+
+    def init_app(self, app: Flask) -> None:
+        self.size = app.config.get('ADDRESS_CACHE_SIZE', self.size)
+
+    @staticmethod
+    def _tables() -> dict:
+        """(table, key columns, values of a new row) of each kind"""
+        from app.models.location import AddressPostcode, AddressType, City, StateLocation
+
+        return {
+            'state': (StateLocation.__table__, ('uf',), lambda key: {'uf': key[0], 'state': STATES[key[0]]}),
+            'postcode': (AddressPostcode.__table__, ('_code',), lambda key: {'_code': key[0]}),
+            'type': (AddressType.__table__, ('type',), lambda key: {'type': key[0]}),
+            'city': (City.__table__, ('city', 'uf_id'), lambda key: {'city': key[0], 'uf_id': key[1]}),
+        }
+
+    def _cached(self, session, kind: str, key: tuple) -> Optional[uuid.UUID]:
+        id = self.maps[kind].get(key)
+        if id is not None:
+            with self.lock:
+                if key in self.maps[kind]:
+                    self.maps[kind].move_to_end(key)
+            return id
+        return session.info.get(PENDING_KEY, {}).get((kind, key))
+
+    def remember(self, kind: str, ids: dict) -> None:
+        with self.lock:
+            entries = self.maps[kind]
+            entries.update(ids)
+            for key in ids:
+                entries.move_to_end(key)
+            while len(entries) > self.size:
+                entries.popitem(last=False)
+
+    def _ids(self, kind: str, keys: Iterable[tuple]) -> dict:
+        """{key: id} of `keys` of `kind`, the missing ones selected or created"""
+        from app.core.db import db
+
+        session = db.session()
+        ids, missing = {}, set()
+        for key in set(keys):
+            id = self._cached(session, kind, key)
+            if id is None:
+                missing.add(key)
+            else:
+                ids[key] = id
+        self.stats['hits'] += len(ids)
+        if not missing:
+            return ids
+        self.stats['misses'] += len(missing)
+        table, columns, values = self._tables()[kind]
+        key_columns = [table.c[column] for column in columns]
+        found = self._select(table, key_columns, missing)
+        self.remember(kind, found)
+        ids.update(found)
+        missing -= found.keys()
+        if missing:
+            from sqlalchemy.dialects.postgresql import insert
+
+            created = {
+                tuple(row[1:]): row[0]
+                for row in db.session.execute(
+                    insert(table)
+                    .values([values(key) for key in missing])
+                    .on_conflict_do_nothing(index_elements=list(columns))
+                    .returning(table.c.id, *key_columns)
+                )
+            }
+            self.stats['created'] += len(created)
+            pending = session.info.setdefault(PENDING_KEY, {})
+            pending.update({(kind, key): id for key, id in created.items()})
+            ids.update(created)
+            missing -= created.keys()
+        if missing:
+            # created by another transaction after the select
+            found = self._select(table, key_columns, missing)
+            self.remember(kind, found)
+            ids.update(found)
+        return ids
+
+    @staticmethod
+    def _select(table, key_columns: list, keys: set) -> dict:
+        """{key: id} of the rows of `keys`, text columns are compared ignoring case"""
+        from app.core.db import db
+
+        folded = {fold(key): key for key in keys}
+        columns = [db.func.lower(column) if isinstance(column.type, db.String) else column for column in key_columns]
+        query = db.select(table.c.id, *key_columns).where(db.tuple_(*columns).in_(list(folded)))
+        found = {}
+        for row in db.session.execute(query):
+            key = folded.get(fold(tuple(row[1:])))
+            if key is not None:
+                found.setdefault(key, row[0])
+        return found
+
+    def resolve(self, addresses: list) -> list:
+        """Rows of the `address` table of `addresses`, normalized by `normalize_address`
+
+        Raises:
+            ValueError: when an address is invalid
+        """
+        addresses = [normalize_address(address) for address in addresses]
+        states = self._ids('state', {(address['uf'],) for address in addresses})
+        postcodes = self._ids('postcode', {(address['postcode'],) for address in addresses})
+        types = self._ids('type', {(address['type'],) for address in addresses})
+        cities = self._ids('city', {(address['city'], states[(address['uf'],)]) for address in addresses})
+        return [
+            {
+                'name': address['name'],
+                '_number': address['number'],
+                'postcode_id': postcodes[(address['postcode'],)],
+                'address_type_id': types[(address['type'],)],
+                'city_id': cities[(address['city'], states[(address['uf'],)])],
+            }
+            for address in addresses
+        ]
+
+    def create(self, addresses: list) -> list:
+        """Insert `addresses` with one executemany, the caller commits
+
+        Returns:
+            list: ids of the new addresses, in the order of `addresses`
+        """
+        from datetime import datetime
+
+        from app.core.db import db
+        from app.models.location import Address
+
+        now = datetime.utcnow()
+        rows = [dict(row, id=uuid.uuid4(), create_at=now) for row in self.resolve(addresses)]
+        if rows:
+            db.session.execute(db.insert(Address.__table__), rows)
+        return [row['id'] for row in rows]
+
+    def clear(self) -> None:
+        with self.lock:
+            for entries in self.maps.values():
+                entries.clear()
+
+    def report(self) -> dict:
+        return dict(self.stats, **{kind: len(entries) for kind, entries in self.maps.items()})
+
+
+address_resolver = AddressResolver()
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_created(session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if not pending:
+        return
+    by_kind = {}
+    for (kind, key), id in pending.items():
+        by_kind.setdefault(kind, {})[key] = id
+    for kind, ids in by_kind.items():
+        address_resolver.remember(kind, ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_created(session):
+    session.info.pop(PENDING_KEY, None)
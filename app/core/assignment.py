@@ -0,0 +1,220 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import count
+from threading import Lock
+from time import monotonic
+from typing import Callable, Optional
+import uuid
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+PENDING_KEY = 'assignment_pending'
+RESERVED_KEY = 'assignment_reserved'
+
+
+def load_routes() -> dict:
+    """Active teams of each service, through `GroupServiceTeam`, and the active members of each team"""
+    from app.core.db import db
+    from app.models.security import User
+    from app.models.service import GroupServiceTeam, Service
+    from app.models.team import Team, UserTeam
+
+    services = {}
+    for service_id, team_id in (
+        db.session.query(Service.id, GroupServiceTeam.team_id)
+        .join(GroupServiceTeam, GroupServiceTeam.group_id == Service.group_id)
+        .join(Team, Team.id == GroupServiceTeam.team_id)
+        .filter(Team.active.is_(True))
+        .distinct()
+    ):
+        services.setdefault(service_id, []).append(team_id)
+    members = {}
+    for team_id, user_id in (
+        db.session.query(UserTeam.team_id, UserTeam.user_id)
+        .join(User, User.id == UserTeam.user_id)
+        .filter(User.active.is_(True))
+        .distinct()
+    ):
+        members.setdefault(team_id, []).append(user_id)
+    return {'services': {k: tuple(v) for k, v in services.items()},
+            'members': {k: tuple(v) for k, v in members.items()}}
+
+
+def load_open_counts() -> Counter:
+    """Open stage events of each user"""
+    from app.core.db import db
+    from app.models.ticket import TicketStageEvent
+
+    return Counter(dict(
+        db.session.query(TicketStageEvent.user_id, db.func.count(TicketStageEvent.id))
+        .filter(TicketStageEvent.user_id.isnot(None), TicketStageEvent._closed.is_(False))
+        .group_by(TicketStageEvent.user_id)
+    ))
+
+
+class AssignmentEngine(object):
+    """Assigns new tickets to the least loaded active member of the teams of their service.
+
+    The routing table (service -> teams -> members) and the open stage events
+    of each user are loaded once and kept in memory, so choosing an agent is a
+    few dictionary lookups. Counters follow the `TicketStageEvent` changes
+    committed in this worker and both tables are reloaded every
+    `ASSIGNMENT_ROUTES_TTL` seconds to pick up changes made by other workers.
+    Ties go to the agent that received a ticket least recently.
+    """
+
+    def __init__(self, routes_loader: Optional[Callable] = None, counts_loader: Optional[Callable] = None,
+                 ttl: Optional[float] = 60) -> None:
+        self.routes_loader = routes_loader or load_routes
+        self.counts_loader = counts_loader or load_open_counts
+        self.ttl = ttl
+        self.lock = Lock()
+        self.table = None
+        self.stage_id = None
+        self.counts = None
+        self.loaded_at = 0.0
+        self.last_assigned = {}
+        self.sequence = count(1)
+        self.stage_name = 'Vinculado'
+        self.deadline = timedelta(days=7)
+        self.enabled = True
+        self.stats = Counter()
+
+    def init_app(self, app: Flask) -> None:
+        self.ttl = app.config.get('ASSIGNMENT_ROUTES_TTL', self.ttl)
+        self.stage_name = app.config.get('ASSIGNMENT_STAGE', self.stage_name)
+        self.deadline = timedelta(days=app.config.get('ASSIGNMENT_DEADLINE_DAYS', 7))
+        self.enabled = app.config.get('TICKET_AUTO_ASSIGN', self.enabled)
+
+    def _load(self) -> None:
+        if self.table is not None and (self.ttl is None or monotonic() - self.loaded_at < self.ttl):
+            return
+        table, counts = self.routes_loader(), self.counts_loader()
+        with self.lock:
+            self.table, self.counts, self.loaded_at = table, counts, monotonic()
+            self.stage_id = None
+        self.stats['loads'] += 1
+
+    def invalidate(self) -> None:
+        """Reload the routing table and the counters on the next assignment"""
+        with self.lock:
+            self.table = None
+
+    def choose(self, service_id: uuid.UUID) -> Optional[tuple]:
+        """Reserve the least loaded member of the teams of `service_id`
+
+        Returns:
+            (team_id, user_id) or None when the service has no active member
+        """
+        self._load()
+        with self.lock:
+            best = None
+            for team_id in self.table['services'].get(service_id, ()):
+                for user_id in self.table['members'].get(team_id, ()):
+                    key = (self.counts[user_id], self.last_assigned.get(user_id, 0))
+                    if best is None or key < best[0]:
+                        best = (key, team_id, user_id)
+            if best is None:
+                self.stats['unrouted'] += 1
+                return None
+            _, team_id, user_id = best
+            self.counts[user_id] += 1
+            self.last_assigned[user_id] = next(self.sequence)
+        self.stats['assigned'] += 1
+        return team_id, user_id
+
+    def release(self, user_id: uuid.UUID, amount: int = 1) -> None:
+        with self.lock:
+            if self.counts is not None:
+                self.counts[user_id] = max(self.counts[user_id] - amount, 0)
+
+    def add(self, user_id: uuid.UUID, amount: int = 1) -> None:
+        with self.lock:
+            if self.counts is not None:
+                self.counts[user_id] += amount
+
+    def reserve(self, ticket) -> Optional[tuple]:
+        """Choose the agent of the new `ticket`, runs in `before_flush` where the session may be queried
+
+        The choice is kept in the ticket and turned into its `TicketStageEvent`
+        by `assign` once the ticket is inserted.
+
+        Returns:
+            (stage_id, team_id, user_id) or None when the ticket is not assigned
+        """
+        from app.core.db import db
+        from app.models.ticket import TicketStage
+
+        ticket._assignment = None
+        if not self.enabled:
+            return None
+        choice = self.choose(ticket.service_id)
+        if choice is None:
+            return None
+        team_id, user_id = choice
+        if self.stage_id is None:
+            self.stage_id = db.session.query(TicketStage.id).filter(TicketStage.name == self.stage_name).scalar()
+        if self.stage_id is None:
+            self.release(user_id)
+            return None
+        ticket._assignment = (self.stage_id, team_id, user_id)
+        reserve_until_commit(ticket, user_id)
+        return ticket._assignment
+
+    def assign(self, ticket) -> Optional["TicketStageEvent"]:
+        """`TicketStageEvent` of the agent reserved for `ticket`, built without queries and added by the caller"""
+        from app.models.ticket import TicketStageEvent
+
+        reserved = getattr(ticket, '_assignment', None)
+        if reserved is None:
+            return None
+        stage_id, team_id, user_id = reserved
+        ticket._assignment = None
+        tse = TicketStageEvent(ticket_stage=stage_id, ticket=ticket,
+                               deadline=datetime.utcnow() + self.deadline, info='')
+        tse.team_id = team_id
+        tse.user_id = user_id
+        tse._assignment_reserved = True
+        return tse
+
+    def report(self) -> dict:
+        load = sorted(self.counts.values()) if self.counts else []
+        return dict(self.stats, agents=len(load), min_open=load[0] if load else 0,
+                    max_open=load[-1] if load else 0)
+
+
+assignment_engine = AssignmentEngine()
+
+
+def reserve_until_commit(target, user_id: uuid.UUID) -> None:
+    """Keep the reservation of `user_id` while the session of `target` is open, release it on rollback"""
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(RESERVED_KEY, []).append(user_id)
+
+
+def count_after_commit(target, user_id: Optional[uuid.UUID], amount: int) -> None:
+    """Add `amount` to the open events of `user_id` once the session of `target` commits"""
+    if user_id is None:
+        return
+    session = object_session(target)
+    if session is None:
+        assignment_engine.add(user_id, amount)
+        return
+    session.info.setdefault(PENDING_KEY, []).append((user_id, amount))
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_counts(session):
+    session.info.pop(RESERVED_KEY, None)
+    for user_id, amount in session.info.pop(PENDING_KEY, ()):
+        assignment_engine.add(user_id, amount)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_counts(session):
+    session.info.pop(PENDING_KEY, None)
+    for user_id in session.info.pop(RESERVED_KEY, ()):
+        assignment_engine.release(user_id)
@@ -0,0 +1,96 @@
+from collections import Counter
+from functools import lru_cache
+from threading import Lock
+from typing import Optional
+
+from flask import Flask, request, url_for
+from socketio import packet
+
+
+@lru_cache(maxsize=64)
+def _static_url(script_root: str, filename: str) -> str:
+    return url_for('static', filename=filename)
+
+
+def static_url(filename: str) -> str:
+    """`url_for('static')` cached by the script root of the current request"""
+    return _static_url(request.script_root, filename)
+
+
+def encoded_size(encoded) -> int:
+    if isinstance(encoded, list):
+        return sum(encoded_size(part) for part in encoded)
+    if isinstance(encoded, str):
+        return len(encoded.encode('utf-8'))
+    return len(encoded)
+
+
+class Broadcaster(object):
+    """Room broadcasts of chat events and the bytes they put on the wire.
+
+    The Socket.IO manager encodes one packet per room emit and sends the same
+    frames to every member, so the payload is built once here and handed to a
+    single `emit`. `SOCKETIO_SERIALIZER` selects the packet encoding, `default`
+    (JSON) or `msgpack`, the packet class is wrapped to count the encoded size
+    of each event.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.counters = Counter()
+
+    def init_app(self, app: Flask) -> dict:
+        """Return the `socketio.init_app` options of the configured serializer"""
+        serializer = app.config.get('SOCKETIO_SERIALIZER', 'default')
+        if serializer == 'msgpack':
+            from socketio.msgpack_packet import MsgPackPacket
+            base = MsgPackPacket
+        elif serializer == 'default':
+            base = packet.Packet
+        else:
+            raise ValueError(f'Serializer {serializer} não suportado')
+        return {'serializer': self.packet_class(base)}
+
+    def packet_class(self, base: type) -> type:
+        broadcaster = self
+
+        class MeteredPacket(base):
+            def encode(self):
+                encoded = super().encode()
+                if self.packet_type in (packet.EVENT, packet.BINARY_EVENT) and self.data:
+                    broadcaster.record_encoded(self.data[0], encoded_size(encoded))
+                return encoded
+
+        return MeteredPacket
+
+    def record_encoded(self, event: str, size: int) -> None:
+        with self.lock:
+            self.counters[f'{event}.encoded'] += 1
+            self.counters[f'{event}.bytes'] += size
+
+    def emit(self, socketio, event: str, payload: dict, room: str, namespace: str,
+             recipients: int, skip_sid: Optional[list] = None) -> None:
+        """Emit `payload` to `room` once, `recipients` is the number of sockets reached"""
+        socketio.emit(event, payload, to=room, namespace=namespace, skip_sid=skip_sid or None)
+        with self.lock:
+            self.counters[f'{event}.emitted'] += 1
+            self.counters[f'{event}.recipients'] += recipients
+
+    def stats(self) -> dict:
+        """Encoded bytes per message and the estimated bytes sent to the recipients"""
+        with self.lock:
+            counters = dict(self.counters)
+        events = {}
+        for key in counters:
+            event = key.rsplit('.', 1)[0]
+            if event in events:
+                continue
+            encoded = counters.get(f'{event}.encoded', 0)
+            size = counters.get(f'{event}.bytes', 0) / encoded if encoded else 0
+            events[event] = {
+                'emitted': counters.get(f'{event}.emitted', 0),
+                'recipients': counters.get(f'{event}.recipients', 0),
+                'bytes_per_message': round(size, 1),
+                'wire_bytes': round(size * counters.get(f'{event}.recipients', 0)),
+            }
+        return events
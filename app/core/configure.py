@@ -8,7 +8,18 @@ from os.path import exists
 from os import mkdir
 
 from app.blueprints import register_blueprints
-from app.core.extesions import csrf, login, migrate, security, socketio, uuid
+from app.core.extesions import broadcaster, csrf, login, message_writer, migrate, rate_limiter, room_registry, security, socketio, uuid
+from app.core.pubsub import socketio_options
+from app.core.membership import membership_index
+from app.core.store import shared_store
+from app.core.hashing import hashing_pool
+from app.core.throttle import login_throttle
+from app.core.usercache import user_cache
+from app.core.activity import activity_tracker
+from app.core.sessions import session_registry
+from app.core.assignment import assignment_engine
+from app.core.costumersearch import costumer_search
+from app.core.addresses import address_resolver
 
 # from app.models.network import Network
 # from app.models.page import Page, Visit
@@ -17,6 +28,7 @@ from app.core.extesions import csrf, login, migrate, security, socketio, uuid
 # from app.models.contact import Contact
 from app.core.db import db, user_datastore
 from app.models import get_class_models #dict of models
+from app.utils.datetime import format_elapsed_time
 
 
 login.login_view = 'auth.login'
@@ -34,7 +46,21 @@ def init(app: Flask):
     login.init_app(app)
     login.session_protection = 'strong'
     uuid.init_app(app)
-    socketio.init_app(app, async_mode=async_mode)
+    socketio.init_app(app, async_mode=async_mode, **socketio_options(app.config), **broadcaster.init_app(app))
+    app.add_template_filter(format_elapsed_time, 'elapsed')
+    message_writer.init_app(app, socketio)
+    membership_index.init_app(app)
+    room_registry.init_app(app)
+    rate_limiter.init_app(app)
+    hashing_pool.init_app(app, socketio.async_mode)
+    shared_store.init_app(app)
+    user_cache.init_app(app, shared_store)
+    login_throttle.init_app(app)
+    activity_tracker.init_app(app, socketio)
+    session_registry.init_app(app, socketio)
+    assignment_engine.init_app(app)
+    costumer_search.init_app(app)
+    address_resolver.init_app(app)
     @app.shell_context_processor
     @with_appcontext
     def shell_context():
@@ -61,10 +87,10 @@ def init(app: Flask):
     def load_user(session_token):
         if not session_token is None:
             try:
-                from app.models.security import User
-                user = User.query.filter_by(fs_uniquifier=session_token).first()
-                if not user is None:
-                    from flask import session
+                # the snapshot versions and the registry entry come in one store round trip
+                user, values = user_cache.lookup(session_token, lambda user_id: [session_registry.key(user_id)])
+                if user is not None and not session_registry.accepts(values.get(session_registry.key(user.id)), session_token):
+                    return None
             except Exception as e:
                 db.session.rollback()
                 app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
@@ -0,0 +1,312 @@
+import csv
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from re import compile as re_compile
+from typing import Iterable, Iterator, Optional
+import uuid
+
+from app.core.addresses import normalize_address
+from app.utils.kernel import only_numbers, search_text, validate_phone
+
+EMAIL = re_compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+CPF_WEIGHTS_1 = list(range(10, 1, -1))
+CPF_WEIGHTS_2 = list(range(11, 1, -1))
+
+
+def cpf_valid(values: list):
+    """Vectorized `validate_cpf`, one boolean per value of `values`
+
+    Args:
+        values (list): CPFs formated as 000.000.000-00 or only numbers
+
+    Returns:
+        numpy.ndarray: True where the value is a valid CPF
+    """
+    import numpy as np
+
+    cpfs = [only_numbers(value or '') for value in values]
+    valid = np.array([len(cpf) == 11 for cpf in cpfs], dtype=bool)
+    if not valid.any():
+        return valid
+    digits = np.frombuffer(''.join(cpf for cpf, ok in zip(cpfs, valid) if ok).encode(), dtype=np.uint8)
+    digits = (digits - ord('0')).astype(np.int64).reshape(-1, 11)
+    first = (digits[:, :9] @ np.array(CPF_WEIGHTS_1)) * 10 % 11 % 10
+    second = (digits[:, :10] @ np.array(CPF_WEIGHTS_2)) * 10 % 11 % 10
+    repeated = (digits == digits[:, :1]).all(axis=1)
+    valid[valid] = (first == digits[:, 9]) & (second == digits[:, 10]) & ~repeated
+    return valid
+
+
+def normalize_phone(value: Optional[str]):
+    """Only the numbers of a valid phone, None when it is empty and False when it is invalid"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    return only_numbers(value) if validate_phone(value) else False
+
+
+def normalize_uuid(value: Optional[str]):
+    """UUID of `value`, None when it is empty and False when it is invalid"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        return False
+
+
+def parse_chunk(rows: list) -> tuple:
+    """Normalize and validate a chunk of (line, row) of the CSV, runs in the process pool
+
+    Returns:
+        tuple: (accepted rows, rejects as (line, reason, row))
+    """
+    accepted, rejects = [], []
+    for (line, row), cpf_ok in zip(rows, cpf_valid([row.get('cpf') for _, row in rows])):
+        name = ' '.join((row.get('name') or '').split())
+        email = (row.get('email') or '').strip().lower()
+        phone_principal = normalize_phone(row.get('phone'))
+        phone_secondary = normalize_phone(row.get('phone_secondary'))
+        address_id = normalize_uuid(row.get('address_id'))
+        address, address_error = None, None
+        if not address_id and (row.get('postcode') or '').strip():
+            try:
+                address = normalize_address({'postcode': row.get('postcode'), 'type': row.get('address_type'),
+                                             'name': row.get('address'), 'number': row.get('number'),
+                                             'city': row.get('city'), 'uf': row.get('uf')})
+            except ValueError as e:
+                address_error = str(e)
+        if not name:
+            reason = 'Nome vazio'
+        elif not cpf_ok:
+            reason = 'CPF inválido'
+        elif not EMAIL.match(email):
+            reason = 'Email inválido'
+        elif phone_principal is False or phone_secondary is False:
+            reason = 'Telefone inválido'
+        elif address_id is False:
+            reason = 'Endereço inválido'
+        elif address_error is not None:
+            reason = address_error
+        else:
+            accepted.append({
+                'line': line,
+                'name': name,
+                'search_name': search_text(name),
+                'identifier': only_numbers(row['cpf']),
+                'email': email,
+                'phone_principal': phone_principal,
+                'phone_secondary': phone_secondary,
+                'address_id': address_id,
+                'address': address,
+                'row': row,
+            })
+            continue
+        rejects.append((line, reason, row))
+    return accepted, rejects
+
+
+def read_chunks(path: str, size: int) -> Iterator[list]:
+    """(line, row) of the CSV at `path` in lists of `size`, the header is line 1"""
+    with open(path, newline='', encoding='utf-8') as file:
+        chunk = []
+        for line, row in enumerate(csv.DictReader(file), start=2):
+            chunk.append((line, row))
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def parse_parallel(chunks: Iterable[list], workers: int) -> Iterator[tuple]:
+    """`parse_chunk` of each chunk in a pool of `workers` processes, in order, at most two chunks per worker in flight"""
+    if workers <= 1:
+        yield from map(parse_chunk, chunks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(parse_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class Deduplicator(object):
+    """Unique keys of `Costumer` and `Contact` already used, in the database or earlier in the file"""
+
+    KEYS = (('identifier', 'CPF'), ('email', 'Email'), ('phone_principal', 'Telefone'), ('phone_secondary', 'Telefone'))
+
+    def __init__(self, identifiers: Iterable = (), emails: Iterable = (), phones: Iterable = ()) -> None:
+        self.existing = {'identifier': set(identifiers), 'email': set(emails), 'phone': set(phones)}
+        self.seen = {'identifier': set(), 'email': set(), 'phone': set()}
+
+    @classmethod
+    def from_database(cls) -> 'Deduplicator':
+        from app.core.db import db
+        from app.models.contact import Contact
+        from app.models.costumer import Costumer
+
+        phones = set()
+        for principal, secondary in db.session.query(Contact._phone_principal, Contact._phone_secondary):
+            phones.update(phone for phone in (principal, secondary) if phone)
+        return cls(
+            identifiers=(value for value, in db.session.query(Costumer._identifier)),
+            emails=(value for value, in db.session.query(db.func.lower(Contact.email))),
+            phones=phones,
+        )
+
+    def check(self, row: dict) -> Optional[str]:
+        """Reason to reject `row` or None, the keys of an accepted row are taken"""
+        values = {}
+        for key, label in self.KEYS:
+            value = row[key]
+            if not value:
+                continue
+            kind = 'phone' if key.startswith('phone') else key
+            if value in self.existing[kind]:
+                return f'{label} já cadastrado'
+            if value in self.seen[kind] or value in values.get(kind, ()):
+                return f'{label} repetido no arquivo'
+            values.setdefault(kind, set()).add(value)
+        for kind, keys in values.items():
+            self.seen[kind].update(keys)
+        return None
+
+    def forget(self, rows: list) -> None:
+        """Release the keys taken by `check` for `rows`, for rows that could not be saved"""
+        for row in rows:
+            for key, _ in self.KEYS:
+                if row[key]:
+                    self.seen['phone' if key.startswith('phone') else key].discard(row[key])
+
+
+class ImportReport(object):
+    """Counters of an import and the CSV of the rejected lines, used as a context manager
+
+    The CSV is opened on enter and closed on exit, an import interrupted by an
+    exception ends the CSV with a line telling it is incomplete.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.counters = Counter()
+        self.file = None
+        self.writer = None
+
+    def __enter__(self) -> 'ImportReport':
+        if self.path:
+            self.file = open(self.path, 'w', newline='', encoding='utf-8')
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        try:
+            if exc is not None and self.file is not None:
+                if self.writer is None:
+                    self.writer = csv.DictWriter(self.file, fieldnames=['linha', 'motivo'], extrasaction='ignore')
+                    self.writer.writeheader()
+                self.writer.writerow({'linha': '', 'motivo': f'Importação interrompida: {exc}'})
+        finally:
+            self.close()
+
+    def accepted(self, amount: int) -> None:
+        self.counters['importados'] += amount
+
+    def reject(self, line: int, reason: str, row: dict) -> None:
+        self.counters[reason] += 1
+        if self.file is None:
+            return
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=['linha', 'motivo', *row.keys()], extrasaction='ignore')
+            self.writer.writeheader()
+        self.writer.writerow({'linha': line, 'motivo': reason, **row})
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def save_chunk(rows: list, identifier_type_id: uuid.UUID, address_id: Optional[uuid.UUID]) -> None:
+    """Insert the addresses, the contacts and the costumers of `rows` with one executemany each and commit"""
+    from datetime import datetime
+
+    from app.core.addresses import address_resolver
+    from app.core.db import db
+    from app.models.contact import Contact
+    from app.models.costumer import Costumer
+
+    now = datetime.utcnow()
+    with_address = [row for row in rows if row['address'] is not None]
+    for row, id in zip(with_address, address_resolver.create([row['address'] for row in with_address])):
+        row['address_id'] = id
+    contacts, costumers = [], []
+    for row in rows:
+        contact_id = uuid.uuid4()
+        contacts.append({'id': contact_id, 'create_at': now, 'email': row['email'],
+                         '_phone_principal': row['phone_principal'], '_phone_secondary': row['phone_secondary']})
+        costumers.append({'id': uuid.uuid4(), 'create_at': now, 'name': row['name'],
+                          'search_name': row['search_name'], '_identifier': row['identifier'],
+                          'identifier_type_id': identifier_type_id, 'contact_id': contact_id,
+                          'address_id': row['address_id'] or address_id,
+                          'opened_tickets_count': 0, 'closed_tickets_count': 0})
+    db.session.execute(db.insert(Contact.__table__), contacts)
+    db.session.execute(db.insert(Costumer.__table__), costumers)
+    db.session.commit()
+
+
+def import_costumers(path: str, identifier_type_id: uuid.UUID, address_id: Optional[uuid.UUID] = None,
+                     workers: int = 4, chunk_size: int = 5000, rejects: Optional[str] = None) -> Counter:
+    """Import the costumers of the CSV at `path`
+
+    The CSV has the columns `name`, `cpf`, `email`, `phone`, `phone_secondary`
+    and optionally `address_id`, used instead of `address_id` for that line,
+    or the address in `postcode`, `address_type`, `address`, `number`, `city`
+    and `uf`, resolved by `address_resolver`.
+    Lines are parsed and validated in `workers` processes, checked against the
+    unique keys already used and saved in chunks of `chunk_size`. Rejected
+    lines are written with their reason to the CSV `rejects`.
+
+    Returns:
+        Counter: imported lines and rejected lines by reason
+    """
+    from flask import current_app as app
+
+    from app.core.costumersearch import costumer_search
+    from app.core.db import db
+
+    deduplicator = Deduplicator.from_database()
+    try:
+        with ImportReport(rejects) as report:
+            for accepted, rejected in parse_parallel(read_chunks(path, chunk_size), workers):
+                for line, reason, row in rejected:
+                    report.reject(line, reason, row)
+                rows = []
+                for row in accepted:
+                    if not row['address_id'] and row['address'] is None and address_id is None:
+                        reason = 'Endereço não informado'
+                    else:
+                        reason = deduplicator.check(row)
+                    if reason is None:
+                        rows.append(row)
+                    else:
+                        report.reject(row['line'], reason, row['row'])
+                if not rows:
+                    continue
+                try:
+                    save_chunk(rows, identifier_type_id, address_id)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+                    app.logger.error(e)
+                    deduplicator.forget(rows)
+                    for row in rows:
+                        report.reject(row['line'], 'Erro ao salvar', row['row'])
+                    continue
+                report.accepted(len(rows))
+    finally:
+        costumer_search.clear()
+    return report.counters
@@ -0,0 +1,231 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Callable, Optional
+
+from flask import Flask, current_app as app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.utils.kernel import SEARCH_MIN_LENGTH, only_numbers, search_text
+
+PENDING_KEY = 'costumer_search_pending'
+
+
+def prefix_pattern(value: str) -> str:
+    """LIKE pattern for values starting with `value`, escaped with `\\`"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def classify(query: str) -> tuple:
+    """Kind of a search and its normalized term
+
+    Returns:
+        tuple: ('email' | 'number' | 'name', term), term is None when it is too short
+    """
+    query = query.strip()
+    if '@' in query:
+        term = query.lower()
+        return 'email', term if len(term) >= SEARCH_MIN_LENGTH else None
+    digits = only_numbers(query)
+    if digits and not any(c.isalpha() for c in query):
+        return 'number', digits if len(digits) >= SEARCH_MIN_LENGTH else None
+    term = search_text(query)
+    return 'name', term if len(term) >= SEARCH_MIN_LENGTH else None
+
+
+def trigrams(text: str) -> set:
+    """Trigrams of the words of `text` padded as `pg_trgm` does"""
+    grams = set()
+    for word in text.split():
+        word = f'  {word} '
+        grams.update(word[idx:idx + 3] for idx in range(len(word) - 2))
+    return grams
+
+
+def term_matches(kind: str, term: str, values: dict) -> bool:
+    """Whether a search of `kind` for `term` may find a row with the searchable `values`
+
+    Args:
+        values (dict): {'number': digits of the CPF and phones, 'email': lowercase emails,
+            'name': `search_text` of the names}
+    """
+    if kind in ('number', 'email'):
+        return any(value.startswith(term) for value in values.get(kind, ()) if value)
+    grams = trigrams(term)
+    return any(term in value or grams & trigrams(value) for value in values.get('name', ()) if value)
+
+
+def costumer_row(row) -> dict:
+    return {
+        'id': str(row.id),
+        'name': row.name,
+        'identifier': row.identifier,
+        'email': row.email,
+        'phone': row.phone,
+        'score': round(float(row.score), 3),
+    }
+
+
+def search_costumers(kind: str, term: str, limit: int, timeout_ms: int) -> list:
+    """Top `limit` costumers of a classified search, best first
+
+    CPF and phone use the `varchar_pattern_ops` prefix indexes, emails the
+    prefix index on `lower(email)` and names the trigram index on
+    `Costumer.search_name`, ranked by `word_similarity`. The search runs on
+    its own connection, in a transaction limited to `timeout_ms`, so the
+    session of the request is neither committed nor rolled back.
+    """
+    from app.core.db import db
+    from app.models.contact import Contact
+    from app.models.costumer import Costumer
+
+    query = (
+        db.select(Costumer.id, Costumer.name, Costumer._identifier.label('identifier'), Contact.email,
+                  Contact._phone_principal.label('phone'))
+        .select_from(Costumer)
+        .outerjoin(Contact, Contact.id == Costumer.contact_id)
+    )
+    if kind == 'number':
+        pattern = prefix_pattern(term)
+        score = db.case((Costumer._identifier == term, 1.0),
+                        (Contact._phone_principal == term, 1.0),
+                        (Contact._phone_secondary == term, 1.0), else_=0.5)
+        # one branch per table, so each one is served by its own prefix indexes
+        by_cpf = db.select(Costumer.id).where(Costumer._identifier.like(pattern, escape='\\'))
+        by_phone = (
+            db.select(Costumer.id)
+            .join(Contact, Contact.id == Costumer.contact_id)
+            .where(db.or_(Contact._phone_principal.like(pattern, escape='\\'),
+                          Contact._phone_secondary.like(pattern, escape='\\')))
+        )
+        query = query.where(Costumer.id.in_(db.union(by_cpf, by_phone)))
+    elif kind == 'email':
+        score = db.case((db.func.lower(Contact.email) == term, 1.0), else_=0.5)
+        query = query.where(db.func.lower(Contact.email).like(prefix_pattern(term), escape='\\'))
+    else:
+        score = db.func.word_similarity(term, Costumer.search_name)
+        query = query.where(db.or_(
+            Costumer.search_name.like('%' + prefix_pattern(term), escape='\\'),
+            db.literal(term).op('<%')(Costumer.search_name),
+        ))
+    query = query.add_columns(score.label('score')).order_by(db.desc('score'), Costumer.name).limit(limit)
+    with db.engine.connect() as connection:
+        # SET LOCAL, the timeout ends with the transaction of this connection
+        connection.execute(db.select(db.func.set_config('statement_timeout', str(timeout_ms), True)))
+        rows = connection.execute(query).all()
+    return [costumer_row(row) for row in rows]
+
+
+class CostumerSearch(object):
+    """Costumer lookup for the agents' autocomplete.
+
+    A query is classified as CPF/phone (digits), email or name and served by
+    the matching index. Each search runs with a `statement_timeout` of
+    `COSTUMER_SEARCH_TIMEOUT_MS`, a search that exceeds it returns no results
+    instead of holding the request. Results of recent terms are kept in a LRU
+    of `COSTUMER_SEARCH_CACHE_SIZE` entries for `COSTUMER_SEARCH_CACHE_TTL`
+    seconds, so the prefixes typed by many agents hit the database once.
+    A committed change of a costumer or contact drops only the entries whose
+    results show it and the ones whose term may find its new values, see
+    `invalidate`. A search that runs while entries are dropped is not kept.
+    """
+
+    def __init__(self, searcher: Optional[Callable] = None, size: int = 1024, ttl: Optional[float] = 30) -> None:
+        self.searcher = searcher or search_costumers
+        self.size = size
+        self.ttl = ttl
+        self.limit = 10
+        self.timeout_ms = 200
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.stats = {'searches': 0, 'hits': 0, 'timeouts': 0}
+        self.generation = 0
+
+    def init_app(self, app: Flask) -> None:
+        self.size = app.config.get('COSTUMER_SEARCH_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('COSTUMER_SEARCH_CACHE_TTL', self.ttl)
+        self.limit = app.config.get('COSTUMER_SEARCH_LIMIT', self.limit)
+        self.timeout_ms = app.config.get('COSTUMER_SEARCH_TIMEOUT_MS', self.timeout_ms)
+
+    def search(self, query: str, limit: Optional[int] = None) -> list:
+        """Costumers matching `query`, best first, an empty list when it is too short"""
+        kind, term = classify(query)
+        if term is None:
+            return []
+        limit = min(limit or self.limit, self.limit)
+        key = (kind, term)
+        self.stats['searches'] += 1
+        entry = self.entries.get(key)
+        if entry is not None and (self.ttl is None or monotonic() - entry[1] < self.ttl):
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0][:limit]
+        generation = self.generation
+        results = self._run(kind, term)
+        if results is None:
+            return []
+        with self.lock:
+            # results read before an invalidation may be stale
+            if generation != self.generation:
+                return results[:limit]
+            self.entries[key] = (results, monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return results[:limit]
+
+    def _run(self, kind: str, term: str) -> Optional[list]:
+        try:
+            return self.searcher(kind, term, self.limit, self.timeout_ms)
+        except Exception as e:
+            self.stats['timeouts'] += 1
+            app.logger.warning(f'Busca de clientes cancelada ({kind}): {e}')
+            return None
+
+    def invalidate(self, values: dict, stale: Optional[Callable] = None) -> int:
+        """Drop the entries whose term matches the new `values` of a row or whose results have `stale(result)`
+
+        Returns:
+            int: number of dropped entries
+        """
+        with self.lock:
+            self.generation += 1
+            keys = [
+                key for key, (results, _) in self.entries.items()
+                if term_matches(*key, values) or (stale is not None and any(stale(row) for row in results))
+            ]
+            for key in keys:
+                del self.entries[key]
+        self.stats['invalidated'] = self.stats.get('invalidated', 0) + len(keys)
+        return len(keys)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+costumer_search = CostumerSearch()
+
+
+def invalidate_after_commit(target, values: dict, stale: Optional[Callable] = None) -> None:
+    """`CostumerSearch.invalidate` once the session of `target` commits"""
+    session = object_session(target)
+    if session is None:
+        costumer_search.invalidate(values, stale)
+        return
+    session.info.setdefault(PENDING_KEY, []).append((values, stale))
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    for values, stale in session.info.pop(PENDING_KEY, ()):
+        costumer_search.invalidate(values, stale)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending(session):
+    session.info.pop(PENDING_KEY, None)
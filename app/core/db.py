@@ -34,6 +34,278 @@ def init_db():
     db.session.commit()
     click.echo('Estágios de ticket criados.')
 
+@click.command('migrate-read-state')
+@with_appcontext
+def migrate_read_state_command():
+    """Convert the per-message receipts of `readed_messages` into team read watermarks"""
+    from sqlalchemy.dialects.postgresql import insert
+    from app.models.chat import Message, readed_messages
+    from app.models.team import TeamReadState
+
+    latest_read = (
+        db.session.query(
+            db.func.gen_random_uuid(),
+            readed_messages.c.user_id,
+            Message.team_id,
+            Message.create_at,
+            Message.id,
+        )
+        .join(Message, Message.id == readed_messages.c.message_id)
+        .filter(Message.team_id.isnot(None), readed_messages.c.user_id.isnot(None))
+        .distinct(readed_messages.c.user_id, Message.team_id)
+        .order_by(
+            readed_messages.c.user_id,
+            Message.team_id,
+            Message.create_at.desc(),
+            Message.id.desc(),
+        )
+    )
+    stmt = insert(TeamReadState).from_select(
+        ['id', 'user_id', 'team_id', 'last_read_at', 'last_read_message_id'],
+        latest_read,
+    ).on_conflict_do_nothing(index_elements=['user_id', 'team_id'])
+    try:
+        result = db.session.execute(stmt)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+        app.logger.error(e)
+        click.echo('Não foi possível migrar as leituras de mensagens')
+        return False
+    click.echo(f'Marcas de leitura criadas: {result.rowcount}')
+
+@click.command('count-unreaded')
+@with_appcontext
+def count_unreaded_command():
+    """Rebuild `User.unreaded_count` from the unread direct messages"""
+    from app.models.chat import Message
+
+    unreaded = (
+        db.session.query(db.func.count(Message.id))
+        .filter(Message.user_destiny_id == User.id, Message.readed.is_(False))
+        .scalar_subquery()
+    )
+    try:
+        result = db.session.execute(db.update(User).values(unreaded_count=unreaded))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+        app.logger.error(e)
+        click.echo('Não foi possível recontar as mensagens não lidas')
+        return False
+    click.echo(f'Usuários atualizados: {result.rowcount}')
+
+@click.command('rebuild-role-masks')
+@with_appcontext
+def rebuild_role_masks_command():
+    """Rebuild `User.role_mask` from `roles_users`"""
+    try:
+        result = db.session.execute(db.update(User).values(role_mask=Role.mask_of(User.id)))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+        app.logger.error(e)
+        click.echo('Não foi possível recalcular os papéis dos usuários')
+        return False
+    click.echo(f'Usuários atualizados: {result.rowcount}')
+
+@click.command('backfill-last-message')
+@with_appcontext
+def backfill_last_message_command():
+    """Fill `Team.last_message_at` and `Team.last_message_id` from the newest message of each team"""
+    from app.models.chat import Message
+    from app.models.team import Team
+
+    latest = (
+        db.session.query(Message.team_id, Message.create_at, Message.id)
+        .filter(Message.team_id.isnot(None))
+        .distinct(Message.team_id)
+        .order_by(Message.team_id, Message.create_at.desc(), Message.id.desc())
+        .subquery()
+    )
+    stmt = (
+        db.update(Team)
+        .where(Team.id == latest.c.team_id)
+        .values(last_message_at=latest.c.create_at, last_message_id=latest.c.id, update_at=Team.update_at)
+    )
+    try:
+        result = db.session.execute(stmt.execution_options(synchronize_session=False))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+        app.logger.error(e)
+        click.echo('Não foi possível preencher a última mensagem dos times')
+        return False
+    click.echo(f'Times atualizados: {result.rowcount}')
+
+@click.command('unique-user-team')
+@with_appcontext
+def unique_user_team_command():
+    """Delete repeated `user_team` rows, keeping the oldest, and create `uq_user_team_user_id_team_id`"""
+    from app.models.team import UserTeam
+
+    keep = (
+        db.session.query(UserTeam.id)
+        .distinct(UserTeam.user_id, UserTeam.team_id)
+        .order_by(UserTeam.user_id, UserTeam.team_id, UserTeam.create_at, UserTeam.id)
+    )
+    try:
+        result = db.session.execute(
+            db.delete(UserTeam)
+            .where(UserTeam.id.not_in(keep.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(db.text(
+            'ALTER TABLE user_team ADD CONSTRAINT uq_user_team_user_id_team_id UNIQUE (user_id, team_id)'
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+        app.logger.error(e)
+        click.echo('Não foi possível criar a restrição de usuários únicos nos times')
+        return False
+    click.echo(f'Vínculos repetidos removidos: {result.rowcount}')
+
+@click.command('unique-city')
+@with_appcontext
+def unique_city_command():
+    """Merge repeated cities of a state into the oldest one and create `uq_city_city_uf_id`"""
+    from app.core.addresses import address_resolver
+    from app.models.location import Address, City
+
+    keep = (
+        db.session.query(City.id, City.city, City.uf_id)
+        .distinct(City.city, City.uf_id)
+        .order_by(City.city, City.uf_id, City.create_at, City.id)
+        .subquery()
+    )
+    repeated = db.aliased(City)
+    try:
+        db.session.execute(
+            db.update(Address)
+            .where(Address.city_id == repeated.id, repeated.city == keep.c.city,
+                   repeated.uf_id == keep.c.uf_id, repeated.id != keep.c.id)
+            .values({Address.city_id: keep.c.id, Address.update_at: Address.update_at})
+            .execution_options(synchronize_session=False)
+        )
+        result = db.session.execute(
+            db.delete(City)
+            .where(City.id.not_in(db.select(keep.c.id)))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.execute(db.text(
+            'ALTER TABLE city ADD CONSTRAINT uq_city_city_uf_id UNIQUE (city, uf_id)'
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+        app.logger.error(e)
+        click.echo('Não foi possível criar a restrição de cidades únicas por estado')
+        return False
+    address_resolver.clear()
+    click.echo(f'Cidades repetidas removidas: {result.rowcount}')
+
+@click.command('count-costumer-tickets')
+@with_appcontext
+def count_costumer_tickets_command():
+    """Add `Costumer.opened_tickets_count` and `Costumer.closed_tickets_count` if needed and rebuild them from the tickets
+
+    Until this runs the counters are NULL and `Costumer.ticket_counts` counts the tickets.
+    """
+    from app.models.costumer import Costumer
+
+    stats = Costumer.ticket_stats_query().subquery()
+    try:
+        db.session.execute(db.text(
+            'ALTER TABLE costumer ADD COLUMN IF NOT EXISTS opened_tickets_count INTEGER, '
+            'ADD COLUMN IF NOT EXISTS closed_tickets_count INTEGER'
+        ))
+        db.session.execute(
+            db.update(Costumer).values(opened_tickets_count=0, closed_tickets_count=0)
+        )
+        result = db.session.execute(
+            db.update(Costumer)
+            .where(Costumer.id == stats.c.costumer_id)
+            .values(opened_tickets_count=stats.c.opened, closed_tickets_count=stats.c.closed)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+        app.logger.error(e)
+        click.echo('Não foi possível recontar os tickets dos clientes')
+        return False
+    click.echo(f'Clientes com tickets: {result.rowcount}')
+
+@click.command('normalize-costumer-names')
+@with_appcontext
+def normalize_costumer_names_command():
+    """Fill `Costumer.search_name` of the costumers created before it existed"""
+    from app.models.costumer import Costumer
+    from app.utils.kernel import search_text
+
+    rows = [
+        {'costumer_id': costumer_id, 'search_name': search_text(name)}
+        for costumer_id, name in db.session.query(Costumer.id, Costumer.name).filter(Costumer.search_name.is_(None))
+    ]
+    if not rows:
+        click.echo('Clientes atualizados: 0')
+        return
+    try:
+        db.session.execute(
+            db.update(Costumer.__table__)
+            .where(Costumer.__table__.c.id == db.bindparam('costumer_id'))
+            .values(search_name=db.bindparam('search_name')),
+            rows,
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+        app.logger.error(e)
+        click.echo('Não foi possível normalizar os nomes dos clientes')
+        return False
+    click.echo(f'Clientes atualizados: {len(rows)}')
+
+@click.command('import-costumers')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--address-id', type=click.UUID, default=None, help='Endereço dos clientes sem a coluna address_id')
+@click.option('--workers', type=int, default=4, show_default=True, help='Processos que validam o arquivo')
+@click.option('--chunk-size', type=int, default=5000, show_default=True, help='Linhas por lote')
+@click.option('--rejects', type=click.Path(dir_okay=False), default=None, help='CSV com as linhas rejeitadas e o motivo')
+@with_appcontext
+def import_costumers_command(path, address_id, workers, chunk_size, rejects):
+    """Import the costumers of a CSV with the columns name, cpf, email, phone, phone_secondary and address_id
+    or postcode, address_type, address, number, city and uf"""
+    from app.core.costumerimport import import_costumers
+    from app.models.costumer import CostumerIdentifierType
+
+    identifier_type = CostumerIdentifierType.query.filter(CostumerIdentifierType.type == 'CPF').first()
+    if identifier_type is None:
+        identifier_type = CostumerIdentifierType()
+        identifier_type.type = 'CPF'
+        db.session.add(identifier_type)
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+            app.logger.error(e)
+            click.echo('Não foi possível criar o tipo de identificador CPF')
+            return False
+    counters = import_costumers(path, identifier_type.id, address_id=address_id, workers=workers,
+                                chunk_size=chunk_size, rejects=rejects)
+    click.echo(f'Clientes importados: {counters.pop("importados", 0)}')
+    for reason, amount in counters.most_common():
+        click.echo(f'{reason}: {amount}')
+
 @click.command('fake-db')
 @with_appcontext
 def fake_db_command():
@@ -48,7 +320,7 @@ def fake_db_command():
     # from app.models.comment import Comment
     # from app.models.ticket import Ticket, TicketType
     from faker import Faker
-    from random import choice, randint
+    from random import choice, randint, sample
     from datetime import datetime, timedelta
     from app.models import get_class_models
     faker = Faker(locale='pt_BR')
@@ -174,36 +446,9 @@ def fake_db_command():
     db.session.add(cpf)
     db.session.commit()
 
-    states_dic = {
-        'AC': 'Acre',
-        'AL': 'Alagoas',
-        'AP': 'Amapá',
-        'AM': 'Amazonas',
-        'BA': 'Bahia',
-        'CE': 'Ceará',
-        'DF': 'Distrito Federal',
-        'ES': 'Espírito Santo',
-        'GO': 'Goiás',
-        'MA': 'Maranhão',
-        'MT': 'Mato Grosso',
-        'MS': 'Mato Grosso do Sul',
-        'MG': 'Minas Gerais',
-        'PA': 'Pará',
-        'PB': 'Paraíba',
-        'PR': 'Paraná',
-        'PE': 'Pernambuco',
-        'PI': 'Piauí',
-        'RJ': 'Rio de Janeiro',
-        'RN': 'Rio Grande do Norte',
-        'RS': 'Rio Grande do Sul',
-        'RO': 'Rondônia',
-        'RR': 'Roraima',
-        'SC': 'Santa Catarina',
-        'SP': 'São Paulo',
-        'SE': 'Sergipe',
-        'TO': 'Tocantins'
-    }
-    for key, value in states_dic.items():
+    from app.core.addresses import STATES
+
+    for key, value in STATES.items():
         state = StateLocation()
         state.state = value
         state.uf = key
@@ -219,7 +464,7 @@ def fake_db_command():
             city.city = city_name
             city.uf_id = choice(states).id
             cities.append(city)
-            city_names.append(city_names)
+            city_names.append(city_name)
     db.session.add_all(cities)
     db.session.commit()
     click.echo('Cidades criadas com sucesso')
@@ -231,7 +476,7 @@ def fake_db_command():
             code = AddressPostcode()
             code.code = postcode
             postcodes.append(code)
-            codes.append(code)
+            codes.append(postcode)
     db.session.add_all(set(postcodes))
     db.session.commit()
     click.echo('Códigos postais criados com sucesso')
@@ -375,14 +620,8 @@ def fake_db_command():
         teams.append(t)
     db.session.add_all(teams)
     db.session.commit()
-    user_teams = []
     for team in Team.query:
-        ut = UserTeam()
-        ut.user_id = user.id
-        ut.team_id = t.id
-        user_teams.append(ut)
-    db.session.add_all(user_teams)
-    db.session.commit()
+        team.add_members([user.id])
     for _ in range(1000):
         ms = Message()
         ms.message = faker.text(max_nb_chars=randint(50,999))
@@ -418,15 +657,14 @@ def fake_db_command():
 
     
     users =User.query.all()
+    users_ids = [_user.id for _user in users]
     admin = User.query.filter(User.username == 'admin').first()
     for t in Team.query.all():
         t.administrators.append(admin)
         for _ in range(30):
             _adm = choice(users)
-            _user = choice(users)
             if not _adm in t.administrators:
-                t.administrators.append(_user)
-            if not _user in t.users:
-                t.users.append(choice(users))
+                t.administrators.append(_adm)
+        t.add_members(sample(users_ids, min(30, len(users_ids))))
     db.session.commit()
     click.echo('Finalizado')
\ No newline at end of file
@@ -4,9 +4,17 @@ from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_socketio import SocketIO
 from flask_uuid import FlaskUUID
+from app.core.writebehind import MessageWriter
+from app.core.rooms import RoomRegistry
+from app.core.ratelimit import RateLimiter
+from app.core.broadcast import Broadcaster
 csrf = CSRFProtect()
 migrate = Migrate()
 login = LoginManager()
 security = Security()
 socketio = SocketIO()
-uuid = FlaskUUID()
\ No newline at end of file
+uuid = FlaskUUID()
+message_writer = MessageWriter()
+room_registry = RoomRegistry()
+rate_limiter = RateLimiter()
+broadcaster = Broadcaster()
@@ -0,0 +1,119 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+from typing import Callable, Optional
+
+from flask import Flask, current_app
+
+
+class HashingBusy(Exception):
+    """No slot of the hashing pool was free within `PASSWORD_HASH_QUEUE_TIMEOUT`"""
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class HashingPool(object):
+    """Bounded pool of OS threads for password hashing and verification.
+
+    At most `PASSWORD_HASH_WORKERS` hashes run at a time and at most
+    `PASSWORD_HASH_QUEUE_SIZE` callers wait for a slot, each one for up to
+    `PASSWORD_HASH_QUEUE_TIMEOUT` seconds, so a burst of logins can't take the
+    worker away from the chat. With eventlet or gevent the jobs run in the hub
+    thread pool, a monkey patched `ThreadPoolExecutor` would run them in green
+    threads.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 32, timeout: float = 5) -> None:
+        self.lock = Lock()
+        self.latencies = deque(maxlen=1000)
+        self.stats = {'completed': 0, 'rejected': 0, 'failed': 0, 'running': 0, 'waiting': 0}
+        self.executor = None
+        self.configure(workers, queue_size, timeout)
+
+    def configure(self, workers: int, queue_size: int, timeout: float, async_mode: Optional[str] = None) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = BoundedSemaphore(workers)
+        self.admission = BoundedSemaphore(workers + queue_size)
+        # a new app (tests, reloads) configures the pool again, the threads of the previous executor exit
+        self.shutdown()
+        self.submit = self._executor(workers, async_mode)
+
+    def shutdown(self) -> None:
+        """Stop the threads of the executor once their running jobs finish"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def init_app(self, app: Flask, async_mode: Optional[str] = None) -> None:
+        self.configure(app.config.get('PASSWORD_HASH_WORKERS', 2),
+                       app.config.get('PASSWORD_HASH_QUEUE_SIZE', 32),
+                       app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5),
+                       async_mode)
+
+    def _executor(self, workers: int, async_mode: Optional[str]) -> Callable:
+        if async_mode == 'eventlet':
+            from eventlet import tpool
+            return tpool.execute
+        if async_mode == 'gevent':
+            import gevent
+            return lambda fn, *args: gevent.get_hub().threadpool.apply(fn, args)
+        executor = self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        return lambda fn, *args: executor.submit(fn, *args).result()
+
+    def run(self, fn: Callable, *args):
+        """Run `fn(*args)` in the pool with the current app context and return its result
+
+        Raises:
+            HashingBusy: the queue is full or no slot was free within the timeout
+        """
+        if not self.admission.acquire(blocking=False):
+            self._count('rejected')
+            raise HashingBusy()
+        try:
+            self._count('waiting')
+            acquired = self.slots.acquire(timeout=self.timeout)
+            self._count('waiting', -1)
+            if not acquired:
+                self._count('rejected')
+                raise HashingBusy()
+            try:
+                self._count('running')
+                app = current_app._get_current_object()
+                start = perf_counter()
+                result = self.submit(self._in_context, app, fn, *args)
+                self.latencies.append(perf_counter() - start)
+                self._count('completed')
+                return result
+            except Exception:
+                self._count('failed')
+                raise
+            finally:
+                self._count('running', -1)
+                self.slots.release()
+        finally:
+            self.admission.release()
+
+    @staticmethod
+    def _in_context(app: Flask, fn: Callable, *args):
+        with app.app_context():
+            return fn(*args)
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += amount
+
+    def report(self) -> dict:
+        latencies = list(self.latencies)
+        return dict(self.stats, workers=self.workers,
+                    p50_ms=round(percentile(latencies, 50) * 1000, 2),
+                    p99_ms=round(percentile(latencies, 99) * 1000, 2))
+
+
+hashing_pool = HashingPool()
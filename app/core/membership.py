@@ -0,0 +1,87 @@
+from threading import Lock
+from time import monotonic
+from typing import Callable, Optional
+import uuid
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+PENDING_KEY = 'membership_index_pending'
+
+
+def load_user_teams(user_id: uuid.UUID) -> frozenset:
+    from app.core.db import db
+    from app.models.team import UserTeam
+
+    return frozenset(
+        team_id
+        for team_id, in db.session.query(UserTeam.team_id).filter(UserTeam.user_id == user_id)
+    )
+
+
+class MembershipIndex(object):
+    """Per-worker index of the teams of each user.
+
+    The team ids of a user are loaded on first use with one query and kept as a
+    frozenset, so membership and ACL checks are set lookups. Entries are
+    invalidated when a change of `UserTeam` rows commits in this worker and
+    expire after `MEMBERSHIP_INDEX_TTL` seconds to pick up changes made by
+    other workers. A load that runs while an invalidation happens is not kept.
+    """
+
+    def __init__(self, loader: Optional[Callable] = None, ttl: Optional[float] = 60) -> None:
+        self.loader = loader or load_user_teams
+        self.ttl = ttl
+        self.lock = Lock()
+        self.entries = {}
+        self.generation = 0
+
+    def init_app(self, app: Flask) -> None:
+        self.ttl = app.config.get('MEMBERSHIP_INDEX_TTL', self.ttl)
+
+    def teams_of(self, user_id: uuid.UUID) -> frozenset:
+        entry = self.entries.get(user_id)
+        if entry is not None and (self.ttl is None or monotonic() - entry[1] < self.ttl):
+            return entry[0]
+        generation = self.generation
+        teams = self.loader(user_id)
+        with self.lock:
+            if generation == self.generation:
+                self.entries[user_id] = (teams, monotonic())
+        return teams
+
+    def is_member(self, user_id: uuid.UUID, team_id: uuid.UUID) -> bool:
+        return team_id in self.teams_of(user_id)
+
+    def invalidate(self, user_id: Optional[uuid.UUID] = None) -> None:
+        """Drop the teams of `user_id`, or of every user when it is None"""
+        with self.lock:
+            self.generation += 1
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
+
+
+membership_index = MembershipIndex()
+
+
+def invalidate_after_commit(target, user_id: uuid.UUID) -> None:
+    """Drop the teams of `user_id` once the session of `target` commits"""
+    session = object_session(target)
+    if session is None:
+        membership_index.invalidate(user_id)
+        return
+    session.info.setdefault(PENDING_KEY, set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    for user_id in session.info.pop(PENDING_KEY, ()):
+        membership_index.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending(session):
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,70 @@
+import enum
+from typing import Iterable
+
+
+class BaseRole(enum.Enum):
+    ADMIN = 0
+    MANAGER_USER = 1
+    SUPPORT = 2
+    LOCAL_ADMIN = 3
+    USER = 4
+    REPORTS = 5
+    COSTUMER = 6
+
+    def __repr__(self) -> str:
+        return super().__repr__()
+
+    @property
+    def mask(self) -> int:
+        return 1 << self.value
+
+
+SUPPORT_ROLES = BaseRole.SUPPORT.mask | BaseRole.MANAGER_USER.mask | BaseRole.ADMIN.mask
+EDITOR_ROLES = BaseRole.ADMIN.mask | BaseRole.LOCAL_ADMIN.mask | BaseRole.MANAGER_USER.mask
+
+
+def roles_mask(roles: Iterable) -> int:
+    """Bitmask of `roles`, each one a `BaseRole` or an object with a `BaseRole` `name`"""
+    mask = 0
+    for role in roles:
+        mask |= (role if isinstance(role, BaseRole) else role.name).mask
+    return mask
+
+
+class RoleMaskMixin(object):
+    """Permission checks of an object with a `role_mask` of `BaseRole` bits"""
+
+    def has_any_role(self, mask: int) -> bool:
+        return bool((self.role_mask or 0) & mask)
+
+    @property
+    def is_admin(self) -> bool:
+        return self.has_any_role(BaseRole.ADMIN.mask)
+
+    @property
+    def is_manager_user(self) -> bool:
+        return self.has_any_role(BaseRole.MANAGER_USER.mask)
+
+    @property
+    def is_editor(self) -> bool:
+        return self.has_any_role(EDITOR_ROLES)
+
+    @property
+    def is_aux_editor(self) -> bool:
+        return self.has_any_role(BaseRole.SUPPORT.mask)
+
+    @property
+    def can_edit(self) -> bool:
+        return self.has_any_role(EDITOR_ROLES | BaseRole.SUPPORT.mask)
+
+    @property
+    def is_support(self) -> bool:
+        return self.has_any_role(BaseRole.SUPPORT.mask)
+
+    @property
+    def has_support(self) -> bool:
+        return self.has_any_role(SUPPORT_ROLES)
+
+    @property
+    def is_viewer(self) -> bool:
+        return self.has_any_role(BaseRole.REPORTS.mask)
@@ -0,0 +1,154 @@
+import select
+import uuid
+from time import monotonic
+from typing import Callable, Iterator, Optional
+
+from socketio import PubSubManager
+
+try:
+    import psycopg2
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+except ImportError:  # pragma: no cover
+    psycopg2 = None
+
+# NOTIFY payloads must be shorter than 8000 bytes, bigger messages are chunked
+NOTIFY_PAYLOAD_SIZE = 7000
+
+
+def split_payload(payload: str, size: int = NOTIFY_PAYLOAD_SIZE) -> list:
+    """Split `payload` in NOTIFY sized chunks formated as `id:index:total:data`
+
+    Args:
+        payload (str): JSON encoded message
+        size (int, optional): max size of data in each chunk. Defaults to NOTIFY_PAYLOAD_SIZE.
+
+    Returns:
+        list: chunks, a single chunk with the payload as is when it fits
+    """
+    if len(payload.encode()) <= size:
+        return [payload]
+    # slicing by characters keeps utf-8 sequences intact, 4 bytes per char in the worst case
+    step = size // 4
+    parts = [payload[i:i + step] for i in range(0, len(payload), step)]
+    id = uuid.uuid4().hex
+    return [f'{id}:{idx}:{len(parts)}:{part}' for idx, part in enumerate(parts)]
+
+
+class PayloadAssembler(object):
+    """Join the chunks created by `split_payload`
+
+    A payload whose chunks don't all arrive within `ttl` seconds, e.g. lost in
+    a reconnect or sent by a publisher that died, is dropped.
+    """
+
+    def __init__(self, ttl: float = 5, clock: Callable = monotonic) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self.pending = {}
+        self.expired = 0
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Return the complete payload or None while chunks are missing"""
+        if chunk.startswith('{'):
+            return chunk
+        now = self.clock()
+        self.expire(now)
+        id, idx, total, data = chunk.split(':', 3)
+        parts, _ = self.pending.setdefault(id, ({}, now))
+        parts[int(idx)] = data
+        if len(parts) < int(total):
+            return None
+        del self.pending[id]
+        return ''.join(parts[i] for i in range(int(total)))
+
+    def expire(self, now: float) -> None:
+        for id in [id for id, (_, started) in self.pending.items() if now - started > self.ttl]:
+            del self.pending[id]
+            self.expired += 1
+
+
+class PostgresManager(PubSubManager):
+    """Client manager that uses PostgreSQL LISTEN/NOTIFY for inter-process
+    messaging, so several workers can share rooms without another broker.
+
+    :param url: PostgreSQL connection URL, the SQLAlchemy driver suffix
+                (``postgresql+psycopg2://``) is accepted.
+    :param channel: The channel name on which the server sends and receives
+                    notifications. Must be the same in all the servers.
+    :param write_only: If set to ``True``, only initialize to emit events.
+    """
+    name = 'postgres'
+
+    def __init__(self, url: str, channel: str = 'socketio', write_only: bool = False,
+                 logger=None, json=None):
+        if psycopg2 is None:
+            raise RuntimeError('psycopg2 não está instalado')
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.url = url.replace('postgresql+psycopg2://', 'postgresql://', 1)
+        self.publisher = None
+
+    def _connect(self):
+        connection = psycopg2.connect(self.url)
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        return connection
+
+    def _publish(self, data: dict) -> None:
+        chunks = split_payload(self.json.dumps(data))
+        for retry in (True, False):
+            try:
+                if self.publisher is None or self.publisher.closed:
+                    self.publisher = self._connect()
+                with self.publisher.cursor() as cursor:
+                    for chunk in chunks:
+                        cursor.execute('SELECT pg_notify(%s, %s)', (self.channel, chunk))
+                return
+            except psycopg2.Error as e:
+                self.publisher = None
+                self._get_logger().error(f'Não foi possível publicar no PostgreSQL: {e}')
+                if not retry:
+                    return
+
+    def _listen(self) -> Iterator[str]:
+        retry_sleep = 1
+        while True:
+            connection = None
+            # chunks lost while reconnecting would never complete a payload of the previous connection
+            assembler = PayloadAssembler()
+            try:
+                connection = self._connect()
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                retry_sleep = 1
+                while True:
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        assembler.expire(monotonic())
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        payload = assembler.feed(connection.notifies.pop(0).payload)
+                        if payload is not None:
+                            yield payload
+            except psycopg2.Error as e:
+                self._get_logger().error(f'Conexão com o PostgreSQL perdida: {e}, '
+                                         f'tentando em {retry_sleep} segundos')
+                self.server.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
+            finally:
+                if connection is not None and not connection.closed:
+                    connection.close()
+
+
+def socketio_options(config: dict) -> dict:
+    """Options of `socketio.init_app` for the configured message queue
+
+    `SOCKETIO_MESSAGE_QUEUE` may be a PostgreSQL URL, handled by `PostgresManager`,
+    or any URL supported by Flask-SocketIO (redis://, amqp://, zmq+tcp://).
+    Without it the rooms only reach clients connected to the same process.
+    """
+    url = config.get('SOCKETIO_MESSAGE_QUEUE')
+    channel = config.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    if not url:
+        return {}
+    if url.startswith('postgresql'):
+        return {'client_manager': PostgresManager(url, channel=channel)}
+    return {'message_queue': url, 'channel': channel}
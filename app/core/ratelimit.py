@@ -0,0 +1,128 @@
+from collections import Counter
+from importlib.metadata import PackageNotFoundError, version
+from threading import Lock
+from time import monotonic
+from typing import Callable, Iterable, Optional
+
+from flask import Flask
+
+try:
+    ENGINEIO_MAJOR = int(version('python-engineio').split('.')[0])
+except (PackageNotFoundError, ValueError):
+    ENGINEIO_MAJOR = None
+
+
+def engineio_queue_size(server, sid: str, namespace: str) -> Optional[int]:
+    """Packets waiting in the outbound queue of the socket of `sid`, None when it cannot be read
+
+    python-engineio has no public API for it, the private attributes read here
+    exist in the 4.x servers of every async mode and are not trusted elsewhere.
+    """
+    if ENGINEIO_MAJOR != 4:
+        return None
+    try:
+        eio_sid = server.manager.eio_sid_from_sid(sid, namespace)
+        socket = server.eio.sockets.get(eio_sid)
+        if socket is None:
+            return 0
+        return int(socket.queue.qsize())
+    except Exception:
+        return None
+
+
+class TokenBucket(object):
+    """Token bucket with `burst` tokens refilled at `rate` tokens per second"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def consume(self, now: float, cost: float = 1) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class RateLimiter(object):
+    """Per-user token buckets for socket events and outbound backpressure.
+
+    `SOCKETIO_RATE_LIMITS` maps an event name to (rate, burst), events without
+    an entry use `SOCKETIO_RATE_LIMIT_DEFAULT`. Sockets whose outbound queue
+    is above `SOCKETIO_QUEUE_HIGH_WATER` are skipped by room broadcasts, the
+    dropped events are coalesced in a single `resync` event once the socket
+    catches up.
+    """
+
+    def __init__(self, clock: Callable = monotonic) -> None:
+        self.clock = clock
+        self.lock = Lock()
+        self.buckets = {}
+        self.limits = {}
+        self.default = (5, 10)
+        self.high_water = 100
+        self.dropped = {}
+        self.counters = Counter()
+
+    def init_app(self, app: Flask) -> None:
+        self.limits = app.config.get('SOCKETIO_RATE_LIMITS', self.limits)
+        self.default = app.config.get('SOCKETIO_RATE_LIMIT_DEFAULT', self.default)
+        self.high_water = app.config.get('SOCKETIO_QUEUE_HIGH_WATER', self.high_water)
+
+    def allow(self, user_id, event: str) -> bool:
+        """Consume a token of `user_id` for `event`, False when the user is throttled"""
+        now = self.clock()
+        key = (user_id, event)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(*self.limits.get(event, self.default), now)
+            allowed = bucket.consume(now)
+            self.counters[f'{event}.{"allowed" if allowed else "throttled"}'] += 1
+        return allowed
+
+    def queue_size(self, server, sid: str, namespace: str) -> int:
+        """Outbound queue of `sid`, 0 when engine.io does not expose it"""
+        size = engineio_queue_size(server, sid, namespace)
+        if size is None:
+            with self.lock:
+                self.counters['queue_size.unavailable'] += 1
+            return 0
+        return size
+
+    def slow_consumers(self, server, sids: Iterable[str], namespace: str, event: str) -> list:
+        """Return the sockets of `sids` that must not receive `event`
+
+        Sockets above the high-water mark are returned and have the drop
+        counted, sockets that drained their queue receive one `resync` event
+        with the number of events they lost.
+        """
+        slow, resync = [], []
+        sizes = [(sid, self.queue_size(server, sid, namespace)) for sid in sids]
+        with self.lock:
+            for sid, size in sizes:
+                if size > self.high_water:
+                    slow.append(sid)
+                    self.dropped[sid] = self.dropped.get(sid, 0) + 1
+                    self.counters[f'{event}.dropped'] += 1
+                elif sid in self.dropped:
+                    resync.append((sid, self.dropped.pop(sid)))
+                    self.counters[f'{event}.coalesced'] += 1
+        for sid, dropped in resync:
+            server.emit('resync', {'dropped': dropped}, to=sid, namespace=namespace)
+        return slow
+
+    def forget(self, sid: str) -> None:
+        with self.lock:
+            self.dropped.pop(sid, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'counters': dict(self.counters), 'buckets': len(self.buckets),
+                    'lagging_sockets': len(self.dropped)}
@@ -0,0 +1,73 @@
+from threading import Lock
+
+from flask import Flask
+
+
+def user_room(user_id) -> str:
+    """Room joined by every socket of `user_id`, used for direct messages"""
+    return f'user:{user_id}'
+
+
+class RoomRegistry(object):
+    """In-memory registry of the Socket.IO rooms of this process.
+
+    Keeps the sockets of each room and the rooms of each socket, so member
+    counts are a dictionary lookup and a disconnect cleans every room of the
+    socket. With a `SOCKETIO_MESSAGE_QUEUE` the rooms span several processes
+    and the counts of this one are not sent to the clients.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.members = {}
+        self.rooms = {}
+        self.distributed = False
+
+    def init_app(self, app: Flask) -> None:
+        self.distributed = bool(app.config.get('SOCKETIO_MESSAGE_QUEUE'))
+
+    def status(self, count: int) -> dict:
+        """`members` of a status event, empty when other processes have members of the room too"""
+        return {} if self.distributed else {'members': count}
+
+    def join(self, sid: str, room: str) -> int:
+        """Add `sid` to `room` and return the number of members of the room"""
+        with self.lock:
+            self.members.setdefault(room, set()).add(sid)
+            self.rooms.setdefault(sid, set()).add(room)
+            return len(self.members[room])
+
+    def leave(self, sid: str, room: str) -> int:
+        """Remove `sid` from `room` and return the number of members left"""
+        with self.lock:
+            self._discard(sid, room)
+            rooms = self.rooms.get(sid)
+            if rooms is not None:
+                rooms.discard(room)
+                if not rooms:
+                    del self.rooms[sid]
+            return len(self.members.get(room, ()))
+
+    def disconnect(self, sid: str) -> set:
+        """Remove `sid` from all rooms, returns the rooms it was in"""
+        with self.lock:
+            rooms = self.rooms.pop(sid, set())
+            for room in rooms:
+                self._discard(sid, room)
+            return rooms
+
+    def count(self, room: str) -> int:
+        return len(self.members.get(room, ()))
+
+    def rooms_of(self, sid: str) -> set:
+        return set(self.rooms.get(sid, ()))
+
+    def sids(self, room: str) -> set:
+        return set(self.members.get(room, ()))
+
+    def _discard(self, sid: str, room: str) -> None:
+        members = self.members.get(room)
+        if members is not None:
+            members.discard(sid)
+            if not members:
+                del self.members[room]
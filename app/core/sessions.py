@@ -0,0 +1,113 @@
+from collections import Counter
+from typing import Optional
+import uuid
+
+from flask import Flask
+
+from app.core.rooms import user_room
+from app.core.store import require_shared, shared_store
+
+
+class SessionRegistry(object):
+    """Active session of each user, shared by the workers through the shared store.
+
+    The entry of a user keeps the `fs_uniquifier` of the active session, its
+    `LoginSession` id and the socket ids opened with it. A new login replaces
+    the entry and disconnects the sockets of the old one, and `load_user`
+    rejects a session token that is not the active one with a store lookup.
+    Entries are changed with the atomic `update` of the store, so sockets that
+    connect or disconnect at the same time in different workers are all kept.
+
+    Users without an entry, e.g. after the store was cleared, are accepted and
+    checked by the user cache as before: a store restart must not log every
+    agent out. With `SESSION_REGISTRY_REQUIRED` a missing entry is rejected
+    instead and the user has to log in again. With several processes
+    (`SOCKETIO_MESSAGE_QUEUE`) a store of this process is refused on startup.
+    """
+
+    def __init__(self, store=None) -> None:
+        self.store = store or shared_store
+        self.socketio = None
+        self.namespace = '/chat'
+        self.required = False
+        self.counters = Counter()
+
+    def init_app(self, app: Flask, socketio, namespace: str = '/chat') -> None:
+        self.socketio = socketio
+        self.namespace = namespace
+        self.required = app.config.get('SESSION_REGISTRY_REQUIRED', self.required)
+        require_shared(self.store, app.config, 'O registro de sessões')
+
+    @staticmethod
+    def key(user_id) -> str:
+        return f'session:{user_id}'
+
+    def get(self, user_id) -> Optional[dict]:
+        return self.store.get(self.key(user_id))
+
+    def activate(self, user_id, token: str, session_id: Optional[uuid.UUID] = None) -> Optional[dict]:
+        """Make `token` the active session of `user_id`, the sockets of the previous one are disconnected
+
+        Returns:
+            The entry of the replaced session or None
+        """
+        entry = {'token': str(token), 'session_id': None if session_id is None else str(session_id), 'sids': []}
+        previous, _ = self.store.update(self.key(user_id), lambda current: entry)
+        self.counters['activated'] += 1
+        if previous is not None and previous['token'] != str(token):
+            self.counters['replaced'] += 1
+            self.disconnect(user_id, previous)
+            return previous
+        return None
+
+    def deactivate(self, user_id, token: str) -> None:
+        """Forget the entry of `user_id` if `token` is still the active session"""
+        self.store.update(self.key(user_id),
+                          lambda entry: None if entry is None or entry['token'] == str(token) else entry)
+
+    def is_active(self, user_id, token: str) -> bool:
+        return self.accepts(self.get(user_id), token)
+
+    def accepts(self, entry: Optional[dict], token: str) -> bool:
+        """Whether `token` is the active session of a registry `entry` already read from the store"""
+        self.counters['checked'] += 1
+        if entry is None and not self.required:
+            return True
+        if entry is not None and entry['token'] == str(token):
+            return True
+        self.counters['rejected'] += 1
+        return False
+
+    def add_sid(self, user_id, token: str, sid: str) -> bool:
+        """Attach the socket `sid` to the active session, False when `token` is not the active one"""
+        def add(entry):
+            if entry is None:
+                if self.required:
+                    return None
+                entry = {'token': str(token), 'session_id': None, 'sids': []}
+            elif entry['token'] != str(token):
+                return entry
+            return entry if sid in entry['sids'] else dict(entry, sids=entry['sids'] + [sid])
+
+        _, entry = self.store.update(self.key(user_id), add)
+        return entry is not None and entry['token'] == str(token) and sid in entry['sids']
+
+    def remove_sid(self, user_id, sid: str) -> None:
+        self.store.update(self.key(user_id), lambda entry: None if entry is None else
+                          dict(entry, sids=[s for s in entry['sids'] if s != sid]))
+
+    def disconnect(self, user_id, entry: dict) -> None:
+        """Warn the sockets of a replaced session and disconnect them in whichever worker they are"""
+        if self.socketio is None or self.socketio.server is None:
+            return
+        # the new session has no sockets yet, so the user room holds only the old ones
+        self.socketio.emit('session_replaced', {}, to=user_room(user_id), namespace=self.namespace)
+        for sid in entry['sids']:
+            self.socketio.server.disconnect(sid, namespace=self.namespace)
+            self.counters['disconnected'] += 1
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+session_registry = SessionRegistry()
@@ -0,0 +1,206 @@
+import json
+import sqlite3
+import threading
+from threading import Lock
+from time import time
+from typing import Any, Callable, Optional
+
+from flask import Flask
+
+
+class MemoryStore(object):
+    """Key/value store of this process with expiration, the default backend"""
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.data = {}
+
+    def get(self, key: str) -> Any:
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time():
+            with self.lock:
+                self.data.pop(key, None)
+            return None
+        return value
+
+    def get_many(self, keys: list) -> dict:
+        return {key: self.get(key) for key in keys}
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self.lock:
+            self.data[key] = (value, time() + ttl if ttl else None)
+
+    def update(self, key: str, fn: Callable, ttl: Optional[float] = None) -> tuple:
+        """Replace the value of `key` by `fn(value)` atomically, None deletes it
+
+        Returns:
+            tuple: (previous value, new value)
+        """
+        with self.lock:
+            value, expires = self.data.get(key, (None, None))
+            if expires is not None and expires <= time():
+                value = None
+            new = fn(value)
+            if new is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = (new, time() + ttl if ttl else None)
+            return value, new
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add `amount` to the integer of `key`, the expiration is set when the key is created"""
+        with self.lock:
+            value, expires = self.data.get(key, (0, None))
+            if expires is not None and expires <= time():
+                value, expires = 0, None
+            if expires is None and ttl:
+                expires = time() + ttl
+            self.data[key] = (value + amount, expires)
+            return value + amount
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self.data.pop(key, None)
+
+
+class SqliteStore(object):
+    """Key/value store in a SQLite file, shared by the workers of a host
+
+    Values are stored as JSON. The database runs in WAL mode so readers don't
+    block the writer, each thread keeps its own connection.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS store '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)')
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        return conn
+
+    def get(self, key: str) -> Any:
+        row = self.connection().execute(
+            'SELECT value FROM store WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time())).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get_many(self, keys: list) -> dict:
+        """Values of `keys` with one query, missing keys are None"""
+        values = dict.fromkeys(keys)
+        rows = self.connection().execute(
+            f'SELECT key, value FROM store WHERE key IN ({", ".join("?" * len(keys))}) '
+            'AND (expires IS NULL OR expires > ?)',
+            (*keys, time())).fetchall()
+        values.update((key, json.loads(value)) for key, value in rows)
+        return values
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.connection().execute(
+            'INSERT OR REPLACE INTO store (key, value, expires) VALUES (?, ?, ?)',
+            (key, json.dumps(value), time() + ttl if ttl else None))
+
+    def update(self, key: str, fn: Callable, ttl: Optional[float] = None) -> tuple:
+        """Replace the value of `key` by `fn(value)` in a write transaction, None deletes it"""
+        conn = self.connection()
+        now = time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value FROM store WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                               (key, now)).fetchone()
+            value = None if row is None else json.loads(row[0])
+            new = fn(value)
+            if new is None:
+                conn.execute('DELETE FROM store WHERE key = ?', (key,))
+            else:
+                conn.execute('INSERT OR REPLACE INTO store (key, value, expires) VALUES (?, ?, ?)',
+                             (key, json.dumps(new), now + ttl if ttl else None))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return value, new
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        conn = self.connection()
+        now = time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM store WHERE key = ? AND expires <= ?', (key, now))
+            conn.execute(
+                'INSERT INTO store (key, value, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value',
+                (key, amount, now + ttl if ttl else None))
+            value = conn.execute('SELECT value FROM store WHERE key = ?', (key,)).fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return int(value)
+
+    def delete(self, key: str) -> None:
+        self.connection().execute('DELETE FROM store WHERE key = ?', (key,))
+
+
+def create_store(url: Optional[str]):
+    """Store of `SHARED_STORE_URL`: empty or `memory://` for this process, `sqlite:///<path>` for a host"""
+    if not url or url == 'memory://':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SqliteStore(url[len('sqlite:///'):])
+    raise ValueError(f'SHARED_STORE_URL {url} não suportada')
+
+
+def require_shared(store, config: dict, owner: str) -> None:
+    """Refuse a store of this process for `owner` when several processes share `SOCKETIO_MESSAGE_QUEUE`
+
+    Raises:
+        RuntimeError: `SOCKETIO_MESSAGE_QUEUE` is set and `store` is a `MemoryStore`
+    """
+    if config.get('SOCKETIO_MESSAGE_QUEUE') and isinstance(getattr(store, 'backend', store), MemoryStore):
+        raise RuntimeError(f'{owner} precisa de um SHARED_STORE_URL compartilhado pelos processos '
+                           f'quando SOCKETIO_MESSAGE_QUEUE está configurada')
+
+
+class SharedStore(object):
+    """State shared by the workers: cache versions, counters and sessions.
+
+    The backend is chosen by `SHARED_STORE_URL` on `init_app`, until then a
+    `MemoryStore` is used.
+    """
+
+    def __init__(self) -> None:
+        self.backend = MemoryStore()
+
+    def init_app(self, app: Flask) -> None:
+        self.backend = create_store(app.config.get('SHARED_STORE_URL'))
+
+    def get(self, key: str) -> Any:
+        return self.backend.get(key)
+
+    def get_many(self, keys: list) -> dict:
+        """Values of `keys` in one round trip to the backend"""
+        return self.backend.get_many(keys)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.backend.set(key, value, ttl)
+
+    def update(self, key: str, fn: Callable, ttl: Optional[float] = None) -> tuple:
+        return self.backend.update(key, fn, ttl)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        return self.backend.incr(key, amount, ttl)
+
+    def delete(self, key: str) -> None:
+        self.backend.delete(key)
+
+
+shared_store = SharedStore()
@@ -0,0 +1,73 @@
+from collections import Counter
+from time import time
+from typing import Callable, Optional
+
+from flask import Flask
+
+from app.core.store import require_shared, shared_store
+
+
+class LoginThrottle(object):
+    """Sliding-window counters of failed logins by username and by IP.
+
+    Each window is kept as two fixed buckets in the shared store, the count is
+    the current bucket plus the previous one weighted by how much of it is
+    still inside the window. Once `LOGIN_THROTTLE_USERNAME` failures of a
+    username or `LOGIN_THROTTLE_IP` failures of an IP happen within
+    `LOGIN_THROTTLE_WINDOW` seconds the login is rejected before the user
+    query and the password verification. With several processes
+    (`SOCKETIO_MESSAGE_QUEUE`) a store of this process is refused on startup,
+    each worker would count its own failures.
+    """
+
+    def __init__(self, store=None, clock: Callable = time) -> None:
+        self.store = store or shared_store
+        self.clock = clock
+        self.window = 300
+        self.limits = {'username': 5, 'ip': 20}
+        self.counters = Counter()
+
+    def init_app(self, app: Flask) -> None:
+        self.window = app.config.get('LOGIN_THROTTLE_WINDOW', self.window)
+        self.limits = {'username': app.config.get('LOGIN_THROTTLE_USERNAME', self.limits['username']),
+                       'ip': app.config.get('LOGIN_THROTTLE_IP', self.limits['ip'])}
+        require_shared(self.store, app.config, 'O limite de tentativas de login')
+
+    def _keys(self, kind: str, value: str) -> tuple:
+        bucket = int(self.clock() // self.window)
+        return f'login:{kind}:{value}:{bucket}', f'login:{kind}:{value}:{bucket - 1}'
+
+    def count(self, kind: str, value: str) -> float:
+        current, previous = self._keys(kind, value)
+        elapsed = (self.clock() % self.window) / self.window
+        return (self.store.get(current) or 0) + (self.store.get(previous) or 0) * (1 - elapsed)
+
+    def blocked(self, username: str, ip: Optional[str]) -> bool:
+        """True when `username` or `ip` reached its limit of failures in the window"""
+        self.counters['checked'] += 1
+        for kind, value in (('username', normalize(username)), ('ip', ip)):
+            if value and self.count(kind, value) >= self.limits[kind]:
+                self.counters[f'blocked_{kind}'] += 1
+                return True
+        return False
+
+    def fail(self, username: str, ip: Optional[str]) -> None:
+        self.counters['failures'] += 1
+        for kind, value in (('username', normalize(username)), ('ip', ip)):
+            if value:
+                self.store.incr(self._keys(kind, value)[0], ttl=self.window * 2)
+
+    def reset(self, username: str) -> None:
+        """Forget the failures of `username` after a successful login"""
+        for key in self._keys('username', normalize(username)):
+            self.store.delete(key)
+
+    def stats(self) -> dict:
+        return dict(self.counters, window=self.window, **{f'limit_{k}': v for k, v in self.limits.items()})
+
+
+def normalize(username: Optional[str]) -> str:
+    return (username or '').strip().lower()
+
+
+login_throttle = LoginThrottle()
@@ -0,0 +1,275 @@
+from collections import Counter, OrderedDict
+from enum import Enum
+from threading import Lock
+from time import monotonic
+from typing import Callable, Optional
+import uuid
+
+from flask import Flask, current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from app.core.permissions import BaseRole, RoleMaskMixin
+from app.core.store import require_shared, shared_store
+
+PENDING_KEY = 'user_cache_pending'
+
+
+def role_name(role) -> Enum:
+    """`BaseRole` of a role, a `Role` or a `RoleSnapshot`"""
+    return role if isinstance(role, Enum) else role.name
+
+
+class RoleSnapshot(object):
+    """Role of a `UserSnapshot`, enough for Flask-Security identity and role checks"""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name) -> None:
+        self.name = name
+
+    def get_permissions(self) -> set:
+        return set()
+
+    def __eq__(self, other) -> bool:
+        return role_name(other) == self.name
+
+    def __hash__(self) -> int:
+        return hash(self.name)
+
+
+class UserSnapshot(RoleMaskMixin):
+    """Read-only copy of an authenticated `User` shared by the requests of a worker.
+
+    The snapshot covers the attributes read by the views, templates and socket
+    events, the queries they start (`tickets`, `teams`, ...) are built from the
+    id without loading the user. Any other attribute is read from the `User` of
+    the current database session, which is counted in `UserCache.fallbacks`
+    and logged, or raises `AttributeError` with `USER_CACHE_STRICT`.
+    """
+
+    __slots__ = ('id', 'fs_uniquifier', 'name', 'username', 'email', 'active',
+                 'temp_password', 'role_mask', 'roles', 'team_ids')
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user, roles: tuple, team_ids: frozenset) -> None:
+        self.id = user.id
+        self.fs_uniquifier = user.fs_uniquifier
+        self.name = user.name
+        self.username = user.username
+        self.email = user.email
+        self.active = user.active
+        self.temp_password = user.temp_password
+        self.role_mask = user.role_mask
+        self.roles = roles
+        self.team_ids = team_ids
+
+    @property
+    def is_active(self) -> bool:
+        return self.active is True
+
+    @property
+    def is_temp_password(self) -> bool:
+        return self.temp_password is True
+
+    @property
+    def model(self):
+        """The `User` of the current database session"""
+        from app.core.db import db
+        from app.models.security import User
+
+        return db.session.get(User, self.id)
+
+    def get_id(self) -> str:
+        return str(self.fs_uniquifier)
+
+    def has_role(self, role) -> bool:
+        if isinstance(role, str):
+            return role in (r.name.name for r in self.roles)
+        return role_name(role) in (r.name for r in self.roles)
+
+    @property
+    def first_name(self) -> str:
+        return self.name.split()[0]
+
+    @property
+    def unreaded_messages(self) -> int:
+        """Read from the database, the counter changes without invalidating the snapshot"""
+        from app.core.db import db
+        from app.models.security import User
+
+        return db.session.query(User.unreaded_count).filter(User.id == self.id).scalar() or 0
+
+    @property
+    def tickets(self):
+        from app.core.db import db
+        from app.models.ticket import Ticket, TicketStageEvent
+
+        return (
+            db.session.query(Ticket)
+            .join(TicketStageEvent, TicketStageEvent.ticket_id == Ticket.id)
+            .filter(TicketStageEvent.user_id == self.id)
+        )
+
+    @property
+    def teams(self):
+        from app.core.db import db
+        from app.models.team import Team
+
+        return db.session.query(Team).filter(Team.id.in_(self.team_ids))
+
+    def tickets_datetime_deadline(self, dt=None):
+        from app.models.security import User
+
+        return User.tickets_datetime_deadline(self, dt)
+
+    def tickets_delay_from_now(self):
+        from app.models.security import User
+
+        return User.tickets_delay_from_now(self)
+
+    def __getattr__(self, name: str):
+        if name.startswith('_') or name in UserSnapshot.__slots__:
+            raise AttributeError(name)
+        user_cache.fallback(name)
+        return getattr(self.model, name)
+
+    def __repr__(self) -> str:
+        return f'<UserSnapshot {self.username}>'
+
+
+def to_model(user):
+    """`User` of a snapshot, other values are returned as they are"""
+    if isinstance(user, UserSnapshot):
+        return user.model
+    return user
+
+
+def load_snapshot(session_token: str) -> Optional[UserSnapshot]:
+    from app.core.membership import membership_index
+    from app.models.security import User
+
+    user = User.query.filter_by(fs_uniquifier=session_token).first()
+    if user is None:
+        return None
+    membership_index.invalidate(user.id)
+    roles = tuple(RoleSnapshot(role) for role in BaseRole if (user.role_mask or 0) & role.mask)
+    return UserSnapshot(user, roles, membership_index.teams_of(user.id))
+
+
+class UserCache(object):
+    """Per-worker cache of `UserSnapshot` keyed by `fs_uniquifier`.
+
+    Each user has a version in the shared store, bumped after a commit that
+    changes the user, its roles or teams, and a global version bumped when a
+    role changes. A snapshot is returned only while both versions are the ones
+    it was loaded with, so the loader costs no database query on the hot path
+    and a rotated `fs_uniquifier` is rejected by every worker on the next
+    request. `USER_CACHE_TTL` bounds the age of a snapshot. With several
+    processes (`SOCKETIO_MESSAGE_QUEUE`) a store of this process is refused on
+    startup, the versions would not reach the other workers.
+    """
+
+    def __init__(self, store=None, loader=None, size: int = 10000, ttl: Optional[float] = 300) -> None:
+        self.store = store
+        self.loader = loader or load_snapshot
+        self.size = size
+        self.ttl = ttl
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.strict = False
+        self.fallbacks = Counter()
+
+    def init_app(self, app: Flask, store) -> None:
+        self.store = store
+        self.size = app.config.get('USER_CACHE_SIZE', self.size)
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+        self.strict = app.config.get('USER_CACHE_STRICT', self.strict)
+        require_shared(store, app.config, 'O cache de usuários')
+
+    def fallback(self, name: str) -> None:
+        """Count a read of `name` that is not in the snapshot and loads the `User`"""
+        if self.strict:
+            raise AttributeError(f'UserSnapshot não tem {name}, adicione ao snapshot')
+        with self.lock:
+            self.fallbacks[name] += 1
+            first = self.fallbacks[name] == 1
+        if first:
+            current_app.logger.warning(f'UserSnapshot.{name} carrega o usuário do banco a cada requisição')
+
+    def _read(self, user_id, extra_keys: Optional[Callable]) -> tuple:
+        """Versions of `user_id` and the values of `extra_keys(user_id)` in one store round trip"""
+        keys = ['user:version', f'user:{user_id}:version']
+        if extra_keys is not None:
+            keys += extra_keys(user_id)
+        values = self.store.get_many(keys)
+        return (values.pop('user:version') or 0, values.pop(f'user:{user_id}:version') or 0), values
+
+    def version(self, user_id) -> tuple:
+        return self._read(user_id, None)[0]
+
+    def get(self, session_token: str) -> Optional[UserSnapshot]:
+        return self.lookup(session_token)[0]
+
+    def lookup(self, session_token: str, extra_keys: Optional[Callable] = None) -> tuple:
+        """Snapshot of `session_token` and the store values of `extra_keys(user_id)`
+
+        A cached snapshot costs one store round trip, which also reads the
+        extra keys, e.g. the session registry entry of the user.
+
+        Returns:
+            tuple: (snapshot or None, {key: value})
+        """
+        entry = self.entries.get(session_token)
+        user_version, values = None, {}
+        if entry is not None:
+            snapshot, loaded_version, loaded_at = entry
+            version, values = self._read(snapshot.id, extra_keys)
+            if (self.ttl is None or monotonic() - loaded_at < self.ttl) and version == loaded_version:
+                return snapshot, values
+            user_version = version[1]
+            with self.lock:
+                self.entries.pop(session_token, None)
+        # versions are read before the user so a concurrent change leaves the entry stale
+        global_version = self.store.get('user:version') or 0
+        snapshot = self.loader(session_token)
+        if snapshot is None:
+            return None, {}
+        if user_version is None:
+            (_, user_version), values = self._read(snapshot.id, extra_keys)
+        version = (global_version, user_version)
+        with self.lock:
+            self.entries[session_token] = (snapshot, version, monotonic())
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return snapshot, values
+
+    def invalidate(self, user_id: Optional[uuid.UUID] = None) -> None:
+        """Expire the snapshots of `user_id` in every worker, or of every user when it is None"""
+        key = 'user:version' if user_id is None else f'user:{user_id}:version'
+        self.store.incr(key)
+
+
+user_cache = UserCache(shared_store)
+
+
+def invalidate_after_commit(target, user_id: Optional[uuid.UUID] = None) -> None:
+    """Invalidate the snapshots of `user_id` once the session of `target` commits"""
+    session = object_session(target)
+    if session is None:
+        user_cache.invalidate(user_id)
+        return
+    session.info.setdefault(PENDING_KEY, set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+    for user_id in session.info.pop(PENDING_KEY, ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_pending(session):
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,159 @@
+import atexit
+from queue import Empty, Full, Queue
+from threading import Lock
+from typing import Optional
+
+from flask import Flask
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.db import db
+
+
+def latest_by_team(rows: list) -> list:
+    """(`team_id`, `create_at`, `id`) of the newest row of each team"""
+    latest = {}
+    for row in rows:
+        if row.get('team_id') is not None:
+            key = (row['create_at'], row['id'])
+            if row['team_id'] not in latest or key > latest[row['team_id']]:
+                latest[row['team_id']] = key
+    return [(team_id, *key) for team_id, key in latest.items()]
+
+
+class MessageWriter(object):
+    """Write-behind buffer for chat messages.
+
+    Messages are emitted to the room as soon as they arrive and the rows are
+    queued here. A background task drains the queue every
+    `CHAT_WRITE_BEHIND_INTERVAL` seconds and persists them with one bulk
+    INSERT, retrying failed batches. Each sender receives a `message_ack` event
+    once its message is saved (or definitely failed), a row whose id already
+    exists is not saved and acknowledged with `ok=False`, unless the batch is
+    being retried, then the rows already in the table were written by the
+    failed attempt and are acknowledged as saved.
+    """
+
+    def __init__(self, app: Optional[Flask] = None, socketio=None) -> None:
+        self.app = None
+        self.socketio = None
+        self.queue = None
+        self.enabled = False
+        self.stopped = False
+        self.lock = Lock()
+        self.stats = {'queued': 0, 'saved': 0, 'failed': 0, 'rejected': 0, 'batches': 0}
+        if app is not None:
+            self.init_app(app, socketio)
+
+    def init_app(self, app: Flask, socketio) -> None:
+        self.app = app
+        self.socketio = socketio
+        self.enabled = app.config.get('CHAT_WRITE_BEHIND', False)
+        self.interval = app.config.get('CHAT_WRITE_BEHIND_INTERVAL', 0.005)
+        self.batch_size = app.config.get('CHAT_WRITE_BEHIND_BATCH_SIZE', 500)
+        self.retries = app.config.get('CHAT_WRITE_BEHIND_RETRIES', 3)
+        self.queue = Queue(maxsize=app.config.get('CHAT_WRITE_BEHIND_QUEUE_SIZE', 10000))
+        if self.enabled:
+            socketio.start_background_task(self._run)
+            atexit.register(self.shutdown)
+
+    def put(self, row: dict, sid: Optional[str] = None, namespace: str = '/chat',
+            client_id: Optional[str] = None) -> bool:
+        """Queue a `Message` row to be persisted
+
+        Args:
+            row (dict): column values of the message, `id` and `create_at` included
+            sid (str, optional): socket that sent the message, receives the `message_ack`
+            namespace (str, optional): namespace of `sid`. Defaults to '/chat'.
+            client_id (str, optional): id given by the client, sent back in the `message_ack`
+
+        Returns:
+            bool: False when the queue is full and the message was not accepted
+        """
+        if self.stopped:
+            return False
+        try:
+            self.queue.put_nowait((row, sid, namespace, client_id))
+        except Full:
+            self._count('rejected', 1)
+            return False
+        self._count('queued', 1)
+        return True
+
+    def _count(self, key: str, amount: int) -> None:
+        with self.lock:
+            self.stats[key] += amount
+
+    def flush(self) -> int:
+        """Persist everything that is in the queue, returns the number of saved messages"""
+        saved = 0
+        while True:
+            batch = self._take(self.batch_size)
+            if not batch:
+                return saved
+            saved += self._write(batch)
+
+    def shutdown(self) -> None:
+        self.stopped = True
+        self.flush()
+
+    def _take(self, size: int) -> list:
+        batch = []
+        while len(batch) < size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self.stopped:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.error(e)
+
+    def _write(self, batch: list) -> int:
+        from app.models.chat import Message
+        from app.models.team import Team
+
+        rows = [row for row, _, _, _ in batch]
+        table = Message.__table__
+        # the ids are generated by the server when the message arrives, so retries are idempotent
+        stmt = insert(table).on_conflict_do_nothing(index_elements=['id']).returning(table.c.id)
+        # the bulk insert skips the `Message` mapper events, so the teams are updated here
+        latest = latest_by_team(rows)
+        touch = Team.touch_last_messages(latest) if latest else None
+        inserted = None
+        with self.app.app_context():
+            for attempt in range(self.retries + 1):
+                try:
+                    inserted = set(db.session.execute(stmt, rows).scalars())
+                    if attempt:
+                        # a failed commit may have written the rows anyway, the ids are ours so existing ones were saved
+                        missing = [row['id'] for row in rows if row['id'] not in inserted]
+                        if missing:
+                            inserted.update(db.session.execute(select(table.c.id).where(table.c.id.in_(missing))).scalars())
+                    if touch is not None:
+                        db.session.execute(touch)
+                    db.session.commit()
+                    break
+                except Exception as e:
+                    inserted = None
+                    db.session.rollback()
+                    self.app.logger.error(self.app.config.get('_ERRORS').get('DB_COMMIT_ERROR'))
+                    self.app.logger.error(e)
+                    self.socketio.sleep(self.interval * 2 ** attempt)
+            db.session.remove()
+        saved = len(inserted) if inserted is not None else 0
+        with self.lock:
+            self.stats['batches'] += 1
+            self.stats['saved'] += saved
+            self.stats['failed'] += len(rows) - saved
+        for row, sid, namespace, client_id in batch:
+            if sid is not None:
+                ok = inserted is not None and row['id'] in inserted
+                self.socketio.emit('message_ack', {'message_id': str(row['id']), 'client_id': client_id, 'ok': ok},
+                                   to=sid, namespace=namespace)
+        return saved
@@ -10,18 +10,7 @@ from sqlalchemy import types
 from typing_extensions import Annotated
 from sqlalchemy.dialects.postgresql import INET
 import enum
-
-class BaseRole(enum.Enum):
-    ADMIN = 0
-    MANAGER_USER = 1
-    SUPPORT = 2
-    LOCAL_ADMIN = 3
-    USER = 4
-    REPORTS = 5
-    COSTUMER = 6
-
-    def __repr__(self) -> str:
-        return super().__repr__()
+from app.core.permissions import BaseRole
 
 str_10 = Annotated[str, 10]
 str_32 = Annotated[str, 32]
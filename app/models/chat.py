@@ -2,10 +2,14 @@ from typing import List, Optional
 from app.models.security import User
 from app.core.db import db
 from app.models.base import BaseModel
+from app.core.membership import membership_index
+from app.utils.kernel import SEARCH_MIN_LENGTH
+from flask import current_app as app
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.hybrid import hybrid_property
 from datetime import datetime
-from sqlalchemy.orm import mapped_column, Mapped
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import joinedload, mapped_column, Mapped
 import uuid
 
 # group_users = db.Table(
@@ -25,6 +29,16 @@ readed_messages = db.Table(
 
 class Message(BaseModel):
     __abstract__ = False
+    __table_args__ = (
+        db.Index("ix_message_team_id_create_at", "team_id", "create_at", "id"),
+        db.Index("ix_message_user_destiny_id_create_at", "user_destiny_id", "create_at", "id"),
+        db.Index(
+            "ix_message_message_trgm",
+            "message",
+            postgresql_using="gin",
+            postgresql_ops={"message": "gin_trgm_ops"},
+        ),
+    )
     message: Mapped[str] = mapped_column(db.Text)
     user_sender_id: Mapped[uuid.UUID] = mapped_column( db.ForeignKey("user.id"))
     user_destiny_id: Mapped[Optional[uuid.UUID]] = mapped_column(db.ForeignKey("user.id"))
@@ -58,14 +72,143 @@ class Message(BaseModel):
             "Não é possível setar a mensagem como privada, informe o usuário de destino para isso"
         )
 
+    def to_dict(self) -> dict:
+        return {
+            "id": str(self.id),
+            "username": self.sender.username,
+            "name": self.sender.name,
+            "message": self.message,
+            "timestamp": self.create_at.isoformat(),
+        }
+
+    @staticmethod
+    def search(
+        user: User,
+        query: str,
+        team: Optional["Team"] = None,
+        before: Optional[tuple] = None,
+        limit: int = 20,
+    ) -> list["Message"]:
+        """Search the messages of the teams of `user` containing `query`, newest first
+
+        The ILIKE filter is served by the trigram index `ix_message_message_trgm`.
+
+        Args:
+            user (User): only messages of the teams of the user are returned
+            query (str): text to search, at least `SEARCH_MIN_LENGTH` characters
+            team (Team, optional): restrict the search to a team. Defaults to None.
+            before (tuple, optional): (datetime, UUID) from `decode_cursor`. Defaults to None.
+            limit (int, optional): page size. Defaults to 20.
+
+        Returns:
+            list[Message]: messages with `sender` and `team` already loaded
+        """
+        query = query.strip()
+        teams = user.team_ids
+        if team is not None:
+            teams = teams & {team.id}
+        if len(query) < SEARCH_MIN_LENGTH or not teams:
+            return []
+        search = (
+            db.session.query(Message)
+            .options(joinedload(Message.sender), joinedload(Message.team))
+            .filter(
+                Message.team_id.in_(teams),
+                Message.message.icontains(query, autoescape=True),
+            )
+        )
+        if before is not None:
+            search = search.filter(
+                db.tuple_(Message.create_at, Message.id) < db.tuple_(*before)
+            )
+        return (
+            search.order_by(Message.create_at.desc(), Message.id.desc())
+            .limit(limit)
+            .all()
+        )
+
+    @staticmethod
+    def inbox(user: User, limit: int = 100) -> list["Message"]:
+        """Unread direct messages of `user`, oldest first
+
+        Served by the index `ix_message_user_destiny_id_create_at`.
+
+        Args:
+            user (User): recipient of the messages
+            limit (int, optional): maximum number of messages. Defaults to 100.
+
+        Returns:
+            list[Message]: messages with `sender` already loaded
+        """
+        return (
+            db.session.query(Message)
+            .options(joinedload(Message.sender))
+            .filter(Message.user_destiny_id == user.id, Message.readed.is_(False))
+            .order_by(Message.create_at, Message.id)
+            .limit(limit)
+            .all()
+        )
+
+    @staticmethod
+    def mark_read(user: User, ids: list) -> int:
+        """Mark the direct messages `ids` of `user` as read and update `User.unreaded_count`
+
+        Returns:
+            int: number of messages that were unread
+        """
+        if not ids:
+            return 0
+        readed = db.session.execute(
+            db.update(Message)
+            .where(
+                Message.id.in_(ids),
+                Message.user_destiny_id == user.id,
+                Message.readed.is_(False),
+            )
+            .values(readed=True)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if readed:
+            db.session.execute(
+                db.update(User)
+                .where(User.id == user.id)
+                .values(unreaded_count=db.func.greatest(User.unreaded_count - readed, 0))
+                .execution_options(synchronize_session=False)
+            )
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(app.config.get("_ERRORS").get("DB_COMMIT_ERROR"))
+            app.logger.error(e)
+            raise Exception("Não foi possível marcar as mensagens como lidas")
+        return readed
+
     def user_can_read(self, user: User) -> bool:
-        if self.team in user.teams:
+        if self.team_id is not None and membership_index.is_member(user.id, self.team_id):
             return True
-        if self.sender == user:
+        if self.user_sender_id == user.id or self.user_destiny_id == user.id:
             return True
         return False
 
 
+@event.listens_for(Message, "after_insert")
+def count_unreaded(mapper, connection, target):
+    if target.user_destiny_id is not None and not target.readed:
+        connection.execute(
+            db.update(User)
+            .where(User.id == target.user_destiny_id)
+            .values(unreaded_count=User.unreaded_count + 1)
+        )
+
+
+event.listen(
+    Message.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
 # class GroupChat(BaseModel):
 #     __abstract__ = False
 #     name = db.mapped_column(db.String(100), nullable=False, unique=True)
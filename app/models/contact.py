@@ -3,10 +3,17 @@ from app.models.base import BaseModel, str_256, str_64
 from app.core.db import db
 from sqlalchemy.ext.hybrid import hybrid_property
 from app.utils.kernel import only_numbers, validate_phone
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Mapped, mapped_column
+from app.core.costumersearch import invalidate_after_commit
 
 class Contact(BaseModel):
     __abstract__ = False
+    __table_args__ = (
+        db.Index('ix_contact_email_prefix', db.func.lower(db.text('email')).label('email'), postgresql_ops={'email': 'varchar_pattern_ops'}),
+        db.Index('ix_contact_phone_principal_prefix', '_phone_principal', postgresql_ops={'_phone_principal': 'varchar_pattern_ops'}),
+        db.Index('ix_contact_phone_secondary_prefix', '_phone_secondary', postgresql_ops={'_phone_secondary': 'varchar_pattern_ops'}),
+    )
     email : Mapped[str_256] = db.mapped_column(db.String(256), index=True, unique=True)
     _phone_principal : Mapped[Optional[str_64]] = db.mapped_column(db.String(60), index=True, unique=True)
     _phone_secondary : Mapped[Optional[str_64]] = db.mapped_column(db.String(60), index=True, unique=True)
@@ -32,4 +39,37 @@ class Contact(BaseModel):
     @phone_secondary.setter
     def phone_secondary(self, value:str) -> None:
         if self.validate_phone(value=value):
-            self._phone_secondary = only_numbers(value)
\ No newline at end of file
+            self._phone_secondary = only_numbers(value)
+
+
+SEARCH_ATTRIBUTES = ('email', '_phone_principal', '_phone_secondary')
+
+
+def invalidate_search(target, deleted: bool = False) -> None:
+    """Drop the cached searches that show the old email or phone of `target` or may find the new ones"""
+    state = inspect(target)
+    shown = set()
+    for name in ('email', '_phone_principal'):
+        history = state.attrs[name].history
+        shown.update(value for value in (*history.deleted, getattr(target, name)) if value)
+    values = {} if deleted else {
+        'email': [(target.email or '').lower()],
+        'number': [target._phone_principal, target._phone_secondary],
+    }
+    invalidate_after_commit(target, values, lambda row: row['email'] in shown or row['phone'] in shown)
+
+
+@event.listens_for(Contact, "after_insert")
+def search_inserted(mapper, connection, target):
+    invalidate_search(target)
+
+
+@event.listens_for(Contact, "after_update")
+def search_updated(mapper, connection, target):
+    if any(inspect(target).attrs[name].history.has_changes() for name in SEARCH_ATTRIBUTES):
+        invalidate_search(target)
+
+
+@event.listens_for(Contact, "after_delete")
+def search_deleted(mapper, connection, target):
+    invalidate_search(target, deleted=True)
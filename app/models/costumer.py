@@ -4,18 +4,39 @@ from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.hybrid import hybrid_property
 from typing import List, Optional
 from re import match as re_match
-from app.utils.kernel import only_numbers, validate_cpf
+from app.utils.kernel import only_numbers, search_text, validate_cpf
 from app.models.ticket import Ticket
+from app.core.costumersearch import invalidate_after_commit
+from sqlalchemy import DDL, event, inspect
 from sqlalchemy.orm import Mapped, mapped_column
 import uuid
 
 class Costumer(BaseModel):
     __abstract__ = False
+    __table_args__ = (
+        db.Index(
+            'ix_costumer_search_name_trgm',
+            'search_name',
+            postgresql_using='gin',
+            postgresql_ops={'search_name': 'gin_trgm_ops'},
+        ),
+        db.Index(
+            'ix_costumer_identifier_prefix',
+            '_identifier',
+            postgresql_ops={'_identifier': 'varchar_pattern_ops'},
+        ),
+    )
     name : Mapped[str_1028]  = mapped_column(index=True, nullable=False)
+    # `search_text` of the name, kept by the `name` set event
+    search_name : Mapped[Optional[str_1028]] = mapped_column()
     _identifier : Mapped[str_32]  = mapped_column(index=True, nullable=False, unique=True)
     identifier_type_id : Mapped[uuid.UUID]  = mapped_column(db.ForeignKey('costumer_identifier_type.id'), nullable=False)
     contact_id : Mapped[uuid.UUID]  = mapped_column(db.ForeignKey('contact.id'), nullable=False)
     address_id : Mapped[uuid.UUID]  = mapped_column(db.ForeignKey('address.id'), nullable=False)
+    # kept by the `Ticket` events, added and filled by `flask count-costumer-tickets`,
+    # NULL until then and `ticket_counts` counts the tickets instead
+    opened_tickets_count : Mapped[Optional[int]] = mapped_column(default=0)
+    closed_tickets_count : Mapped[Optional[int]] = mapped_column(default=0)
 
     @hybrid_property
     def identifier(self) -> str:
@@ -28,13 +49,53 @@ class Costumer(BaseModel):
                 self._identifier = only_numbers(value)
 
     @property
-    def opened_tickets(self):
-        return self.tickets.filter(Ticket._closed != True).count()
-    
+    def opened_tickets(self) -> int:
+        return self.ticket_counts()[0]
+
     @property
-    def closed_tickets(self):
-        return self.tickets.filter(Ticket._closed == True).count()
-    
+    def closed_tickets(self) -> int:
+        return self.ticket_counts()[1]
+
+    def ticket_counts(self) -> tuple:
+        """(opened, closed) from the counters, counted from the tickets while the counters are not filled"""
+        if self.opened_tickets_count is not None and self.closed_tickets_count is not None:
+            return self.opened_tickets_count, self.closed_tickets_count
+        if self.id is None:
+            return 0, 0
+        return Costumer.ticket_stats([self.id])[self.id]
+
+    @staticmethod
+    def ticket_stats(costumer_ids) -> dict:
+        """Opened and closed tickets of many costumers with one GROUP BY
+
+        Args:
+            costumer_ids (iterable): ids of the costumers
+
+        Returns:
+            dict: {costumer_id: (opened, closed)}, costumers without tickets have (0, 0)
+        """
+        costumer_ids = set(costumer_ids)
+        if not costumer_ids:
+            return {}
+        stats = dict.fromkeys(costumer_ids, (0, 0))
+        for costumer_id, opened, closed in db.session.execute(
+            Costumer.ticket_stats_query().where(Ticket.costumer_id.in_(costumer_ids))
+        ):
+            stats[costumer_id] = (opened, closed)
+        return stats
+
+    @staticmethod
+    def ticket_stats_query():
+        """SELECT of (costumer_id, opened, closed) of every costumer with tickets"""
+        return (
+            db.select(
+                Ticket.costumer_id,
+                db.func.count(Ticket.id).filter(Ticket._closed.isnot(True)).label('opened'),
+                db.func.count(Ticket.id).filter(Ticket._closed.is_(True)).label('closed'),
+            )
+            .group_by(Ticket.costumer_id)
+        )
+
 
 
 class CostumerIdentifierType(BaseModel):
@@ -43,3 +104,83 @@ class CostumerIdentifierType(BaseModel):
     clients : Mapped[List['Costumer']]= db.relationship(backref='identifier_type', lazy='dynamic')
 
 
+
+
+def count_ticket(connection, costumer_id, closed: bool, amount: int) -> None:
+    if costumer_id is None:
+        return
+    column = Costumer.closed_tickets_count if closed else Costumer.opened_tickets_count
+    connection.execute(
+        db.update(Costumer)
+        .where(Costumer.id == costumer_id)
+        .values({column: column + amount, Costumer.update_at: Costumer.update_at})
+    )
+
+
+@event.listens_for(Ticket._closed, "set", active_history=True)
+@event.listens_for(Ticket.costumer_id, "set", active_history=True)
+def load_previous_value(target, value, oldvalue, initiator):
+    """Loads the previous value before a change, so `count_updated_ticket` sees it in the history"""
+
+
+@event.listens_for(Ticket, "after_insert")
+def count_inserted_ticket(mapper, connection, target):
+    count_ticket(connection, target.costumer_id, bool(target._closed), 1)
+
+
+@event.listens_for(Ticket, "after_update")
+def count_updated_ticket(mapper, connection, target):
+    state = inspect(target)
+    costumer_id, closed = state.attrs.costumer_id.history, state.attrs._closed.history
+    old_costumer_id = costumer_id.deleted[0] if costumer_id.deleted else target.costumer_id
+    old_closed = bool(closed.deleted[0]) if closed.deleted else bool(target._closed)
+    if (old_costumer_id, old_closed) == (target.costumer_id, bool(target._closed)):
+        return
+    count_ticket(connection, old_costumer_id, old_closed, -1)
+    count_ticket(connection, target.costumer_id, bool(target._closed), 1)
+
+
+@event.listens_for(Ticket, "after_delete")
+def count_deleted_ticket(mapper, connection, target):
+    count_ticket(connection, target.costumer_id, bool(target._closed), -1)
+
+
+@event.listens_for(Costumer.name, "set")
+def normalize_name(target, value, oldvalue, initiator):
+    target.search_name = None if value is None else search_text(value)
+
+
+def search_changed(target, attributes: tuple) -> bool:
+    state = inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in attributes)
+
+
+def invalidate_search(target, deleted: bool = False) -> None:
+    """Drop the cached searches that show `target` or may find its new name or CPF"""
+    values = {} if deleted else {'number': [target._identifier], 'name': [target.search_name]}
+    costumer_id = str(target.id)
+    invalidate_after_commit(target, values, lambda row: row['id'] == costumer_id)
+
+
+@event.listens_for(Costumer, "after_insert")
+def search_inserted(mapper, connection, target):
+    invalidate_search(target)
+
+
+@event.listens_for(Costumer, "after_update")
+def search_updated(mapper, connection, target):
+    # counters and other columns don't change the results
+    if search_changed(target, ('name', '_identifier', 'contact_id')):
+        invalidate_search(target)
+
+
+@event.listens_for(Costumer, "after_delete")
+def search_deleted(mapper, connection, target):
+    invalidate_search(target, deleted=True)
+
+
+event.listen(
+    Costumer.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
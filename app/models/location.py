@@ -3,9 +3,11 @@ from app.models.base import BaseModel,str_128, str_10, str_256, str_64
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.hybrid import hybrid_property
 from typing import List, Optional
+from sqlalchemy import event
 from sqlalchemy.orm import mapped_column, Mapped
 import uuid
 
+from app.core.addresses import address_resolver
 from app.utils.kernel import only_numbers
 
 
@@ -37,7 +39,7 @@ class AddressPostcode(BaseModel):
 
     @hybrid_property
     def code(self):
-        self._code
+        return self._code
 
     @code.setter
     def code(self, value: str) -> None:
@@ -58,6 +60,7 @@ class AddressType(BaseModel):
 
 class City(BaseModel):
     __abstract__ = False
+    __table_args__ = (db.UniqueConstraint('city', 'uf_id', name='uq_city_city_uf_id'),)
     city : Mapped[str_256] = db.mapped_column(db.String(256), index=True, nullable=False, unique=False)
     uf_id : Mapped[uuid.UUID] = db.mapped_column(UUID(as_uuid=True), db.ForeignKey('state_location.id'), nullable=False)#rua, avenida, estrada
     adresses : Mapped[List['Address']]= db.relationship(backref='city', lazy='dynamic')
@@ -66,4 +69,16 @@ class StateLocation(BaseModel):
     __abstract__ = False
     state : Mapped[str_64] = db.mapped_column(index=True, nullable=False, unique=True)
     uf : Mapped[str] = db.mapped_column(index=True, nullable=False, unique=True)
-    cities : Mapped[List['City']]= db.relationship(backref='state', lazy='dynamic')
\ No newline at end of file
+    cities : Mapped[List['City']]= db.relationship(backref='state', lazy='dynamic')
+
+
+@event.listens_for(AddressPostcode, "after_update")
+@event.listens_for(AddressPostcode, "after_delete")
+@event.listens_for(AddressType, "after_update")
+@event.listens_for(AddressType, "after_delete")
+@event.listens_for(City, "after_update")
+@event.listens_for(City, "after_delete")
+@event.listens_for(StateLocation, "after_update")
+@event.listens_for(StateLocation, "after_delete")
+def clear_addresses(mapper, connection, target):
+    address_resolver.clear()
@@ -1,7 +1,7 @@
 from typing import Optional
 from flask import current_app as app
 from flask_security.utils import hash_password, verify_password
-from sqlalchemy import cast, extract, Date
+from sqlalchemy import cast, event, extract, Date
 from sqlalchemy.ext.hybrid import hybrid_property
 from datetime import date, datetime, timedelta
 from flask_security.models import fsqla_v3 as fsqla
@@ -15,11 +15,23 @@ from app.core.db import db
 from app.utils.kernel import validate_password
 from app.utils.datetime import format_elapsed_time
 from app.models.base import BaseModel, str_32, str_512, str_128, str_256, BaseRole
+from app.core.usercache import invalidate_after_commit
+from app.core.permissions import RoleMaskMixin
+from app.core.hashing import hashing_pool
 from datetime import datetime
 from typing import List
 from sqlalchemy.schema import Sequence
 
 
+def verify_and_rehash(password: str, password_hash: str) -> tuple:
+    """Returns (valid, new hash), the new hash is None unless the password context asks for an update"""
+    if not verify_password(password, password_hash):
+        return False, None
+    if app.extensions["security"].pwd_context.needs_update(password_hash):
+        return True, hash_password(password)
+    return True, None
+
+
 roles_users = db.Table(
     "roles_users",
     db.Column("user_id", UUID(as_uuid=True), db.ForeignKey("user.id")),
@@ -38,7 +50,7 @@ group_services_users = db.Table(
 )
 
 
-class User(BaseModel, UserMixin):
+class User(BaseModel, RoleMaskMixin, UserMixin):
     __abstract__ = False
     username: Mapped[str_32] = db.mapped_column(index=True, unique=True)
     name: Mapped[str_512] = db.mapped_column(index=True)
@@ -59,6 +71,8 @@ class User(BaseModel, UserMixin):
     )
     confirmed_at: Mapped[Optional[datetime]]
     login_count: Mapped[Optional[int]] = db.mapped_column(default=0)
+    unreaded_count: Mapped[int] = db.mapped_column(default=0, server_default="0")
+    role_mask: Mapped[int] = db.mapped_column(default=0, server_default="0")
     # session_token = db.mapped_column(db.String(256), index=True)
     current_login_network_id: Mapped[Optional[uuid.UUID]] = db.mapped_column(
         db.ForeignKey("network.id")
@@ -101,52 +115,10 @@ class User(BaseModel, UserMixin):
         return str(self.fs_uniquifier)
 
     @property
-    def is_admin(self):
-        if any([role.is_admin for role in self.roles.all()]):
-            return True
-        return False
-
-    @property
-    def is_manager_user(self):
-        if any([role.is_manager_user for role in self.roles.all()]):
-            return True
-        return False
+    def team_ids(self) -> frozenset:
+        from app.core.membership import membership_index
 
-    @property
-    def is_editor(self):
-        if any([role.is_editor for role in self.roles.all()]):
-            return True
-        return False
-
-    @property
-    def is_aux_editor(self):
-        if any([role.is_aux_editor for role in self.roles.all()]):
-            return True
-        return False
-
-    @property
-    def can_edit(self):
-        if any([role.can_edit for role in self.roles.all()]):
-            return True
-        return False
-
-    @property
-    def is_support(self):
-        if any([role.is_support for role in self.roles.all()]):
-            return True
-        return False
-
-    @property
-    def has_support(self):
-        if any([role.has_support for role in self.roles.all()]):
-            return True
-        return False
-
-    @property
-    def is_viewer(self):
-        if any([role.is_viewer for role in self.roles.all()]):
-            return True
-        return False
+        return membership_index.teams_of(self.id)
 
     @property
     def is_temp_password(self):
@@ -154,32 +126,21 @@ class User(BaseModel, UserMixin):
 
     @hybrid_property
     def current_login_ip(self):
-        if self.sessions.first() is None:
+        login_session = self.sessions.first()
+        if login_session is None:
             return None
-        return self.sessions.first().ip
+        return login_session.network.ip
 
     @current_login_ip.setter
     def current_login_ip(self, ip):
+        """Point `current_login_network_id` to the `Network` of `ip`, the caller commits"""
         from app.models.network import Network
 
         network = Network.query.filter(Network.ip == ip).first()
         if network is None:
-            network = Network()
-            network.ip = ip
-            try:
-                db.session.add(network)
-                db.session.commit()
-            except Exception as e:
-                app.logger.error(app.config.get("_ERRORS").get("DB_COMMIT_ERROR"))
-                app.logger.error(e)
-                raise Exception("Não foi possível salvar o IP")
+            network = Network(id=uuid.uuid4(), ip=ip)
+            db.session.add(network)
         self.current_login_network_id = network.id
-        try:
-            db.session.commit()
-        except Exception as e:
-            app.logger.error(app.config.get("_ERRORS").get("DB_COMMIT_ERROR"))
-            app.logger.error(e)
-            raise Exception("Não foi possível salvar o IP")
 
     @hybrid_property
     def password(self):
@@ -189,7 +150,7 @@ class User(BaseModel, UserMixin):
     def password(self, password):
         _validate_password = validate_password(password)
         if _validate_password["ok"]:
-            self._password = hash_password(password)
+            self._password = hashing_pool.run(hash_password, password)
         else:
             raise ValueError("Não foi possível validar a senha")
 
@@ -198,7 +159,14 @@ class User(BaseModel, UserMixin):
         return format_elapsed_time(self.last_seen)
 
     def check_password(self, password):
-        return verify_password(password, self.password)
+        return hashing_pool.run(verify_password, password, self.password)
+
+    def verify_and_upgrade_password(self, password) -> bool:
+        """Check `password` and rehash it when the hash parameters changed, the caller commits"""
+        valid, upgraded = hashing_pool.run(verify_and_rehash, password, self.password)
+        if upgraded is not None:
+            self._password = upgraded
+        return valid
 
     @property
     def format_create_date(self) -> str:
@@ -244,38 +212,26 @@ class User(BaseModel, UserMixin):
         return self.tickets_datetime_deadline(dt)
 
     @property
-    def unreaded_messages(self):
-        from app.models.chat import Message
-
-        total_messages = (
-            db.session.query(db.func.count(Message.id).label("cnt"))
-            .join(User.received_messages)
-            .filter(User.id == self.id)
-            .subquery()
-        )
-
-        read_msg = (
-            db.session.query(db.func.count(Message.id).label("cnt"))
-            .join(User.readed_messages)
-            .filter(User.id == self.id)
-            .subquery()
-        )
-        count_unread = db.session.query(total_messages.c.cnt - read_msg.c.cnt).scalar()
-        return count_unread
+    def unreaded_messages(self) -> int:
+        """Unread direct messages, kept by the `Message` insert and `Message.mark_read`"""
+        return self.unreaded_count or 0
 
     @property
     def teams_ordered_by_last_message(self):
         from app.models.team import Team
-        from app.models.chat import Message
 
-        query = (
+        return (
             db.session.query(Team)
-            .join(Team.users)
-            .join(Team.messages)
-            .filter(User.id == self.id)
-            .order_by(Message.create_at.desc())
+            .filter(Team.id.in_(self.team_ids))
+            .order_by(*Team.by_last_message())
+        )
+
+    @staticmethod
+    def query_online(seconds: int = 300):
+        """Users seen in the last `seconds`, `last_seen` is written by the activity tracker"""
+        return User.query.filter(
+            User.last_seen >= datetime.utcnow() - timedelta(seconds=seconds)
         )
-        return query
 
     @staticmethod
     def query_by_month_year(year: int, month: int):
@@ -312,32 +268,66 @@ class Role(BaseModel, RoleMixin):
 
     @property
     def is_admin(self):
-        if self.level == BaseRole.ADMIN:
-            return True
-        return False
+        return self.name == BaseRole.ADMIN
 
     @property
     def is_manager_user(self):
-        if self.level == BaseRole.MANAGER_USER:
-            return True
-        return False
+        return self.name == BaseRole.MANAGER_USER
 
     @property
     def is_support(self):
-        if self.level in BaseRole.SUPPORT:
-            return True
-        return False
+        return self.name == BaseRole.SUPPORT
 
     @property
     def has_support(self):
-        if self.level in [BaseRole.SUPPORT, BaseRole.MANAGER_USER, BaseRole.ADMIN]:
-            return True
-        return False
+        return self.name in (BaseRole.SUPPORT, BaseRole.MANAGER_USER, BaseRole.ADMIN)
+
+    @staticmethod
+    def mask_of(user_id):
+        """SQL bitmask of the roles of `user_id`, the `BaseRole.mask` of each role"""
+        bits = db.case(*[(Role.name == role, role.mask) for role in BaseRole], else_=0)
+        return (
+            db.select(db.func.coalesce(db.func.bit_or(bits), 0))
+            .select_from(roles_users)
+            .join(Role, Role.id == roles_users.c.role_id)
+            .where(roles_users.c.user_id == user_id)
+            .scalar_subquery()
+        )
 
     def __repr__(self):
         return f"<Role {self.name.name}>"
 
 
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_user(mapper, connection, target):
+    invalidate_after_commit(target, target.id)
+
+
+@event.listens_for(User.roles, "append")
+def add_role_mask(target, value, initiator):
+    target.role_mask = (target.role_mask or 0) | value.name.mask
+    if target.id is not None:
+        invalidate_after_commit(target, target.id)
+
+
+@event.listens_for(User.roles, "remove")
+def remove_role_mask(target, value, initiator):
+    target.role_mask = (target.role_mask or 0) & ~value.name.mask
+    if target.id is not None:
+        invalidate_after_commit(target, target.id)
+
+
+@event.listens_for(Role, "after_update")
+@event.listens_for(Role, "after_delete")
+def invalidate_role(mapper, connection, target):
+    users = db.select(roles_users.c.user_id).where(roles_users.c.role_id == target.id)
+    connection.execute(
+        db.update(User).where(User.id.in_(users)).values(role_mask=Role.mask_of(User.id))
+    )
+    invalidate_after_commit(target)
+
+
 class LoginSession(BaseModel):
     __abstract__ = False
     user_id: Mapped[uuid.UUID] = db.mapped_column(
@@ -345,3 +335,4 @@ class LoginSession(BaseModel):
     )
     location: Mapped[str_128] = db.mapped_column(nullable=True)
     network_id: Mapped[uuid.UUID] = db.mapped_column(db.ForeignKey("network.id"))
+    last_seen_at: Mapped[Optional[datetime]] = db.mapped_column(db.DateTime(timezone=True))
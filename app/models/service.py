@@ -5,6 +5,7 @@ from app.core.db import db
 from sqlalchemy import event
 from sqlalchemy.orm.interfaces import EXT_STOP
 from sqlalchemy.orm import mapped_column, Mapped
+from app.core.assignment import assignment_engine
 import uuid
 
 
@@ -19,8 +20,8 @@ class Service(BaseModel):
     )
     teams: Mapped[List["Team"]] = db.relationship(
         secondary="group_service_team",
-        primaryjoin="foreign(team.c.id)==group_service_team.c.team_id",
-        secondaryjoin="group_service_team.c.id==foreign(service.c.group_id)",
+        primaryjoin="service.c.group_id==foreign(group_service_team.c.group_id)",
+        secondaryjoin="team.c.id==foreign(group_service_team.c.team_id)",
         lazy="dynamic",
         back_populates="services",
         viewonly=True,
@@ -47,3 +48,12 @@ class GroupServiceTeam(BaseModel):
         db.ForeignKey("group_service.id"), nullable=False
     )
     team_id: Mapped[uuid.UUID] = mapped_column(db.ForeignKey("team.id"), nullable=False)
+
+
+@event.listens_for(Service, "after_insert")
+@event.listens_for(Service, "after_update")
+@event.listens_for(GroupServiceTeam, "after_insert")
+@event.listens_for(GroupServiceTeam, "after_update")
+@event.listens_for(GroupServiceTeam, "after_delete")
+def invalidate_routes(mapper, connection, target):
+    assignment_engine.invalidate()
@@ -1,17 +1,24 @@
 from typing import Optional, Any
 import uuid
-from sqlalchemy import asc, desc
+from sqlalchemy import asc, desc, event, inspect
+from sqlalchemy.dialects.postgresql import insert
 from app.models.base import BaseModel, str_512
 from sqlalchemy.dialects.postgresql import UUID
 from app.core.db import db
 from datetime import datetime
 from flask import current_app as app
 from app.models.chat import Message
-from sqlalchemy.orm import mapped_column, Mapped
+from sqlalchemy.orm import joinedload, mapped_column, Mapped
 
 from app.models.security import User
+from app.core import membership
+from app.core.membership import membership_index
+from app.core.usercache import invalidate_after_commit, user_cache
+from app.core.assignment import assignment_engine
 from app.utils.datetime import format_elapsed_time
 
+MEMBERS_INVALIDATE_ALL = 500  # above this many changed users every cached user is dropped
+
 team_administrators = db.Table(
     "team_administrators",
     db.Column("team_id", UUID(as_uuid=True), db.ForeignKey("team.id")),
@@ -24,6 +31,9 @@ class Team(BaseModel):
     __abstract__ = False
     name: Mapped[str_512] = mapped_column(db.String(512), index=True)
     active: Mapped[bool] = mapped_column(db.Boolean, default=False)
+    # kept by `touch_last_messages`, no foreign key so `Team.messages` stays the only join with `Message`
+    last_message_at: Mapped[Optional[datetime]] = mapped_column(db.DateTime(timezone=True))
+    last_message_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True))
     administrators = db.relationship(
         "User",
         secondary=team_administrators,
@@ -64,7 +74,7 @@ class Team(BaseModel):
         "Service",
         secondary="group_service_team",
         primaryjoin="team.c.id==foreign(group_service_team.c.team_id)",
-        secondaryjoin="foreign(group_service_team.c.id)==service.c.group_id",
+        secondaryjoin="foreign(group_service_team.c.group_id)==service.c.group_id",
         lazy="dynamic",
         back_populates="teams",
         viewonly=True,
@@ -82,97 +92,324 @@ class Team(BaseModel):
 
     def remove_user(self, user: User) -> None:
         if isinstance(user, User):
-            self.users.remove(user)
-            try:
-                db.session.commit()
-            except Exception as e:
-                app.logger.error(app.config.get("_ERRORS").get("DB_COMMIT_ERROR"))
-                app.logger.error(e)
-                raise Exception("Não foi possível remover usuário do time")
+            self.remove_members([user.id])
 
     def add_user(self, user: User) -> None:
         if isinstance(user, User):
-            self.users.add(user)
-            try:
-                db.session.commit()
-            except Exception as e:
-                app.logger.error(app.config.get("_ERRORS").get("DB_COMMIT_ERROR"))
-                app.logger.error(e)
-                raise Exception("Não foi possível adicionar usuário ao time")
+            self.add_members([user.id])
 
-    def unreaded_messages(self, user):
-        from app.models.chat import Message
-        from app.models.security import User
+    def member_ids(self) -> set:
+        return {
+            user_id
+            for user_id, in db.session.query(UserTeam.user_id).filter(
+                UserTeam.team_id == self.id
+            )
+        }
 
-        # received_messages = db.session.query(db.func.count(Message.id).label('cnt')).join(User.received_messages)\
-        #         .filter(User.id == user.id, Message.team_id == self.id).subquery()
-        team_messages = (
-            db.session.query(db.func.count(Message.id).label("cnt"))
-            .filter(Message.team_id == self.id)
-            .subquery()
+    def add_members(self, user_ids) -> set:
+        """Add the users of `user_ids` that are not members yet with one INSERT
+
+        Returns:
+            set: ids of the users that were added
+        """
+        added = self._insert_members(set(user_ids))
+        self._commit_members(added, "Não foi possível adicionar usuários ao time")
+        return added
+
+    def remove_members(self, user_ids) -> set:
+        """Remove the members of `user_ids` with one DELETE
+
+        Returns:
+            set: ids of the users that were removed
+        """
+        removed = self._delete_members(set(user_ids))
+        self._commit_members(removed, "Não foi possível remover usuários do time")
+        return removed
+
+    def set_members(self, user_ids) -> tuple:
+        """Make `user_ids` the members of the team, diffing them with the current members
+
+        Returns:
+            tuple: (ids added, ids removed)
+        """
+        user_ids = set(user_ids)
+        current = self.member_ids()
+        added = self._insert_members(user_ids - current)
+        removed = self._delete_members(current - user_ids)
+        self._commit_members(added | removed, "Não foi possível alterar os usuários do time")
+        return added, removed
+
+    def _insert_members(self, user_ids: set) -> set:
+        if not user_ids:
+            return set()
+        table = UserTeam.__table__
+        stmt = (
+            insert(table)
+            .values([{"user_id": user_id, "team_id": self.id} for user_id in user_ids])
+            .on_conflict_do_nothing(index_elements=["user_id", "team_id"])
+            .returning(table.c.user_id)
         )
-        read_msg = (
-            db.session.query(db.func.count(Message.id).label("cnt"))
-            .join(User.readed_messages)
-            .filter(User.id == user.id, Message.team_id == self.id)
-            .subquery()
+        return set(db.session.execute(stmt).scalars())
+
+    def _delete_members(self, user_ids: set) -> set:
+        if not user_ids:
+            return set()
+        table = UserTeam.__table__
+        stmt = (
+            db.delete(table)
+            .where(table.c.team_id == self.id, table.c.user_id.in_(user_ids))
+            .returning(table.c.user_id)
+        )
+        return set(db.session.execute(stmt).scalars())
+
+    def _commit_members(self, changed: set, message: str) -> None:
+        """Commit and invalidate the caches of `changed`, the bulk statements skip the `UserTeam` events"""
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(app.config.get("_ERRORS").get("DB_COMMIT_ERROR"))
+            app.logger.error(e)
+            raise Exception(message)
+        if not changed:
+            return
+        if len(changed) > MEMBERS_INVALIDATE_ALL:
+            changed = (None,)
+        for user_id in changed:
+            membership_index.invalidate(user_id)
+            user_cache.invalidate(user_id)
+        assignment_engine.invalidate()
+
+    def unreaded_messages(self, user):
+        return (
+            db.session.query(db.func.count(Message.id))
+            .select_from(Message)
+            .outerjoin(
+                TeamReadState,
+                db.and_(
+                    TeamReadState.team_id == Message.team_id,
+                    TeamReadState.user_id == user.id,
+                ),
+            )
+            .filter(Message.team_id == self.id, TeamReadState.after_watermark())
+            .scalar()
         )
-        count_unread = db.session.query(team_messages.c.cnt - read_msg.c.cnt).scalar()
-        return count_unread
 
     @property
     def last_message(self):
-        return (
+        if self.last_message_id is None:
+            return None
+        return db.session.get(Message, self.last_message_id)
+
+    def last_messages(self, limit: int = 10) -> Any:
+        return self.messages_before(limit=limit)
+
+    def messages_before(
+        self, before: Optional[tuple] = None, limit: int = 20
+    ) -> list[Message]:
+        """Return a page of messages of the team, newest first, using the keyset
+        (`create_at`, `id`) of the last message of the previous page
+
+        Args:
+            before (tuple, optional): (datetime, UUID) from `decode_cursor`. Defaults to None, the newest messages.
+            limit (int, optional): page size. Defaults to 20.
+
+        Returns:
+            list[Message]: messages with `sender` already loaded
+        """
+        query = (
             db.session.query(Message)
+            .options(joinedload(Message.sender))
             .filter(Message.team_id == self.id)
-            .order_by(desc(Message.create_at))
-            .first()
         )
-
-    def last_messages(self, limit: int = 10) -> Any:
+        if before is not None:
+            query = query.filter(
+                db.tuple_(Message.create_at, Message.id) < db.tuple_(*before)
+            )
         return (
-            db.session.query(Message)
-            .join(Team.messages)
-            .order_by(Message.create_at.desc())
-            .filter(Team.id == self.id)
+            query.order_by(Message.create_at.desc(), Message.id.desc())
             .limit(limit)
+            .all()
         )
 
     @property
     def time_last_message(self):
-        message = (
-            db.session.query(Message)
-            .filter(Message.team == self)
-            .order_by(desc(Message.create_at))
-            .first()
-        )
-        if message is None:
-            return self.create_at
-        return message.create_at
+        return self.last_message_at or self.create_at
 
     @property
     def time_elapsed_last_message(self):
         return format_elapsed_time(self.time_last_message)
 
-    def add_view_message(self, user: User, messages: Optional[list[Message]] = None):
-        if not isinstance(messages, list):
-            messages = self.messages
-
-        for message in messages:
-            if message.user_can_read(user) and user not in message.users_readed:
-                message.users_readed.append(user)
+    def add_view_message(self, user: User) -> None:
+        last_message = (
+            db.session.query(Message.id, Message.create_at)
+            .filter(Message.team_id == self.id)
+            .order_by(Message.create_at.desc(), Message.id.desc())
+            .limit(1)
+            .subquery()
+        )
+        values = {
+            "user_id": user.id,
+            "team_id": self.id,
+            "last_read_at": db.select(last_message.c.create_at).scalar_subquery(),
+            "last_read_message_id": db.select(last_message.c.id).scalar_subquery(),
+        }
+        stmt = insert(TeamReadState).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[TeamReadState.user_id, TeamReadState.team_id],
+            set_={
+                "last_read_at": stmt.excluded.last_read_at,
+                "last_read_message_id": stmt.excluded.last_read_message_id,
+                "update_at": datetime.utcnow(),
+            },
+        )
         try:
+            db.session.execute(stmt)
             db.session.commit()
         except Exception as e:
+            db.session.rollback()
             app.logger.error(app.config.get("_ERRORS").get("DB_COMMIT_ERROR"))
             app.logger.error(e)
             raise Exception("Não foi possível adicionar a leitura às mesagens")
 
     def has_user(self, user: User):
-        return user in self.users
+        return membership_index.is_member(user.id, self.id)
+
+    @staticmethod
+    def sidebar_for(user: User) -> Any:
+        """Return the teams of `user` for the chat sidebar in a single query
+
+        Each row is (`Team`, `last_message`, `last_message_at`, `unreaded`), one
+        row per team, ordered by `Team.last_message_at` (index
+        `ix_team_last_message_at`). The unread count of each team is a range
+        scan of `ix_message_team_id_create_at` after the read watermark.
+
+        Args:
+            user (User): user that owns the sidebar
+
+        Returns:
+            BaseQuery: query with one row for each team of the user
+        """
+        unreaded = (
+            db.select(db.func.count(Message.id))
+            .where(Message.team_id == Team.id, TeamReadState.after_watermark())
+            .correlate(Team, TeamReadState)
+            .scalar_subquery()
+        )
+        last_message = db.aliased(Message, name="last_message")
+        return (
+            db.session.query(
+                Team,
+                last_message.message.label("last_message"),
+                db.func.coalesce(Team.last_message_at, Team.create_at).label(
+                    "last_message_at"
+                ),
+                unreaded.label("unreaded"),
+            )
+            .outerjoin(last_message, last_message.id == Team.last_message_id)
+            .outerjoin(
+                TeamReadState,
+                db.and_(
+                    TeamReadState.team_id == Team.id,
+                    TeamReadState.user_id == user.id,
+                ),
+            )
+            .filter(Team.id.in_(membership_index.teams_of(user.id)))
+            .order_by(*Team.by_last_message())
+        )
+
+    @staticmethod
+    def by_last_message() -> tuple:
+        """Order of the teams by the most recent message, teams without messages last"""
+        return (Team.last_message_at.desc().nulls_last(), Team.create_at.desc())
+
+    @staticmethod
+    def touch_last_messages(messages: list) -> Any:
+        """UPDATE of `last_message_at` and `last_message_id` of the teams of `messages`
+
+        Args:
+            messages (list): (`team_id`, `create_at`, `id`) of inserted messages, at most one per team
+
+        Returns:
+            Update: statement that only moves the columns forward
+        """
+        latest = db.values(
+            db.column("team_id", UUID(as_uuid=True)),
+            db.column("create_at", db.DateTime(timezone=True)),
+            db.column("id", UUID(as_uuid=True)),
+            name="latest",
+        ).data(messages)
+        table = Team.__table__
+        return (
+            db.update(table)
+            .where(
+                table.c.id == latest.c.team_id,
+                db.or_(
+                    table.c.last_message_at.is_(None),
+                    db.tuple_(table.c.last_message_at, table.c.last_message_id)
+                    < db.tuple_(latest.c.create_at, latest.c.id),
+                ),
+            )
+            .values(
+                last_message_at=latest.c.create_at,
+                last_message_id=latest.c.id,
+                update_at=table.c.update_at,
+            )
+        )
+
+
+db.Index("ix_team_last_message_at", Team.last_message_at.desc().nulls_last(), Team.create_at.desc())
+
+
+@event.listens_for(Message, "after_insert")
+def touch_last_message(mapper, connection, target):
+    if target.team_id is not None:
+        connection.execute(
+            Team.touch_last_messages([(target.team_id, target.create_at, target.id)])
+        )
 
 
 class UserTeam(BaseModel):
     __abstract__ = False
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "team_id", name="uq_user_team_user_id_team_id"),
+    )
     user_id = mapped_column(db.ForeignKey("user.id"))
     team_id: Mapped[uuid.UUID] = mapped_column(db.ForeignKey("team.id"))
+
+
+@event.listens_for(UserTeam, "after_insert")
+@event.listens_for(UserTeam, "after_update")
+@event.listens_for(UserTeam, "after_delete")
+def invalidate_membership(mapper, connection, target):
+    membership.invalidate_after_commit(target, target.user_id)
+    invalidate_after_commit(target, target.user_id)
+    assignment_engine.invalidate()
+    history = inspect(target).attrs.user_id.history
+    for user_id in history.deleted or ():
+        membership.invalidate_after_commit(target, user_id)
+        invalidate_after_commit(target, user_id)
+
+
+class TeamReadState(BaseModel):
+    """Read watermark of a user in a team: every message up to
+    (`last_read_at`, `last_read_message_id`) is considered read"""
+
+    __abstract__ = False
+    __table_args__ = (db.UniqueConstraint("user_id", "team_id"),)
+    user_id: Mapped[uuid.UUID] = mapped_column(db.ForeignKey("user.id"), nullable=False)
+    team_id: Mapped[uuid.UUID] = mapped_column(db.ForeignKey("team.id"), nullable=False)
+    last_read_at: Mapped[Optional[datetime]]
+    last_read_message_id: Mapped[Optional[uuid.UUID]] = mapped_column(
+        db.ForeignKey("message.id")
+    )
+
+    @classmethod
+    def after_watermark(cls) -> Any:
+        """Filter for messages newer than the watermark, a user without
+        watermark in the team has all messages unread"""
+        return db.or_(
+            cls.last_read_at.is_(None),
+            db.tuple_(Message.create_at, Message.id)
+            > db.tuple_(cls.last_read_at, cls.last_read_message_id),
+        )
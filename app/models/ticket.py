@@ -8,12 +8,13 @@ from app.models.security import User
 from app.models.team import Team
 from app.utils.datetime import format_elapsed_time
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy import ForeignKeyConstraint, PrimaryKeyConstraint, event
+from sqlalchemy import ForeignKeyConstraint, PrimaryKeyConstraint, event, inspect
 from flask import current_app as app
 import pytz
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.orm import Mapped, Session, mapped_column
 import uuid
 from sqlalchemy.schema import Sequence
+from app.core.assignment import assignment_engine, count_after_commit
 
 utc = pytz.UTC
 
@@ -37,7 +38,7 @@ class Ticket(BaseModel):
     create_network_id: Mapped[uuid.UUID] = mapped_column(db.ForeignKey("network.id"))
     create_user_id: Mapped[uuid.UUID] = mapped_column(db.ForeignKey("user.id"))
     costumer_id: Mapped[uuid.UUID] = mapped_column(
-        db.ForeignKey("costumer.id")
+        db.ForeignKey("costumer.id"), index=True
     )  # Citizen is not nullable
     service_id: Mapped[uuid.UUID] = mapped_column(db.ForeignKey("service.id"))
     comments: Mapped[List["Comment"]] = db.relationship(
@@ -225,7 +226,7 @@ class TicketStageEvent(BaseModel):
 
     def __init__(
         self,
-        ticket_stage: TicketStage,
+        ticket_stage: TicketStage | uuid.UUID,
         ticket: Ticket,
         deadline: Optional[dt] = None,
         team: Optional[Team] = None,
@@ -243,7 +244,7 @@ class TicketStageEvent(BaseModel):
                 app.logger.warning(f"O usuário {user.name} não está no {team.name}")
             else:
                 self.user_id = user.id
-        self.ticket_stage_id = ticket_stage.id
+        self.ticket_stage_id = ticket_stage.id if isinstance(ticket_stage, TicketStage) else ticket_stage
         self.ticket_id = ticket.id
         self.deadline = deadline
         self.info = info
@@ -351,16 +352,60 @@ class TicketStageEvent(BaseModel):
 # @event.listens_for(TicketStage.collection, 'append', propagate=True)
 # def my_append_listener(target, value, initiator):
 #     print("received append event for target: %s" % target)
+@event.listens_for(Session, "before_flush")
+def reserve_assignments(session, flush_context, instances):
+    """Choose the agents of the new tickets before the flush, the mapper events must not query the session"""
+    for target in session.new:
+        if isinstance(target, Ticket):
+            assignment_engine.reserve(target)
+
+
 @event.listens_for(Ticket, "after_insert")
 def receive_after_create(mapper, connection, target):
     from flask_login import current_user
+    from app.core.usercache import to_model
     deadline = dt.today() + timedelta(days=7)
     ts = TicketStage.query.filter(TicketStage.level == 0).first()
     if ts is None:
         raise Exception(ExceptionMessages.TICKET_STAGE_EMPTY)
-    tse = target.add_stage(ticket_stage=ts, user=current_user, deadline=deadline, info='', closed=True)
+    tse = target.add_stage(ticket_stage=ts, user=to_model(current_user), deadline=deadline, info='', closed=True)
+    linked = assignment_engine.assign(target)
     @event.listens_for(db.session, "after_flush", once=True)
     def after_flush(session, context):
         session.add(tse)
+        if linked is not None:
+            session.add(linked)
         # session.commit()
     # db.session.commit()
+
+
+@event.listens_for(TicketStageEvent._closed, "set", active_history=True)
+@event.listens_for(TicketStageEvent.user_id, "set", active_history=True)
+def load_previous_value(target, value, oldvalue, initiator):
+    """Loads the previous value before a change, so `count_updated` sees it in the history"""
+
+
+@event.listens_for(TicketStageEvent, "after_insert")
+def count_inserted(mapper, connection, target):
+    if not target._closed and not getattr(target, "_assignment_reserved", False):
+        count_after_commit(target, target.user_id, 1)
+
+
+@event.listens_for(TicketStageEvent, "after_update")
+def count_updated(mapper, connection, target):
+    state = inspect(target)
+    user_id, closed = state.attrs.user_id.history, state.attrs._closed.history
+    old_user_id = user_id.deleted[0] if user_id.deleted else target.user_id
+    old_closed = bool(closed.deleted[0]) if closed.deleted else bool(target._closed)
+    if (old_user_id, old_closed) == (target.user_id, bool(target._closed)):
+        return
+    if not old_closed:
+        count_after_commit(target, old_user_id, -1)
+    if not target._closed:
+        count_after_commit(target, target.user_id, 1)
+
+
+@event.listens_for(TicketStageEvent, "after_delete")
+def count_deleted(mapper, connection, target):
+    if not target._closed:
+        count_after_commit(target, target.user_id, -1)
@@ -1,8 +1,13 @@
 $(document).ready(function () {
-    socket = io.connect('http://' + document.domain + ':' + location.port + '/chat');
+    // com SOCKETIO_SERIALIZER=msgpack a página deve carregar o socket.io-msgpack-parser
+    var options = window.msgpackParser ? {parser: window.msgpackParser} : {};
+    socket = io.connect('http://' + document.domain + ':' + location.port + '/chat', options);
     // var socket = io();
     socket.on('connect', function() {
-        socket.emit('joined', {});
+        var team_id = $('.messages-container').data('team-id');
+        if (team_id) {
+            socket.emit('joined', {team_id: team_id});
+        }
     });
     socket.on('status', function(data) {
         console.log(data)
@@ -20,6 +25,22 @@ $(document).ready(function () {
           $('.messages-container').scrollTop($('.messages-container')[0].scrollHeight);
       });
 
+    socket.on('resync', function (data) {
+        // mensagens foram descartadas enquanto a conexão estava lenta
+        window.location.reload();
+    });
+
+    socket.on('session_replaced', function (data) {
+        // o usuário entrou em outro navegador, esta sessão não é mais válida
+        window.location.reload();
+    });
+
+    socket.on('message_ack', function (data) {
+        if (!data.ok) {
+            console.log('Mensagem não salva', data.client_id || data.message_id);
+        }
+    });
+
     socket.on('my_response', function (msg, cb) {
         $('#log').append('<br>' + $('<div/>').text('Received #' + msg.count + ': ' + msg.data).html());
         console.log(msg)
@@ -52,8 +73,54 @@ $(document).ready(function () {
 
 
 
+    var history = $('.messages-container');
+    var loading_history = false;
+    function history_item(data) {
+        var item = $('<li class="d-flex justify-content-between mb-4 w-100">'+
+            '<img alt="avatar" class="rounded-circle d-flex align-self-start me-3 shadow-1-strong" width="60">'+
+            '<div class="card w-100">'+
+              '<div class="card-header d-flex justify-content-between p-3">'+
+                '<p class="fw-bold mb-0 message-name"></p>'+
+                '<p class="text-muted small mb-0"><i class="far fa-clock"></i> </p>'+
+              '</div>'+
+              '<div class="card-body">'+
+                '<p class="mb-0 message-text"></p>'+
+              '</div>'+
+           '</div>'+
+          '</li>');
+        item.find('img').attr('src', history.data('avatar'));
+        item.find('.message-name').text(data.name);
+        item.find('.message-text').text(data.message);
+        return item;
+    }
+    $(window).scroll(function () {
+        var cursor = history.attr('data-cursor');
+        if (loading_history || !cursor || $(window).scrollTop() > 50) {
+            return;
+        }
+        loading_history = true;
+        $.getJSON(history.data('history-url'), {before: cursor}, function (data) {
+            var height = $(document).height();
+            $.each(data.messages, function (_, message) {
+                history.prepend(history_item(message));
+            });
+            history.attr('data-cursor', data.cursor || '');
+            $(window).scrollTop($(document).height() - height);
+        }).always(function () {
+            loading_history = false;
+        });
+    });
+
     $('form#send-message').submit(function(event) {
-        socket.emit('message_team', {data: $('#message-text').val()});
+        var message = {data: $('#message-text').val()};
+        if (window.crypto && window.crypto.randomUUID) {
+            message.id = window.crypto.randomUUID();
+        }
+        socket.emit('message_team', message, function (ack) {
+            if (!ack || !ack.ok) {
+                console.log('Mensagem não enviada', ack);
+            }
+        });
         $('#message-text').val('');
         return false;
     });
@@ -0,0 +1,43 @@
+import uuid
+
+from sqlalchemy.dialects import postgresql
+
+from app.core.activity import ActivityTracker
+from app.models.security import LoginSession, User
+
+
+def tracker():
+    activity = ActivityTracker()
+    activity.enabled = True
+    return activity
+
+
+def test_touch_keeps_the_latest_time_of_each_user():
+    activity = tracker()
+    user_id, session_id = uuid.uuid4(), uuid.uuid4()
+    activity.touch(user_id, str(session_id))
+    first = activity.users[user_id]
+    activity.touch(user_id, session_id)
+    activity.touch(uuid.uuid4())
+    assert len(activity.users) == 2
+    assert list(activity.sessions) == [session_id]
+    assert activity.users[user_id] >= first
+    assert activity.stats['touches'] == 3
+
+
+def test_touch_is_ignored_when_disabled():
+    activity = ActivityTracker()
+    activity.touch(uuid.uuid4())
+    assert activity.users == {}
+
+
+def test_update_is_one_statement_per_table():
+    activity = tracker()
+    activity.touch(uuid.uuid4(), uuid.uuid4())
+    activity.touch(uuid.uuid4())
+    for table, column, times in ((User.__table__, 'last_seen', activity.users),
+                                 (LoginSession.__table__, 'last_seen_at', activity.sessions)):
+        sql = str(ActivityTracker._update(table, column, times).compile(dialect=postgresql.dialect()))
+        assert sql.startswith(f'UPDATE {table.name}') or sql.startswith(f'UPDATE "{table.name}"')
+        assert f'greatest({table.name}.{column}' in sql.replace('"', '')
+        assert sql.count('::UUID') == len(times)
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+import uuid
+
+import pytest
+
+from app.core.addresses import PENDING_KEY, AddressResolver, address_resolver, apply_created, discard_created, \
+    fold, normalize_address
+
+
+def address(**values):
+    values.setdefault('postcode', '70.000-000')
+    values.setdefault('type', 'Rua')
+    values.setdefault('name', ' Quadra   1 ')
+    values.setdefault('number', '12')
+    values.setdefault('city', 'Brasília')
+    values.setdefault('uf', 'df')
+    return values
+
+
+def test_normalize_address():
+    assert normalize_address(address()) == {'postcode': '70000000', 'type': 'Rua', 'name': 'Quadra 1',
+                                            'number': 12, 'city': 'Brasília', 'uf': 'DF'}
+    assert normalize_address(address(number=None))['number'] == 0
+    for values, message in ((address(postcode='7000'), 'CEP inválido'), (address(uf='XX'), 'UF inválida'),
+                            (address(city=' '), 'Cidade vazia')):
+        with pytest.raises(ValueError, match=message):
+            normalize_address(values)
+
+
+def test_maps_keep_the_most_recent_keys():
+    resolver = AddressResolver(size=2)
+    session = SimpleNamespace(info={})
+    ids = [uuid.uuid4() for _ in range(3)]
+    resolver.remember('postcode', {('1',): ids[0], ('2',): ids[1]})
+    assert resolver._cached(session, 'postcode', ('1',)) == ids[0]
+    resolver.remember('postcode', {('3',): ids[2]})
+    assert set(resolver.maps['postcode']) == {('1',), ('3',)}
+
+
+def test_created_ids_are_kept_after_commit():
+    address_resolver.clear()
+    id = uuid.uuid4()
+    session = SimpleNamespace(info={PENDING_KEY: {('type', ('Rua',)): id}})
+    assert address_resolver._cached(session, 'type', ('Rua',)) == id
+    discard_created(session)
+    assert address_resolver._cached(session, 'type', ('Rua',)) is None
+    session.info[PENDING_KEY] = {('type', ('Rua',)): id}
+    apply_created(session)
+    assert address_resolver.maps['type'] == {('Rua',): id}
+    address_resolver.clear()
+
+
+def test_normalize_address_rejects_values_longer_than_the_columns():
+    for values, message in ((address(type='R' * 33), 'Tipo de endereço muito longo'),
+                            (address(name='R' * 129), 'Logradouro muito longo'),
+                            (address(city='B' * 257), 'Cidade muito longa'),
+                            (address(number='9' * 11), 'Número inválido')):
+        with pytest.raises(ValueError, match=message):
+            normalize_address(values)
+    assert normalize_address(address(city='B' * 256))['city'] == 'B' + 'b' * 255
+
+
+def test_type_and_city_keys_ignore_case():
+    upper = normalize_address(address(type='RUA', city='RIO DE JANEIRO'))
+    lower = normalize_address(address(type='rua', city='rio de janeiro'))
+    assert (upper['type'], upper['city']) == (lower['type'], lower['city']) == ('Rua', 'Rio de Janeiro')
+    id = uuid.uuid4()
+    assert fold(('BRASÍLIA', id)) == fold(('Brasília', id)) == ('brasília', id)
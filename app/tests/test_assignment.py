@@ -0,0 +1,131 @@
+from collections import Counter
+import uuid
+
+from app.core.assignment import AssignmentEngine
+
+
+def make_engine(open_events=None):
+    service, other = uuid.uuid4(), uuid.uuid4()
+    team_a, team_b = uuid.uuid4(), uuid.uuid4()
+    users = [uuid.uuid4() for _ in range(3)]
+    routes = {'services': {service: (team_a, team_b), other: ()},
+              'members': {team_a: (users[0], users[1]), team_b: (users[2],)}}
+    engine = AssignmentEngine(routes_loader=lambda: routes,
+                              counts_loader=lambda: Counter(open_events(users) if open_events else {}))
+    return engine, service, other, users
+
+
+def test_load_is_spread_evenly():
+    engine, service, _, users = make_engine()
+    chosen = Counter(engine.choose(service)[1] for _ in range(30))
+    assert chosen == {user_id: 10 for user_id in users}
+    assert engine.stats['loads'] == 1
+
+
+def test_least_loaded_member_is_chosen():
+    engine, service, _, users = make_engine(lambda users: {users[0]: 5, users[1]: 1, users[2]: 3})
+    assert [engine.choose(service)[1] for _ in range(2)] == [users[1], users[1]]
+    # tie at 3 open events goes to the agent that waited longer
+    assert engine.choose(service)[1] == users[2]
+    assert engine.choose(service)[1] == users[1]
+
+
+def test_service_without_teams_is_not_routed():
+    engine, _, other, _ = make_engine()
+    assert engine.choose(other) is None
+    assert engine.choose(uuid.uuid4()) is None
+    assert engine.stats['unrouted'] == 2
+
+
+def test_closed_events_release_the_agent():
+    engine, service, _, users = make_engine(lambda users: {users[0]: 1, users[1]: 1, users[2]: 1})
+    assert engine.choose(service)[1] == users[0]
+    engine.release(users[0], 3)
+    assert engine.counts[users[0]] == 0
+    assert engine.choose(service)[1] == users[0]
+    assert engine.report()['max_open'] == 1
+
+
+def new(model, **values):
+    from sqlalchemy import inspect
+    from sqlalchemy.orm import configure_mappers
+
+    configure_mappers()
+    instance = inspect(model).class_manager.new_instance()
+    for key, value in values.items():
+        setattr(instance, key, value)
+    return instance
+
+
+def persistent(session, model, **values):
+    from sqlalchemy.orm import make_transient_to_detached
+
+    instance = new(model, id=uuid.uuid4(), **values)
+    make_transient_to_detached(instance)
+    session.add(instance)
+    return instance
+
+
+def test_reservation_is_kept_on_commit_and_released_on_rollback(monkeypatch):
+    from sqlalchemy.orm import Session
+    from app.core import assignment
+    from app.models.ticket import Ticket
+
+    engine, service, _, users = make_engine()
+    monkeypatch.setattr(assignment, 'assignment_engine', engine)
+    engine._load()
+    engine.stage_id = stage_id = uuid.uuid4()
+    session = Session()
+    ticket = new(Ticket, id=uuid.uuid4(), service_id=service)
+    session.add(ticket)
+    _, team_id, user_id = engine.reserve(ticket)
+    assert session.info[assignment.RESERVED_KEY] == [user_id]
+    assert engine.counts[user_id] == 1
+    tse = engine.assign(ticket)
+    assert (tse.ticket_stage_id, tse.team_id, tse.user_id) == (stage_id, team_id, user_id)
+    assert tse._assignment_reserved is True
+    assert engine.assign(ticket) is None
+    assignment.apply_counts(session)
+    assert assignment.RESERVED_KEY not in session.info
+    assert engine.counts[user_id] == 1
+
+    engine.reserve(ticket)
+    user_id = ticket._assignment[2]
+    assert engine.counts[user_id] == 1
+    assignment.discard_counts(session)
+    assert engine.counts[user_id] == 0
+    assert sum(engine.counts.values()) == 1
+
+
+def test_disabled_engine_reserves_nothing():
+    engine, service, _, _ = make_engine()
+    engine.enabled = False
+    ticket = type('Ticket', (), {'service_id': service})()
+    assert engine.reserve(ticket) is None
+    assert engine.assign(ticket) is None
+
+
+def test_count_updated_follows_reassignment_and_close(monkeypatch):
+    from sqlalchemy.orm import Session
+    from app.core import assignment
+    from app.models.ticket import TicketStageEvent, count_updated
+
+    engine, service, _, users = make_engine(lambda users: {users[0]: 2, users[1]: 1})
+    monkeypatch.setattr(assignment, 'assignment_engine', engine)
+    engine._load()
+    session = Session()
+    tse = persistent(session, TicketStageEvent, user_id=users[0], _closed=False)
+    tse.user_id = users[1]
+    count_updated(None, None, tse)
+    assert session.info[assignment.PENDING_KEY] == [(users[0], -1), (users[1], 1)]
+    assignment.apply_counts(session)
+    assert (engine.counts[users[0]], engine.counts[users[1]]) == (1, 2)
+
+    tse = persistent(session, TicketStageEvent, user_id=users[1], _closed=False)
+    tse._closed = True
+    count_updated(None, None, tse)
+    assignment.discard_counts(session)
+    assert engine.counts[users[1]] == 2
+    count_updated(None, None, tse)
+    assignment.apply_counts(session)
+    assert engine.counts[users[1]] == 1
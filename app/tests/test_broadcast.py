@@ -0,0 +1,50 @@
+import pytest
+from socketio import packet
+from app.core.broadcast import Broadcaster, encoded_size
+
+
+class FakeSocketIO(object):
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data, **kwargs):
+        self.emitted.append((event, data, kwargs))
+
+
+def test_encoded_size():
+    assert encoded_size('ação') == 6
+    assert encoded_size(b'abc') == 3
+    assert encoded_size(['ab', b'c']) == 3
+
+def test_packet_class_counts_encoded_events():
+    broadcaster = Broadcaster()
+    packet_class = broadcaster.packet_class(packet.Packet)
+    encoded = packet_class(packet.EVENT, namespace='/chat', data=['message', {'message': 'oi'}]).encode()
+    packet_class(packet.CONNECT, namespace='/chat').encode()
+    assert broadcaster.counters == {'message.encoded': 1, 'message.bytes': len(encoded)}
+    decoded = packet_class(encoded_packet=encoded)
+    assert decoded.data == ['message', {'message': 'oi'}]
+
+def test_msgpack_packet_round_trip():
+    pytest.importorskip('msgpack')
+    from socketio.msgpack_packet import MsgPackPacket
+    broadcaster = Broadcaster()
+    packet_class = broadcaster.packet_class(MsgPackPacket)
+    payload = ['message', {'username': 'admin', 'message': 'oi', 'timestamp': '2023-01-01T10:00:00'}]
+    encoded = packet_class(packet.EVENT, namespace='/chat', data=payload).encode()
+    assert isinstance(encoded, bytes)
+    assert broadcaster.counters['message.bytes'] == len(encoded)
+    assert packet_class(encoded_packet=encoded).data == payload
+
+def test_emit_once_per_room_and_stats():
+    broadcaster = Broadcaster()
+    socketio = FakeSocketIO()
+    broadcaster.emit(socketio, 'message', {'message': 'oi'}, 'team', '/chat', 3, skip_sid=['a'])
+    broadcaster.emit(socketio, 'message', {'message': 'oi'}, 'team', '/chat', 4)
+    broadcaster.record_encoded('message', 50)
+    broadcaster.record_encoded('message', 70)
+    assert len(socketio.emitted) == 2
+    assert socketio.emitted[0][2] == {'to': 'team', 'namespace': '/chat', 'skip_sid': ['a']}
+    assert socketio.emitted[1][2]['skip_sid'] is None
+    assert broadcaster.stats() == {'message': {'emitted': 2, 'recipients': 7, 'bytes_per_message': 60.0,
+                                               'wire_bytes': 420}}
@@ -0,0 +1,40 @@
+from collections import Counter
+
+from benchmarks.chat_load import assign_rooms, check, compare, load_baselines, percentile, save_baseline, summarize
+from config.config import config
+
+BASELINE = {'messages_per_second': 100, 'p50_ms': 2, 'p99_ms': 10, 'queries_per_message': 1}
+
+
+def test_test_config():
+    assert config['test'].TESTING is True
+    assert config['test'].SQLALCHEMY_DATABASE_URI.endswith('_test')
+
+def test_assign_rooms_is_reproducible_and_balanced():
+    assignment = assign_rooms(10, 3, seed=7)
+    assert assignment == assign_rooms(10, 3, seed=7)
+    assert Counter(assignment) == {0: 4, 1: 3, 2: 3}
+
+def test_summarize():
+    result = summarize(sent=4, throttled=1, latencies=[0.001, 0.002, 0.003], elapsed=2, queries=6)
+    assert result == {'sent': 4, 'throttled': 1, 'delivered': 3, 'messages_per_second': 2,
+                      'p50_ms': 2, 'p99_ms': 3, 'queries_per_message': 1.5}
+    assert percentile([], 99) == 0
+
+def test_compare():
+    assert compare(BASELINE, dict(BASELINE, messages_per_second=85, p99_ms=11.5), 0.2) == []
+    assert compare(BASELINE, dict(BASELINE, messages_per_second=70, p99_ms=13, queries_per_message=2), 0.2) == \
+        ['messages_per_second', 'p99_ms', 'queries_per_message']
+
+def test_baseline_file(tmp_path):
+    path = str(tmp_path / 'baselines' / 'chat_load.json')
+    assert load_baselines(path) == {}
+    save_baseline(path, 'a', BASELINE)
+    save_baseline(path, 'b', BASELINE)
+    assert load_baselines(path) == {'a': BASELINE, 'b': BASELINE}
+
+def test_check_fails_without_baseline(capsys):
+    assert check({}, 'a', BASELINE, 0.2) == 2
+    assert 'Sem baseline para a' in capsys.readouterr().err
+    assert check({'a': BASELINE}, 'a', BASELINE, 0.2) == 0
+    assert check({'a': BASELINE}, 'a', dict(BASELINE, p50_ms=5), 0.2) == 1
@@ -0,0 +1,25 @@
+from sqlalchemy.dialects import postgresql
+
+from app.models.costumer import Costumer
+
+
+def test_ticket_stats_without_costumers_runs_no_query():
+    assert Costumer.ticket_stats([]) == {}
+
+
+def test_counters_default_to_zero():
+    assert Costumer().opened_tickets == 0
+    assert Costumer().closed_tickets == 0
+
+
+def test_counters_are_used_once_filled():
+    costumer = Costumer(opened_tickets_count=2, closed_tickets_count=5)
+    assert costumer.ticket_counts() == (2, 5)
+
+
+def test_ticket_stats_query_counts_with_filters_grouped_by_costumer():
+    sql = ' '.join(str(Costumer.ticket_stats_query().compile(dialect=postgresql.dialect())).split())
+    assert sql.count('count(ticket.id) FILTER (WHERE') == 2
+    assert 'ticket._closed IS NOT true' in sql
+    assert 'ticket._closed IS true' in sql
+    assert sql.endswith('GROUP BY ticket.costumer_id')
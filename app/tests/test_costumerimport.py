@@ -0,0 +1,96 @@
+import random
+
+import pytest
+
+from app.core.costumerimport import Deduplicator, ImportReport, normalize_phone
+from app.utils.kernel import validate_cpf
+
+
+def cpf(digits: str) -> str:
+    for weights in (range(10, 1, -1), range(11, 1, -1)):
+        digits += str(sum(int(a) * b for a, b in zip(digits, weights)) * 10 % 11 % 10)
+    return digits
+
+
+def row(**values):
+    values.setdefault('name', 'Ana Souza')
+    values.setdefault('cpf', cpf('123456789'))
+    values.setdefault('email', 'ana@mail.com')
+    values.setdefault('phone', '+55 61 99999-0000')
+    return values
+
+
+def test_cpf_valid_matches_validate_cpf():
+    pytest.importorskip('numpy')
+    from app.core.costumerimport import cpf_valid
+
+    rng = random.Random(7)
+    values = [cpf(''.join(rng.choice('0123456789') for _ in range(9))) for _ in range(500)]
+    values += [''.join(rng.choice('0123456789') for _ in range(11)) for _ in range(500)]
+    values += ['111.111.111-11', '000.000.000-00', '123.456.789-09', '1234567890', '', 'abc', '529.982.247-25']
+    assert cpf_valid(values).tolist() == [validate_cpf(value) for value in values]
+
+
+def test_parse_chunk_rejects_with_reason():
+    pytest.importorskip('numpy')
+    from app.core.costumerimport import parse_chunk
+
+    rows = [row(name='  Ana   Souza '), row(cpf='111.111.111-11'), row(name=''), row(email='ana'),
+            row(phone='telefone'), row(address_id='x')]
+    accepted, rejects = parse_chunk(list(enumerate(rows, start=2)))
+    assert [(line, reason) for line, reason, _ in rejects] == [
+        (3, 'CPF inválido'), (4, 'Nome vazio'), (5, 'Email inválido'), (6, 'Telefone inválido'), (7, 'Endereço inválido'),
+    ]
+    assert len(accepted) == 1
+    assert accepted[0]['name'] == 'Ana Souza'
+    assert accepted[0]['search_name'] == 'ana souza'
+    assert accepted[0]['phone_principal'] == '5561999990000'
+    assert accepted[0]['phone_secondary'] is None
+
+
+def test_normalize_phone():
+    assert normalize_phone(' 61 9999-0000 ') == '6199990000'
+    assert normalize_phone('') is None
+    assert normalize_phone('telefone') is False
+
+
+def test_deduplicator_checks_database_and_file():
+    deduplicator = Deduplicator(identifiers=['1'], emails=['a@b.c'], phones=['9'])
+    keys = {'identifier': '2', 'email': 'd@e.f', 'phone_principal': '8', 'phone_secondary': None}
+    assert deduplicator.check(dict(keys, identifier='1')) == 'CPF já cadastrado'
+    assert deduplicator.check(dict(keys, phone_secondary='9')) == 'Telefone já cadastrado'
+    assert deduplicator.check(dict(keys, phone_secondary='8')) == 'Telefone repetido no arquivo'
+    assert deduplicator.check(keys) is None
+    assert deduplicator.check(dict(keys, identifier='3')) == 'Email repetido no arquivo'
+
+
+def test_deduplicator_forgets_the_keys_of_unsaved_rows():
+    deduplicator = Deduplicator()
+    keys = {'identifier': '1', 'email': 'a@b.c', 'phone_principal': '9', 'phone_secondary': '8'}
+    assert deduplicator.check(keys) is None
+    assert deduplicator.check(keys) == 'CPF repetido no arquivo'
+    deduplicator.forget([keys])
+    assert deduplicator.check(keys) is None
+
+
+def test_parse_chunk_normalizes_the_address():
+    pytest.importorskip('numpy')
+    from app.core.costumerimport import parse_chunk
+
+    rows = [row(postcode='70000-000', address_type='Rua', address='Quadra 1', number='12', city='Brasília', uf='DF'),
+            row(postcode='70000-000', address_type='Rua', address='Quadra 1', city='Brasília', uf='XX')]
+    accepted, rejects = parse_chunk(list(enumerate(rows, start=2)))
+    assert accepted[0]['address']['postcode'] == '70000000'
+    assert [(line, reason) for line, reason, _ in rejects] == [(3, 'UF inválida')]
+
+
+def test_import_report_is_closed_when_the_import_fails(tmp_path):
+    path = tmp_path / 'rejects.csv'
+    with pytest.raises(RuntimeError):
+        with ImportReport(str(path)) as report:
+            report.reject(2, 'CPF inválido', {'name': 'Ana'})
+            raise RuntimeError('falha')
+    assert report.file is None
+    assert path.read_text(encoding='utf-8').splitlines() == [
+        'linha,motivo,name', '2,CPF inválido,Ana', ',Importação interrompida: falha,',
+    ]
@@ -0,0 +1,91 @@
+from app.core.costumersearch import CostumerSearch, classify, prefix_pattern, term_matches
+
+
+def searcher(calls):
+    def search(kind, term, limit, timeout_ms):
+        calls.append((kind, term))
+        return [{'name': f'{term}{idx}'} for idx in range(limit)]
+    return search
+
+
+def test_classify_by_kind():
+    assert classify('123.456') == ('number', '123456')
+    assert classify('(61) 9999-0000') == ('number', '6199990000')
+    assert classify(' Ana@Mail ') == ('email', 'ana@mail')
+    assert classify('  JOÃO   da  Silva ') == ('name', 'joao da silva')
+    assert classify('Jo') == ('name', None)
+    assert classify('12') == ('number', None)
+
+
+def test_prefix_pattern_escapes_wildcards():
+    assert prefix_pattern('a_b%c') == 'a\\_b\\%c%'
+
+
+def test_hot_prefixes_hit_the_cache():
+    calls = []
+    search = CostumerSearch(searcher(calls))
+    assert len(search.search('José')) == 10
+    assert len(search.search('jose', limit=3)) == 3
+    assert search.search('jo') == []
+    assert calls == [('name', 'jose')]
+    assert search.stats['hits'] == 1
+
+
+def test_cache_evicts_the_least_recent_term():
+    calls = []
+    search = CostumerSearch(searcher(calls), size=2)
+    for term in ('ana', 'bia', 'ana', 'caio', 'bia'):
+        search.search(term)
+    assert calls == [('name', 'ana'), ('name', 'bia'), ('name', 'caio'), ('name', 'bia')]
+    search.clear()
+    assert search.entries == {}
+
+
+def test_term_matches_new_values():
+    values = {'number': ['12345678909', None], 'email': ['ana@mail.com'], 'name': ['ana souza']}
+    assert term_matches('number', '123', values)
+    assert not term_matches('number', '999', values)
+    assert term_matches('email', 'ana@', values)
+    assert term_matches('name', 'souza', values)
+    assert term_matches('name', 'souzza', values)
+    assert not term_matches('name', 'pedro', values)
+
+
+def test_invalidate_drops_only_the_affected_entries():
+    rows = {'jose': [{'id': '1', 'email': 'jose@mail.com', 'phone': None}],
+            'pedro': [{'id': '2', 'email': 'pedro@mail.com', 'phone': None}],
+            'maria': [{'id': '3', 'email': 'maria@mail.com', 'phone': None}]}
+    search = CostumerSearch(lambda kind, term, limit, timeout_ms: rows[term])
+    for term in rows:
+        search.search(term)
+    assert search.invalidate({'name': ['maria souza']}, lambda row: row['id'] == '1') == 2
+    assert list(search.entries) == [('name', 'pedro')]
+
+
+def test_search_raced_by_an_invalidation_is_not_kept():
+    def search(kind, term, limit, timeout_ms):
+        _search.invalidate({'name': ['ana']})
+        return [{'id': '1'}]
+    _search = CostumerSearch(search)
+    assert _search.search('jose') == [{'id': '1'}]
+    assert _search.entries == {}
+
+
+def test_changes_invalidate_after_commit(monkeypatch):
+    from sqlalchemy.orm import Session
+    from app.core import costumersearch
+    from app.models.costumer import Costumer
+
+    _search = CostumerSearch(lambda kind, term, limit, timeout_ms: [{'id': '1'}])
+    monkeypatch.setattr(costumersearch, 'costumer_search', _search)
+    _search.search('maria')
+    session = Session()
+    target = Costumer(name='Maria Souza')
+    session.add(target)
+    costumersearch.invalidate_after_commit(target, {'name': ['maria souza']})
+    assert list(_search.entries) == [('name', 'maria')]
+    costumersearch.discard_pending(session)
+    costumersearch.invalidate_after_commit(target, {'name': ['maria souza']})
+    costumersearch.invalidate_committed(session)
+    assert _search.entries == {}
+    assert costumersearch.PENDING_KEY not in session.info
@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, current_app
+
+from app.core.hashing import HashingBusy, HashingPool
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['PASSWORD_HASH_WORKERS'] = 1
+    app.config['PASSWORD_HASH_QUEUE_SIZE'] = 0
+    app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = 0.1
+    with app.app_context():
+        yield app
+
+
+def test_run_uses_the_app_context(app):
+    pool = HashingPool()
+    pool.init_app(app)
+    assert pool.run(lambda: current_app.name) == app.name
+    report = pool.report()
+    assert report['completed'] == 1 and report['running'] == 0 and report['workers'] == 1
+
+def test_full_pool_rejects_callers(app):
+    pool = HashingPool()
+    pool.init_app(app)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return True
+
+    def in_context():
+        with app.app_context():
+            pool.run(slow)
+    worker = threading.Thread(target=in_context)
+    worker.start()
+    started.wait(5)
+    with pytest.raises(HashingBusy):
+        pool.run(lambda: True)
+    release.set()
+    worker.join()
+    assert pool.report()['rejected'] == 1
+    assert pool.run(lambda: 1) == 1
+
+def test_waiting_callers_time_out(app):
+    pool = HashingPool(workers=1, queue_size=1, timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    def in_context():
+        with app.app_context():
+            pool.run(slow)
+    worker = threading.Thread(target=in_context)
+    worker.start()
+    started.wait(5)
+    start = time.perf_counter()
+    with pytest.raises(HashingBusy):
+        pool.run(lambda: True)
+    assert time.perf_counter() - start >= 0.05
+    release.set()
+    worker.join()
+
+def test_errors_are_raised_and_counted(app):
+    pool = HashingPool()
+    with pytest.raises(ZeroDivisionError):
+        pool.run(lambda: 1 / 0)
+    assert pool.report()['failed'] == 1
+
+
+def test_init_app_shuts_down_the_previous_executor(app):
+    pool = HashingPool()
+    first = pool.executor
+    pool.init_app(app)
+    assert first._shutdown is True
+    assert pool.executor is not first
+    assert pool.run(lambda: True) is True
+    pool.shutdown()
+    assert pool.executor is None
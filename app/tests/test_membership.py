@@ -0,0 +1,63 @@
+from uuid import uuid4
+from app.core.membership import MembershipIndex
+
+
+def index(teams, **kwargs):
+    calls = []
+    def loader(user_id):
+        calls.append(user_id)
+        return frozenset(teams.get(user_id, ()))
+    return MembershipIndex(loader=loader, **kwargs), calls
+
+def test_membership_index_loads_each_user_once():
+    user, team = uuid4(), uuid4()
+    _index, calls = index({user: [team]})
+    assert _index.is_member(user, team) is True
+    assert _index.is_member(user, uuid4()) is False
+    assert calls == [user]
+
+def test_membership_index_invalidate_reloads_user():
+    user, team = uuid4(), uuid4()
+    teams = {user: []}
+    _index, calls = index(teams)
+    assert _index.is_member(user, team) is False
+    teams[user] = [team]
+    _index.invalidate(user)
+    assert _index.is_member(user, team) is True
+    assert calls == [user, user]
+
+def test_membership_index_expires_entries():
+    user = uuid4()
+    _index, calls = index({}, ttl=0)
+    _index.teams_of(user)
+    _index.teams_of(user)
+    assert calls == [user, user]
+
+def test_user_team_is_unique_by_user_and_team():
+    from app.models.team import UserTeam
+    constraints = {tuple(c.name for c in constraint.columns)
+                   for constraint in UserTeam.__table__.constraints
+                   if constraint.__class__.__name__ == 'UniqueConstraint'}
+    assert ('user_id', 'team_id') in constraints
+
+def test_membership_index_drops_a_load_raced_by_an_invalidation():
+    user = uuid4()
+    _index = MembershipIndex(loader=lambda user_id: _index.invalidate(user_id) or frozenset())
+    _index.teams_of(user)
+    assert user not in _index.entries
+
+def test_user_team_changes_invalidate_after_commit():
+    from sqlalchemy.orm import Session
+    from app.core import membership
+    from app.models.team import UserTeam
+
+    user, team = uuid4(), uuid4()
+    membership.membership_index.entries[user] = (frozenset([team]), 0)
+    session = Session()
+    target = UserTeam(user_id=user, team_id=team)
+    session.add(target)
+    membership.invalidate_after_commit(target, user)
+    assert user in membership.membership_index.entries
+    membership.invalidate_committed(session)
+    assert user not in membership.membership_index.entries
+    assert membership.PENDING_KEY not in session.info
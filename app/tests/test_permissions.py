@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+from app.core.permissions import BaseRole, RoleMaskMixin, roles_mask
+
+
+class Holder(RoleMaskMixin):
+    def __init__(self, *roles):
+        self.role_mask = roles_mask(roles)
+
+
+def test_roles_mask():
+    assert roles_mask([]) == 0
+    assert roles_mask([BaseRole.ADMIN, BaseRole.SUPPORT]) == 0b101
+    assert roles_mask([SimpleNamespace(name=BaseRole.REPORTS)]) == BaseRole.REPORTS.mask
+
+def test_permissions_read_the_mask():
+    admin = Holder(BaseRole.ADMIN)
+    assert admin.is_admin and admin.has_support and admin.is_editor and admin.can_edit
+    assert not admin.is_support and not admin.is_viewer
+    support = Holder(BaseRole.SUPPORT)
+    assert support.is_support and support.has_support and support.is_aux_editor and support.can_edit
+    assert not support.is_admin and not support.is_editor
+    user = Holder(BaseRole.USER)
+    assert not any([user.is_admin, user.is_manager_user, user.has_support, user.can_edit, user.is_viewer])
+    assert Holder(BaseRole.REPORTS).is_viewer
+    assert Holder().has_any_role(BaseRole.ADMIN.mask) is False
+
+
+def test_roles_accepted_denies_through_flask_security(monkeypatch):
+    from flask import Flask, g
+    from flask_principal import AnonymousIdentity
+    from app.utils import route
+
+    app = Flask(__name__)
+    handled = []
+    app.extensions['security'] = SimpleNamespace(
+        _unauthorized_callback=None,
+        _unauthz_handler=lambda func_name, params: handled.append((func_name, params)) or 'negado')
+    view = route.roles_accepted(BaseRole.ADMIN)(lambda: 'ok')
+    user = SimpleNamespace(is_authenticated=True, has_any_role=lambda mask: False)
+    monkeypatch.setattr(route, 'current_user', user)
+    with app.test_request_context():
+        g.identity = AnonymousIdentity()
+        assert view() == 'negado'
+        assert handled == [('roles_accepted', [BaseRole.ADMIN])]
+        user.has_any_role = lambda mask: True
+        assert view() == 'ok'
@@ -0,0 +1,108 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from os.path import abspath, dirname
+
+import pytest
+from app.core.pubsub import PayloadAssembler, socketio_options, split_payload
+
+BASE_DIR = abspath(dirname(dirname(dirname(__file__))))
+QUEUE_URL = os.environ.get('TEST_SOCKETIO_MESSAGE_QUEUE')
+
+WORKER = '''
+import sys
+import socketio
+from werkzeug.serving import make_server
+from app.core.pubsub import PostgresManager
+
+url, channel, port = sys.argv[1], sys.argv[2], int(sys.argv[3])
+sio = socketio.Server(async_mode='threading', client_manager=PostgresManager(url, channel=channel))
+
+@sio.on('join')
+def join(sid, room):
+    sio.enter_room(sid, room)
+    return True
+
+@sio.on('say')
+def say(sid, data):
+    sio.emit('heard', data, room=data['room'])
+
+make_server('127.0.0.1', port, socketio.WSGIApp(sio), threaded=True).serve_forever()
+'''
+
+
+def test_split_payload_small_message_is_not_chunked():
+    payload = json.dumps({'method': 'emit', 'data': ['oi']})
+    assert split_payload(payload) == [payload]
+
+def test_split_payload_round_trip():
+    payload = json.dumps({'method': 'emit', 'data': ['ação ' * 5000]})
+    chunks = split_payload(payload)
+    assert len(chunks) > 1
+    assert all(len(chunk.encode()) < 8000 for chunk in chunks)
+    assembler = PayloadAssembler()
+    results = [assembler.feed(chunk) for chunk in reversed(chunks)]
+    assert results[:-1] == [None] * (len(chunks) - 1)
+    assert results[-1] == payload
+    assert assembler.pending == {}
+
+def test_payload_assembler_expires_incomplete_payloads():
+    now = [0.0]
+    assembler = PayloadAssembler(ttl=5, clock=lambda: now[0])
+    lost = split_payload(json.dumps({'data': ['a' * 20000]}))
+    assert assembler.feed(lost[0]) is None
+    now[0] = 6.0
+    chunks = split_payload(json.dumps({'data': ['b' * 20000]}))
+    results = [assembler.feed(chunk) for chunk in chunks]
+    assert results[-1] is not None
+    assert assembler.pending == {}
+    assert assembler.expired == 1
+
+
+def test_socketio_options():
+    assert socketio_options({}) == {}
+    assert socketio_options({'SOCKETIO_MESSAGE_QUEUE': 'redis://localhost', 'SOCKETIO_CHANNEL': 'chask'}) == \
+        {'message_queue': 'redis://localhost', 'channel': 'chask'}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.mark.skipif(QUEUE_URL is None, reason='TEST_SOCKETIO_MESSAGE_QUEUE não configurado')
+def test_room_emit_reaches_clients_of_other_workers():
+    pytest.importorskip('requests')
+    import socketio
+    channel = f'chask_test_{os.getpid()}'
+    ports = [free_port() for _ in range(3)]
+    workers = [subprocess.Popen([sys.executable, '-c', WORKER, QUEUE_URL, channel, str(port)], cwd=BASE_DIR)
+               for port in ports]
+    clients = []
+    try:
+        received = {}
+        for idx, port in enumerate(ports):
+            client = socketio.Client()
+            client.on('heard', lambda data, idx=idx: received.setdefault(idx, data))
+            for _ in range(50):
+                try:
+                    client.connect(f'http://127.0.0.1:{port}', transports=['polling'])
+                    break
+                except socketio.exceptions.ConnectionError:
+                    time.sleep(0.1)
+            clients.append(client)
+        for client in clients[1:]:
+            assert client.call('join', 'team') is True
+        clients[0].emit('say', {'room': 'team', 'message': 'oi'})
+        deadline = time.time() + 10
+        while len(received) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert received == {1: {'room': 'team', 'message': 'oi'}, 2: {'room': 'team', 'message': 'oi'}}
+    finally:
+        for client in clients:
+            client.disconnect()
+        for worker in workers:
+            worker.terminate()
@@ -0,0 +1,59 @@
+from queue import Queue
+from types import SimpleNamespace
+from app.core.ratelimit import RateLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_token_bucket_burst_and_refill():
+    bucket = TokenBucket(rate=1, burst=2, now=0)
+    assert bucket.consume(0) is True
+    assert bucket.consume(0) is True
+    assert bucket.consume(0) is False
+    assert bucket.consume(0.5) is False
+    assert bucket.consume(1) is True
+
+def test_rate_limiter_per_user_and_event():
+    clock = Clock()
+    limiter = RateLimiter(clock=clock)
+    limiter.limits = {'message_team': (1, 1)}
+    assert limiter.allow('user1', 'message_team') is True
+    assert limiter.allow('user1', 'message_team') is False
+    assert limiter.allow('user2', 'message_team') is True
+    assert limiter.allow('user1', 'joined') is True
+    clock.now = 1
+    assert limiter.allow('user1', 'message_team') is True
+    assert limiter.stats()['counters'] == {'message_team.allowed': 3, 'message_team.throttled': 1,
+                                           'joined.allowed': 1}
+
+def test_rate_limiter_skips_and_resyncs_slow_consumers():
+    queues = {'fast': Queue(), 'slow': Queue()}
+    for _ in range(3):
+        queues['slow'].put('event')
+    emitted = []
+    server = SimpleNamespace(
+        manager=SimpleNamespace(eio_sid_from_sid=lambda sid, namespace: sid),
+        eio=SimpleNamespace(sockets={sid: SimpleNamespace(queue=queue) for sid, queue in queues.items()}),
+        emit=lambda event, data, to, namespace: emitted.append((event, data, to)))
+    limiter = RateLimiter()
+    limiter.high_water = 2
+    assert limiter.slow_consumers(server, ['fast', 'slow'], '/chat', 'message') == ['slow']
+    assert limiter.slow_consumers(server, ['fast', 'slow'], '/chat', 'message') == ['slow']
+    assert emitted == []
+    while not queues['slow'].empty():
+        queues['slow'].get()
+    assert limiter.slow_consumers(server, ['fast', 'slow'], '/chat', 'message') == []
+    assert emitted == [('resync', {'dropped': 2}, 'slow')]
+    assert limiter.stats()['counters'] == {'message.dropped': 2, 'message.coalesced': 1}
+
+
+def test_rate_limiter_counts_unreadable_queues():
+    server = SimpleNamespace(manager=SimpleNamespace(eio_sid_from_sid=lambda sid, namespace: sid), eio=None)
+    limiter = RateLimiter()
+    assert limiter.slow_consumers(server, ['sid'], '/chat', 'message') == []
+    assert limiter.stats()['counters'] == {'queue_size.unavailable': 1}
@@ -0,0 +1,46 @@
+import uuid
+
+from app.core.rooms import RoomRegistry, user_room
+
+
+def test_room_registry_counts_members():
+    registry = RoomRegistry()
+    assert registry.join('a', 'team') == 1
+    assert registry.join('b', 'team') == 2
+    assert registry.join('b', 'team') == 2
+    assert registry.count('team') == 2
+    assert registry.count('other') == 0
+
+def test_room_registry_leave_removes_empty_rooms():
+    registry = RoomRegistry()
+    registry.join('a', 'team')
+    assert registry.leave('a', 'team') == 0
+    assert registry.members == {}
+    assert registry.rooms == {}
+    assert registry.leave('a', 'team') == 0
+
+def test_room_registry_disconnect_leaves_every_room():
+    registry = RoomRegistry()
+    registry.join('a', 'team1')
+    registry.join('a', 'team2')
+    registry.join('b', 'team1')
+    assert registry.disconnect('a') == {'team1', 'team2'}
+    assert registry.sids('team1') == {'b'}
+    assert registry.count('team2') == 0
+    assert registry.rooms_of('a') == set()
+
+def test_user_room():
+    user_id = uuid.uuid4()
+    assert user_room(user_id) == f'user:{user_id}'
+    assert user_room(user_id) != user_room(uuid.uuid4())
+
+
+def test_room_registry_hides_counts_with_a_message_queue():
+    from flask import Flask
+
+    registry = RoomRegistry()
+    assert registry.status(2) == {'members': 2}
+    app = Flask(__name__)
+    app.config['SOCKETIO_MESSAGE_QUEUE'] = 'redis://localhost'
+    registry.init_app(app)
+    assert registry.status(2) == {}
@@ -0,0 +1,116 @@
+import uuid
+
+import pytest
+
+from app.core.sessions import SessionRegistry
+from app.core.store import MemoryStore, SharedStore, SqliteStore
+
+
+class Server(object):
+    def __init__(self):
+        self.disconnected = []
+
+    def disconnect(self, sid, namespace=None):
+        self.disconnected.append(sid)
+
+
+class SocketIO(object):
+    def __init__(self):
+        self.server = Server()
+        self.emitted = []
+
+    def emit(self, event, data, to=None, namespace=None):
+        self.emitted.append((event, to))
+
+
+def make_registry():
+    registry = SessionRegistry(MemoryStore())
+    registry.socketio = SocketIO()
+    return registry
+
+
+def test_new_login_disconnects_the_previous_sockets():
+    registry = make_registry()
+    user_id = uuid.uuid4()
+    assert registry.activate(user_id, 'old', uuid.uuid4()) is None
+    assert registry.add_sid(user_id, 'old', 'sid-1')
+    assert registry.add_sid(user_id, 'old', 'sid-2')
+    previous = registry.activate(user_id, 'new', uuid.uuid4())
+    assert previous['sids'] == ['sid-1', 'sid-2']
+    assert registry.socketio.emitted == [('session_replaced', f'user:{user_id}')]
+    assert registry.socketio.server.disconnected == ['sid-1', 'sid-2']
+    assert registry.get(user_id)['sids'] == []
+
+
+def test_only_the_active_token_is_valid():
+    registry = make_registry()
+    user_id = uuid.uuid4()
+    assert registry.is_active(user_id, 'any')
+    registry.activate(user_id, 'old')
+    registry.activate(user_id, 'new')
+    assert registry.is_active(user_id, 'new')
+    assert not registry.is_active(user_id, 'old')
+    assert not registry.add_sid(user_id, 'old', 'sid-1')
+    assert registry.stats()['rejected'] == 1
+
+
+def test_logout_of_a_replaced_session_keeps_the_active_one():
+    registry = make_registry()
+    user_id = uuid.uuid4()
+    registry.activate(user_id, 'old')
+    registry.activate(user_id, 'new')
+    registry.add_sid(user_id, 'new', 'sid-1')
+    registry.deactivate(user_id, 'old')
+    assert registry.get(user_id)['token'] == 'new'
+    registry.remove_sid(user_id, 'sid-1')
+    assert registry.get(user_id)['sids'] == []
+    registry.deactivate(user_id, 'new')
+    assert registry.get(user_id) is None
+
+
+def test_sockets_of_concurrent_workers_are_all_kept(tmp_path):
+    import threading
+    from app.core.store import SqliteStore
+
+    path = str(tmp_path / 'store.db')
+    user_id = uuid.uuid4()
+    SessionRegistry(SqliteStore(path)).activate(user_id, 'token')
+
+    def connect(worker):
+        registry = SessionRegistry(SqliteStore(path))
+        for idx in range(20):
+            assert registry.add_sid(user_id, 'token', f'sid-{worker}-{idx}')
+
+    threads = [threading.Thread(target=connect, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(SessionRegistry(SqliteStore(path)).get(user_id)['sids']) == 80
+
+
+def test_required_registry_rejects_sessions_without_entry():
+    registry = make_registry()
+    registry.required = True
+    user_id = uuid.uuid4()
+    assert not registry.is_active(user_id, 'token')
+    assert not registry.add_sid(user_id, 'token', 'sid-1')
+    registry.activate(user_id, 'token')
+    assert registry.is_active(user_id, 'token')
+    assert registry.add_sid(user_id, 'token', 'sid-1')
+
+
+def config_app(config):
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.config.update(config)
+    return app
+
+
+def test_registry_refuses_a_process_store_with_a_message_queue(tmp_path):
+    config = {'SOCKETIO_MESSAGE_QUEUE': 'redis://localhost'}
+    with pytest.raises(RuntimeError, match='SHARED_STORE_URL'):
+        SessionRegistry(SharedStore()).init_app(config_app(config), SocketIO())
+    SessionRegistry(SqliteStore(str(tmp_path / 'store.db'))).init_app(config_app(config), SocketIO())
+    SessionRegistry(MemoryStore()).init_app(config_app({}), SocketIO())
@@ -0,0 +1,65 @@
+import pytest
+
+from app.core.store import MemoryStore, SharedStore, SqliteStore
+from app.core.throttle import LoginThrottle
+
+
+class Clock(object):
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_throttle(now=0.0):
+    clock = Clock(now)
+    throttle = LoginThrottle(MemoryStore(), clock=clock)
+    throttle.window = 100
+    throttle.limits = {'username': 3, 'ip': 5}
+    return throttle, clock
+
+
+def test_username_is_blocked_after_the_limit():
+    throttle, _ = make_throttle()
+    for _ in range(2):
+        throttle.fail('Ana', '10.0.0.1')
+    assert not throttle.blocked('ana', '10.0.0.2')
+    throttle.fail(' ANA ', '10.0.0.1')
+    assert throttle.blocked('ana', '10.0.0.2')
+    assert not throttle.blocked('bia', '10.0.0.2')
+    assert throttle.stats()['blocked_username'] == 1
+
+def test_ip_is_blocked_across_usernames():
+    throttle, _ = make_throttle()
+    for idx in range(5):
+        throttle.fail(f'user{idx}', '10.0.0.1')
+    assert throttle.blocked('other', '10.0.0.1')
+    assert throttle.stats()['blocked_ip'] == 1
+
+def test_window_slides():
+    throttle, clock = make_throttle(now=150)
+    for _ in range(3):
+        throttle.fail('ana', None)
+    clock.now = 210
+    assert throttle.count('username', 'ana') == 3 * 0.9
+    assert not throttle.blocked('ana', None)
+    clock.now = 300
+    assert throttle.count('username', 'ana') == 0
+
+def test_reset_after_success():
+    throttle, _ = make_throttle()
+    for _ in range(3):
+        throttle.fail('ana', '10.0.0.1')
+    throttle.reset('ana')
+    assert not throttle.blocked('ana', '10.0.0.2')
+
+
+def test_throttle_refuses_a_process_store_with_a_message_queue(tmp_path):
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.config['SOCKETIO_MESSAGE_QUEUE'] = 'redis://localhost'
+    with pytest.raises(RuntimeError, match='SHARED_STORE_URL'):
+        LoginThrottle(SharedStore()).init_app(app)
+    LoginThrottle(SqliteStore(str(tmp_path / 'store.db'))).init_app(app)
@@ -0,0 +1,154 @@
+import uuid
+import pytest
+from types import SimpleNamespace
+
+from app.core.store import MemoryStore, SharedStore, SqliteStore, create_store
+from app.core.usercache import RoleSnapshot, UserCache, UserSnapshot
+from app.core.permissions import BaseRole
+
+
+def make_user(**kwargs):
+    values = dict(id=uuid.uuid4(), fs_uniquifier=str(uuid.uuid4()), name='Ana', username='ana',
+                  email='ana@localhost', active=True, temp_password=False, role_mask=BaseRole.ADMIN.mask)
+    values.update(kwargs)
+    return SimpleNamespace(**values)
+
+def make_cache(users):
+    calls = []
+
+    def loader(token):
+        calls.append(token)
+        user = users.get(token)
+        if user is None:
+            return None
+        return UserSnapshot(user, (RoleSnapshot(BaseRole.ADMIN),), frozenset())
+    return UserCache(MemoryStore(), loader=loader), calls
+
+
+def test_memory_store():
+    store = MemoryStore()
+    assert store.get('a') is None
+    assert store.incr('a') == 1
+    assert store.incr('a', 2) == 3
+    store.set('b', {'x': 1}, ttl=-1)
+    assert store.get('b') is None
+    store.delete('a')
+    assert store.get('a') is None
+
+def test_sqlite_store(tmp_path):
+    store = create_store(f'sqlite:///{tmp_path / "store.db"}')
+    assert isinstance(store, SqliteStore)
+    assert store.incr('a') == 1
+    assert SqliteStore(str(tmp_path / 'store.db')).incr('a', 4) == 5
+    store.set('b', ['x', 1])
+    assert store.get('b') == ['x', 1]
+    store.set('c', 1, ttl=-1)
+    assert store.get('c') is None
+    assert store.incr('c') == 1
+
+def test_snapshot_is_cached_until_the_user_version_changes():
+    user = make_user()
+    cache, calls = make_cache({user.fs_uniquifier: user})
+    snapshot = cache.get(user.fs_uniquifier)
+    assert cache.get(user.fs_uniquifier) is snapshot
+    assert len(calls) == 1
+    cache.invalidate(user.id)
+    assert cache.get(user.fs_uniquifier) is not snapshot
+    assert len(calls) == 2
+    cache.invalidate()
+    cache.get(user.fs_uniquifier)
+    assert len(calls) == 3
+
+def test_rotated_token_is_rejected():
+    user = make_user()
+    users = {user.fs_uniquifier: user}
+    cache, _ = make_cache(users)
+    old = user.fs_uniquifier
+    assert cache.get(old) is not None
+    users.pop(old)
+    cache.invalidate(user.id)
+    assert cache.get(old) is None
+
+def test_cache_size_is_bounded():
+    users = {}
+    for _ in range(3):
+        user = make_user()
+        users[user.fs_uniquifier] = user
+    cache, _ = make_cache(users)
+    cache.size = 2
+    for token in users:
+        cache.get(token)
+    assert list(cache.entries) == list(users)[1:]
+
+def test_snapshot_interface():
+    user = make_user()
+    snapshot = UserSnapshot(user, (RoleSnapshot(BaseRole.ADMIN),), frozenset())
+    assert snapshot.is_authenticated and snapshot.is_active and not snapshot.is_anonymous
+    assert snapshot.get_id() == user.fs_uniquifier
+    assert snapshot.has_role(BaseRole.ADMIN) and not snapshot.has_role(BaseRole.USER)
+    assert snapshot.has_role('ADMIN')
+    assert RoleSnapshot(BaseRole.ADMIN) == BaseRole.ADMIN
+
+class CountingStore(MemoryStore):
+    def __init__(self):
+        super().__init__()
+        self.round_trips = 0
+
+    def get(self, key):
+        self.round_trips += 1
+        return super().get(key)
+
+    def get_many(self, keys):
+        self.round_trips += 1
+        return {key: MemoryStore.get(self, key) for key in keys}
+
+def test_cached_request_runs_no_query_and_one_store_round_trip(monkeypatch):
+    user = make_user()
+    cache, calls = make_cache({user.fs_uniquifier: user})
+    cache.store = store = CountingStore()
+    cache.strict = True
+    store.set(f'session:{user.id}', {'token': user.fs_uniquifier})
+    monkeypatch.setattr(UserSnapshot, 'model', property(lambda self: pytest.fail('the user was loaded')))
+    cache.get(user.fs_uniquifier)
+    store.round_trips = 0
+    snapshot, values = cache.lookup(user.fs_uniquifier, lambda user_id: [f'session:{user_id}'])
+    assert store.round_trips == 1 and len(calls) == 1
+    assert values == {f'session:{user.id}': {'token': user.fs_uniquifier}}
+    # attributes read by the views, templates and socket events
+    assert (snapshot.id, snapshot.name, snapshot.username, snapshot.first_name) == (user.id, 'Ana', 'ana', 'Ana')
+    assert snapshot.is_authenticated and snapshot.has_any_role(BaseRole.ADMIN.mask)
+    assert snapshot.team_ids == frozenset() and snapshot.get_id() == user.fs_uniquifier
+    assert cache.fallbacks == {}
+
+def test_snapshot_fallbacks_are_counted_or_raise(monkeypatch):
+    from flask import Flask
+    from app.core import usercache
+
+    user = make_user()
+    snapshot = UserSnapshot(user, (), frozenset())
+    monkeypatch.setattr(UserSnapshot, 'model', property(lambda self: SimpleNamespace(location='DF')))
+    cache = UserCache(MemoryStore())
+    monkeypatch.setattr(usercache, 'user_cache', cache)
+    with Flask(__name__).app_context():
+        assert snapshot.location == 'DF'
+        assert snapshot.location == 'DF'
+    assert cache.fallbacks == {'location': 2}
+    cache.strict = True
+    with pytest.raises(AttributeError):
+        snapshot.location
+
+def test_store_get_many(tmp_path):
+    for store in (MemoryStore(), SqliteStore(str(tmp_path / 'store.db'))):
+        store.set('a', 1)
+        store.set('b', 2, ttl=-1)
+        assert store.get_many(['a', 'b', 'c']) == {'a': 1, 'b': None, 'c': None}
+
+
+def test_user_cache_refuses_a_process_store_with_a_message_queue(tmp_path):
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.config['SOCKETIO_MESSAGE_QUEUE'] = 'redis://localhost'
+    with pytest.raises(RuntimeError, match='SHARED_STORE_URL'):
+        UserCache().init_app(app, SharedStore())
+    UserCache().init_app(app, SqliteStore(str(tmp_path / 'store.db')))
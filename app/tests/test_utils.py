@@ -1,5 +1,7 @@
 import pytest
-from app.utils.kernel import validate_password, strip_accents, only_letters, order_dict
+from datetime import datetime
+from uuid import uuid4
+from app.utils.kernel import validate_password, strip_accents, only_letters, order_dict, encode_cursor, decode_cursor, highlight
 
 def test_validate_password_only_numbers():
     password = '123'
@@ -70,4 +72,26 @@ def strip_accents_without_accents():
 def strip_accents_with_accents():
         value = 'Acentuação, pontuação ÃOÉ'
         test = strip_accents(value)
-        assert 'Acentuaçao, pontuaçao AOE' == test
\ No newline at end of file
+        assert 'Acentuaçao, pontuaçao AOE' == test
+
+def test_cursor_round_trip():
+    timestamp = datetime(2023, 2, 26, 10, 30, 15, 123456)
+    id = uuid4()
+    assert decode_cursor(encode_cursor(timestamp, id)) == (timestamp, id)
+
+def test_decode_cursor_invalid():
+    with pytest.raises(ValueError):
+        decode_cursor('invalido')
+
+
+def test_highlight_marks_every_occurrence():
+    assert highlight('Placa do veículo, placa nova', 'placa') == \
+        '<mark>Placa</mark> do veículo, <mark>placa</mark> nova'
+
+def test_highlight_escapes_html():
+    assert highlight('<b>cpf</b> inválido', 'cpf') == '&lt;b&gt;<mark>cpf</mark>&lt;/b&gt; inválido'
+
+def test_highlight_snippet_around_term():
+    text = 'a' * 100 + 'renavam' + 'b' * 100
+    result = highlight(text, 'renavam', size=27)
+    assert result == '…' + 'a' * 10 + '<mark>renavam</mark>' + 'b' * 10 + '…'
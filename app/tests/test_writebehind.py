@@ -0,0 +1,94 @@
+from flask import Flask
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from uuid import uuid4
+from app.core import writebehind
+from app.core.writebehind import MessageWriter, latest_by_team
+
+
+def writer(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    return MessageWriter(app, socketio=None)
+
+def test_message_writer_disabled_by_default():
+    assert writer().enabled is False
+
+def test_message_writer_rejects_when_queue_is_full():
+    _writer = writer(CHAT_WRITE_BEHIND_QUEUE_SIZE=2)
+    assert _writer.put({'id': 1}) is True
+    assert _writer.put({'id': 2}) is True
+    assert _writer.put({'id': 3}) is False
+    assert _writer.stats['queued'] == 2
+    assert _writer.stats['rejected'] == 1
+
+def test_message_writer_take_respects_batch_size():
+    _writer = writer()
+    for idx in range(5):
+        _writer.put({'id': idx}, sid=f'sid{idx}')
+    batch = _writer._take(3)
+    assert [row['id'] for row, _, _, _ in batch] == [0, 1, 2]
+    assert _writer.queue.qsize() == 2
+
+def test_message_writer_refuses_after_shutdown():
+    _writer = writer()
+    _writer.stopped = True
+    assert _writer.put({'id': 1}) is False
+
+def test_latest_by_team_keeps_the_newest_message():
+    team, other = uuid4(), uuid4()
+    now = datetime.utcnow()
+    rows = [{'id': uuid4(), 'team_id': team, 'create_at': now},
+            {'id': uuid4(), 'team_id': team, 'create_at': now + timedelta(seconds=1)},
+            {'id': uuid4(), 'team_id': other, 'create_at': now},
+            {'id': uuid4(), 'team_id': None, 'create_at': now + timedelta(seconds=2)}]
+    latest = dict((team_id, (create_at, id)) for team_id, create_at, id in latest_by_team(rows))
+    assert latest == {team: (rows[1]['create_at'], rows[1]['id']),
+                      other: (rows[2]['create_at'], rows[2]['id'])}
+
+
+def test_message_writer_acks_only_inserted_rows(monkeypatch):
+    emitted = []
+    socketio = SimpleNamespace(emit=lambda event, data, **kw: emitted.append(data), sleep=lambda seconds: None)
+    _writer = writer()
+    _writer.socketio = socketio
+    rows = [{'id': uuid4(), 'team_id': None, 'create_at': datetime.utcnow()} for _ in range(2)]
+    result = SimpleNamespace(scalars=lambda: [rows[0]['id']])
+    session = SimpleNamespace(execute=lambda stmt, params=None: result, commit=lambda: None, remove=lambda: None)
+    monkeypatch.setattr(writebehind, 'db', SimpleNamespace(session=session))
+    for idx, row in enumerate(rows):
+        _writer.put(row, sid=f'sid{idx}', client_id=f'c{idx}')
+    assert _writer.flush() == 1
+    assert [(ack['client_id'], ack['ok']) for ack in emitted] == [('c0', True), ('c1', False)]
+    assert _writer.stats['saved'] == 1
+    assert _writer.stats['failed'] == 1
+
+
+def test_message_writer_retry_acks_rows_written_by_a_failed_commit(monkeypatch):
+    emitted = []
+    socketio = SimpleNamespace(emit=lambda event, data, **kw: emitted.append(data), sleep=lambda seconds: None)
+    _writer = writer(_ERRORS={'DB_COMMIT_ERROR': 'erro'})
+    _writer.socketio = socketio
+    rows = [{'id': uuid4(), 'team_id': None, 'create_at': datetime.utcnow()} for _ in range(2)]
+    commits = []
+
+    def execute(stmt, params=None):
+        if params is None:
+            # the failed commit wrote the rows, the retry finds them
+            return SimpleNamespace(scalars=lambda: [row['id'] for row in rows])
+        ids = [] if commits else [row['id'] for row in rows]
+        return SimpleNamespace(scalars=lambda: ids)
+
+    def commit():
+        commits.append(1)
+        if len(commits) == 1:
+            raise RuntimeError('connection lost')
+
+    session = SimpleNamespace(execute=execute, commit=commit, rollback=lambda: None, remove=lambda: None)
+    monkeypatch.setattr(writebehind, 'db', SimpleNamespace(session=session))
+    for idx, row in enumerate(rows):
+        _writer.put(row, sid=f'sid{idx}', client_id=f'c{idx}')
+    assert _writer.flush() == 2
+    assert [ack['ok'] for ack in emitted] == [True, True]
+    assert _writer.stats['saved'] == 2
+    assert _writer.stats['failed'] == 0
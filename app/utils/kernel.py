@@ -1,5 +1,9 @@
 import enum
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
 from re import search, sub, match as re_match
+from uuid import UUID
+from markupsafe import Markup, escape
 from functools import wraps
 from unicodedata import normalize, category
 from flask import request
@@ -7,6 +11,7 @@ from flask import url_for, g, session, request
 
 
 ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_123456789"
+SEARCH_MIN_LENGTH = 3  # trigram index needs at least 3 characters
 
 
 def validate_password(password):
@@ -34,6 +39,18 @@ def strip_accents(string: str):
     return "".join(c for c in normalize("NFD", string) if category(c) != "Mn")
 
 
+def search_text(string: str) -> str:
+    """Lower case `string` without accents and repeated spaces, used to search names
+
+    Args:
+        string (str): text to normalize
+
+    Returns:
+        str: normalized text
+    """
+    return " ".join(strip_accents(string).lower().split())
+
+
 def only_letters(string: str, lower: bool = True) -> str:
     """Return only letter of a given `string`
 
@@ -135,3 +152,67 @@ def validate_phone(value : str) -> bool:
     if _rematch is None:
         return False
     return True
+
+
+def encode_cursor(timestamp: datetime, id: UUID) -> str:
+    """Encode a keyset pagination cursor
+
+    Args:
+        timestamp (datetime): timestamp of the last item of the page
+        id (UUID): id of the last item of the page, used to break ties
+
+    Returns:
+        str: url safe cursor
+    """
+    value = f"{timestamp.isoformat()}|{id}"
+    return urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor created by `encode_cursor`
+
+    Args:
+        cursor (str): cursor received from the client
+
+    Raises:
+        ValueError: if the cursor is malformed
+
+    Returns:
+        tuple: (datetime, UUID) of the last item of the previous page
+    """
+    try:
+        value = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, id = value.split("|")
+        return datetime.fromisoformat(timestamp), UUID(id)
+    except Exception as e:
+        raise ValueError("Cursor inválido") from e
+
+
+def highlight(text: str, term: str, size: int = 80) -> Markup:
+    """Return a snippet of `text` around the first occurrence of `term` with every
+    occurrence wrapped in `<mark>`, case insensitive and html escaped
+
+    Args:
+        text (str): text where `term` was found
+        term (str): searched term
+        size (int, optional): max length of the snippet. Defaults to 80.
+
+    Returns:
+        Markup: safe html snippet
+    """
+    position = text.lower().find(term.lower()) if term else -1
+    start = max(0, position - (size - len(term)) // 2) if position > -1 else 0
+    snippet = text[start:start + size]
+    parts = []
+    lower, found = snippet.lower(), 0
+    while term:
+        idx = lower.find(term.lower(), found)
+        if idx == -1:
+            break
+        parts.append(escape(snippet[found:idx]))
+        parts.append(Markup("<mark>%s</mark>") % snippet[idx:idx + len(term)])
+        found = idx + len(term)
+    parts.append(escape(snippet[found:]))
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if start + size < len(text) else ""
+    return Markup(prefix) + Markup("").join(parts) + Markup(suffix)
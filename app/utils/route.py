@@ -1,11 +1,14 @@
 from functools import wraps
 from flask import abort, request, g, current_app as app
 from flask_login import current_user
+from flask_security import roles_accepted as security_roles_accepted
 from werkzeug.urls import url_parse
 from app.models.network import Network
 from app.models.page import Page
 from app.core.db import db
 from flask_socketio import disconnect, emit
+from app.core.extesions import rate_limiter
+from app.core.permissions import roles_mask
 
 def counter(f):
     @wraps(f)
@@ -62,4 +65,31 @@ def authenticated_only(f):
             disconnect()
         else:
             return f(*args, **kwargs)
-    return wrapped
\ No newline at end of file
+    return wrapped
+
+
+def rate_limited(event):
+    """Throttle a socket event with the token bucket of the current user"""
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            if not rate_limiter.allow(current_user.id, event):
+                return {'ok': False, 'error': 'rate_limited'}
+            return f(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def roles_accepted(*roles):
+    """Allow users with any of `roles`, checked against `role_mask` without queries
+    Other requests go through Flask-Security's `roles_accepted`, so its unauthorized handlers answer them."""
+    mask = roles_mask(roles)
+    def decorator(f):
+        checked = security_roles_accepted(*roles)(f)
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            if current_user.is_authenticated and current_user.has_any_role(mask):
+                return f(*args, **kwargs)
+            return checked(*args, **kwargs)
+        return wrapped
+    return decorator
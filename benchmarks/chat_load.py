@@ -0,0 +1,351 @@
+"""Load test of the team chat: N agents in M team rooms sending messages
+
+The agents, rooms and memberships are created (once) in the database of the
+selected config, the agents log in and join their room, then every agent sends
+`--rate` messages per second during `--duration` seconds. The report has the
+messages/sec, the p50/p99 delivery latency and the database queries per message.
+
+Transports:
+    test-client  flask_socketio test clients in this process, the delivery is
+                 synchronous so the latency is the server time per message.
+    server       the app served by a subprocess and one python-socketio client
+                 (thread) per agent, the latency is from emit to receipt.
+
+Results are compared with the scenario of the `--baseline` file and the
+command exits with 1 when a metric regresses more than `--tolerance` and with
+2 when the scenario has no baseline, `--save-baseline` records the current
+result. Baselines depend on the machine and the database, so they are
+measured and saved where the check runs.
+
+Usage:
+    python benchmarks/chat_load.py --agents 20 --rooms 4 --rate 1 --duration 10
+    python benchmarks/chat_load.py --transport server --agents 50 --rooms 5 --save-baseline
+"""
+import argparse
+import json
+import os
+import random
+import socket as _socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from os.path import abspath, dirname, exists, join
+
+BASE_DIR = abspath(dirname(dirname(__file__)))
+BASELINE = join(BASE_DIR, 'benchmarks', 'baselines', 'chat_load.json')
+AGENT_PREFIX = 'load-agent-'
+ROOM_PREFIX = 'load-room-'
+PASSWORD = 'Abc123'
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def assign_rooms(agents: int, rooms: int, seed: int) -> list:
+    """Room index of each agent, the same for a given seed and every room has an agent"""
+    assignment = [idx % rooms for idx in range(agents)]
+    random.Random(seed).shuffle(assignment)
+    return assignment
+
+
+def scenario(args) -> str:
+    return f'{args.transport}-{args.agents}a-{args.rooms}r-{args.rate:g}mps-{args.duration:g}s'
+
+
+def summarize(sent: int, throttled: int, latencies: list, elapsed: float, queries: int) -> dict:
+    return {
+        'sent': sent,
+        'throttled': throttled,
+        'delivered': len(latencies),
+        'messages_per_second': round(sent / elapsed, 2) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'queries_per_message': round(queries / sent, 3) if sent else 0,
+    }
+
+
+def compare(baseline: dict, result: dict, tolerance: float) -> list:
+    """Return the regressions of `result` against `baseline`"""
+    regressions = []
+    if result['messages_per_second'] < baseline['messages_per_second'] * (1 - tolerance):
+        regressions.append('messages_per_second')
+    for metric in ('p50_ms', 'p99_ms'):
+        if result[metric] > baseline[metric] * (1 + tolerance):
+            regressions.append(metric)
+    if result['queries_per_message'] > baseline['queries_per_message'] + 0.01:
+        regressions.append('queries_per_message')
+    return regressions
+
+
+def check(baselines: dict, name: str, result: dict, tolerance: float) -> int:
+    """Exit code of the comparison of `result` with the baseline of `name`, printing the regressions"""
+    baseline = baselines.get(name)
+    if baseline is None:
+        print(f'Sem baseline para {name}, meça e salve com --save-baseline', file=sys.stderr)
+        return 2
+    regressions = compare(baseline, result, tolerance)
+    for metric in regressions:
+        print(f'Regressão em {metric}: {baseline[metric]} -> {result[metric]}')
+    return 1 if regressions else 0
+
+
+def load_baselines(path: str) -> dict:
+    if not exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, name: str, result: dict) -> None:
+    baselines = load_baselines(path)
+    baselines[name] = result
+    os.makedirs(dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+
+
+def create_app(config: str):
+    sys.path.insert(0, BASE_DIR)
+    from app import create_app
+    app = create_app(config)
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+def query_counter(app) -> list:
+    """Count the statements executed by the engine of `app` in a one item list"""
+    from sqlalchemy import event
+    from app.core.db import db
+    count = [0]
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        count[0] += 1
+    return count
+
+
+def seed(args) -> list:
+    """Create the agents and rooms of the scenario, returns (username, team_id) of each agent"""
+    from app.core.db import db
+    from app.models.network import Network
+    from app.models.security import User
+    from app.models.team import Team, UserTeam
+
+    network = Network.query.filter(Network.ip == '127.0.0.1').first()
+    if network is None:
+        network = Network()
+        network.ip = '127.0.0.1'
+        db.session.add(network)
+        db.session.commit()
+    teams = []
+    for idx in range(args.rooms):
+        name = f'{ROOM_PREFIX}{idx}'
+        team = Team.query.filter(Team.name == name).first()
+        if team is None:
+            team = Team()
+            team.name = name
+            team.active = True
+            db.session.add(team)
+        teams.append(team)
+    db.session.commit()
+    agents = []
+    for idx, room in enumerate(assign_rooms(args.agents, args.rooms, args.seed)):
+        username = f'{AGENT_PREFIX}{idx}'
+        user = User.query.filter(User.username == username).first()
+        if user is None:
+            user = User()
+            user.username = username
+            user.name = f'Agente {idx}'
+            user.email = f'{username}@localhost'
+            user.password = PASSWORD
+            user.active = True
+            user.temp_password = False
+            user.created_network_id = network.id
+            user.confirmed_network_id = network.id
+            db.session.add(user)
+            db.session.flush()
+        team = teams[room]
+        UserTeam.query.filter(UserTeam.user_id == user.id, UserTeam.team_id != team.id,
+                              UserTeam.team_id.in_([t.id for t in teams])).delete(synchronize_session=False)
+        if UserTeam.query.filter(UserTeam.user_id == user.id, UserTeam.team_id == team.id).first() is None:
+            user_team = UserTeam()
+            user_team.user_id = user.id
+            user_team.team_id = team.id
+            db.session.add(user_team)
+        agents.append((username, str(team.id)))
+    db.session.commit()
+    return agents
+
+
+def run_test_client(args) -> dict:
+    app = create_app(args.config)
+    from app.core.extesions import socketio
+    agents = seed(args)
+    clients = []
+    for username, team_id in agents:
+        http = app.test_client()
+        http.post('/auth/login/', data={'username': username, 'password': PASSWORD})
+        client = socketio.test_client(app, namespace='/chat', flask_test_client=http)
+        if not client.emit('joined', {'team_id': team_id}, namespace='/chat', callback=True):
+            raise Exception(f'{username} não entrou na sala {team_id}')
+        clients.append((client, team_id))
+    for client, _ in clients:
+        client.get_received('/chat')
+    queries = query_counter(app)
+    sent = throttled = 0
+    latencies = []
+    interval = 1 / (args.rate * args.agents)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    rng = random.Random(args.seed)
+    while time.perf_counter() < deadline:
+        for client, team_id in clients:
+            scheduled = start + sent * interval
+            if scheduled > time.perf_counter():
+                time.sleep(scheduled - time.perf_counter())
+            emitted = time.perf_counter()
+            ack = client.emit('message_team', {'id': str(uuid.uuid4()), 'data': f'carga {rng.random()}'},
+                              namespace='/chat', callback=True)
+            delivered = time.perf_counter() - emitted
+            sent += 1
+            if not ack or not ack.get('ok'):
+                throttled += 1
+                continue
+            for peer, peer_team in clients:
+                if peer_team == team_id:
+                    latencies.extend(delivered for received in peer.get_received('/chat')
+                                     if received['name'] == 'message')
+    elapsed = time.perf_counter() - start
+    for client, _ in clients:
+        client.disconnect(namespace='/chat')
+    return summarize(sent, throttled, latencies, elapsed, queries[0])
+
+
+def serve(args) -> None:
+    app = create_app(args.config)
+    from app.core.extesions import socketio
+    queries = query_counter(app)
+    app.add_url_rule('/_load/queries', 'load_queries', lambda: {'queries': queries[0]})
+    socketio.run(app, host='127.0.0.1', port=args.port, allow_unsafe_werkzeug=True)
+
+
+def free_port() -> int:
+    with _socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_server(args) -> dict:
+    import requests
+    import socketio as socketio_client
+
+    app = create_app(args.config)
+    with app.app_context():
+        agents = seed(args)
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = subprocess.Popen([sys.executable, __file__, '--serve', '--port', str(port), '--config', args.config],
+                              cwd=BASE_DIR)
+    try:
+        for _ in range(100):
+            try:
+                requests.get(f'{url}/_load/queries', timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        sent_at = {}
+        latencies = []
+        counters = {'sent': 0, 'throttled': 0}
+        lock = threading.Lock()
+        clients = []
+        for username, team_id in agents:
+            http = requests.Session()
+            http.post(f'{url}/auth/login/', data={'username': username, 'password': PASSWORD})
+            client = socketio_client.Client(http_session=http)
+
+            def on_message(data):
+                received = time.perf_counter()
+                with lock:
+                    if data['message_id'] in sent_at:
+                        latencies.append(received - sent_at[data['message_id']])
+            client.on('message', on_message, namespace='/chat')
+            client.connect(url, namespaces=['/chat'], transports=['websocket'])
+            if not client.call('joined', {'team_id': team_id}, namespace='/chat'):
+                raise Exception(f'{username} não entrou na sala {team_id}')
+            clients.append(client)
+        baseline_queries = requests.get(f'{url}/_load/queries').json()['queries']
+
+        def agent(client, idx):
+            rng = random.Random(args.seed + idx)
+            start = time.perf_counter()
+            count = 0
+            while time.perf_counter() - start < args.duration:
+                message_id = str(uuid.uuid4())
+                with lock:
+                    sent_at[message_id] = time.perf_counter()
+                ack = client.call('message_team', {'id': message_id, 'data': f'carga {rng.random()}'},
+                                  namespace='/chat')
+                with lock:
+                    counters['sent'] += 1
+                    if not ack or not ack.get('ok'):
+                        counters['throttled'] += 1
+                count += 1
+                wait = start + count / args.rate - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+
+        threads = [threading.Thread(target=agent, args=(client, idx)) for idx, client in enumerate(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        time.sleep(0.5)
+        queries = requests.get(f'{url}/_load/queries').json()['queries'] - baseline_queries
+        for client in clients:
+            client.disconnect()
+        return summarize(counters['sent'], counters['throttled'], latencies, elapsed, queries)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', type=int, default=10)
+    parser.add_argument('--rooms', type=int, default=2)
+    parser.add_argument('--rate', type=float, default=1, help='mensagens por segundo de cada agente')
+    parser.add_argument('--duration', type=float, default=10, help='segundos')
+    parser.add_argument('--transport', choices=['test-client', 'server'], default='test-client')
+    parser.add_argument('--config', default='development')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=5000, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+    result = run_server(args) if args.transport == 'server' else run_test_client(args)
+    name = scenario(args)
+    print(json.dumps({name: result}, indent=2))
+    if args.save_baseline:
+        save_baseline(args.baseline, name, result)
+        print(f'Baseline salvo em {args.baseline}')
+        return
+    sys.exit(check(load_baselines(args.baseline), name, result, args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Compare the synchronous and the write-behind persistence of `message_team`
+
+Each mode runs in its own process (the mode is read from `CHAT_WRITE_BEHIND`
+when the config is imported) against the development database populated by
+`flask fake-db`, and reports messages/sec and emit latency percentiles.
+
+Usage:
+    python benchmarks/write_behind.py --messages 2000 --username admin --password Abc123
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from os.path import abspath, dirname
+
+BASE_DIR = abspath(dirname(dirname(__file__)))
+MODES = {'sync': '0', 'write-behind': '1'}
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run(args) -> dict:
+    sys.path.insert(0, BASE_DIR)
+    from app import create_app
+    from app.core.extesions import message_writer, socketio
+    from app.models.team import UserTeam
+    from app.models.security import User
+
+    app = create_app('development')
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    client.post('/auth/login/', data={'username': args.username, 'password': args.password})
+    user = User.query.filter(User.username == args.username).first()
+    team_id = args.team or UserTeam.query.filter(UserTeam.user_id == user.id).first().team_id
+    client.get(f'/chat/team/{team_id}')
+    socket = socketio.test_client(app, namespace='/chat', flask_test_client=client)
+    socket.emit('joined', {'team_id': str(team_id)}, namespace='/chat')
+
+    latencies = []
+    start = time.perf_counter()
+    for idx in range(args.messages):
+        sent = time.perf_counter()
+        ack = socket.emit('message_team', {'data': f'benchmark {idx}'}, namespace='/chat', callback=True)
+        latencies.append(time.perf_counter() - sent)
+        if not ack or not ack.get('ok'):
+            raise Exception(f'Mensagem não aceita: {ack}')
+        socket.get_received('/chat')
+    elapsed = time.perf_counter() - start
+    if message_writer.enabled:
+        message_writer.flush()
+    persisted = time.perf_counter() - start
+    socket.disconnect(namespace='/chat')
+    return {
+        'messages': args.messages,
+        'messages_per_second': args.messages / elapsed,
+        'persisted_per_second': args.messages / persisted,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='Abc123')
+    parser.add_argument('--team', default=None, help='id do time, padrão: primeiro time do usuário')
+    parser.add_argument('--mode', choices=MODES.keys(), default=None, help='executa somente um modo')
+    args = parser.parse_args()
+    if args.mode is not None:
+        print(json.dumps(run(args)))
+        return
+    results = {}
+    for mode, flag in MODES.items():
+        env = dict(os.environ, CHAT_WRITE_BEHIND=flag)
+        output = subprocess.run([sys.executable, __file__, '--mode', mode, *sys.argv[1:]],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    print(f"{'modo':<14}{'msg/s':>10}{'salvas/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for mode, result in results.items():
+        print(f"{mode:<14}{result['messages_per_second']:>10.0f}{result['persisted_per_second']:>10.0f}"
+              f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,42 @@ class BaseConfig(object):
     login_message = 'Você não tem acessos'
     SECURITY_UNAUTHORIZED_VIEW = '/unauthorized'
     STAGES = ['Criado', 'Vinculado', 'Em análise', 'Indevido', 'Transferido', 'Finalizado']
+    CHAT_PAGE_SIZE = 20
+    CHAT_PAGE_SIZE_MAX = 100
+    SOCKETIO_MESSAGE_QUEUE = environ.get('SOCKETIO_MESSAGE_QUEUE') # postgresql://, redis://, amqp://
+    SOCKETIO_CHANNEL = PROJECT_NAME
+    MEMBERSHIP_INDEX_TTL = 60
+    SHARED_STORE_URL = environ.get('SHARED_STORE_URL') # memory:// (padrão) ou sqlite:///caminho, compartilhado pelos processos
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 300
+    SESSION_REGISTRY_REQUIRED = False # True: sessões sem registro (ex.: após limpar o store) precisam de novo login
+    USER_CACHE_STRICT = False # True: atributos fora do snapshot geram erro em vez de carregar o usuário
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE_SIZE = 32
+    PASSWORD_HASH_QUEUE_TIMEOUT = 5
+    LOGIN_THROTTLE_WINDOW = 300 # segundos
+    LOGIN_THROTTLE_USERNAME = 5 # falhas por usuário na janela
+    LOGIN_THROTTLE_IP = 20 # falhas por IP na janela
+    ACTIVITY_TRACKER = True
+    ACTIVITY_FLUSH_INTERVAL = 30 # segundos entre as gravações de last_seen
+    TICKET_AUTO_ASSIGN = True
+    ASSIGNMENT_STAGE = 'Vinculado'
+    ASSIGNMENT_DEADLINE_DAYS = 7
+    ASSIGNMENT_ROUTES_TTL = 60 # segundos até recarregar os times dos serviços e os tickets abertos
+    COSTUMER_SEARCH_LIMIT = 10
+    COSTUMER_SEARCH_TIMEOUT_MS = 200
+    COSTUMER_SEARCH_CACHE_SIZE = 1024
+    COSTUMER_SEARCH_CACHE_TTL = 30 # segundos
+    ADDRESS_CACHE_SIZE = 100000 # chaves de CEP, cidade, UF e tipo de endereço em memória
+    SOCKETIO_RATE_LIMITS = {'message_team': (2, 10)} # evento: (tokens por segundo, rajada)
+    SOCKETIO_RATE_LIMIT_DEFAULT = (5, 20)
+    SOCKETIO_QUEUE_HIGH_WATER = 100
+    SOCKETIO_SERIALIZER = environ.get('SOCKETIO_SERIALIZER', 'default') # default (JSON) ou msgpack
+    CHAT_WRITE_BEHIND = environ.get('CHAT_WRITE_BEHIND', '0') == '1'
+    CHAT_WRITE_BEHIND_QUEUE_SIZE = 10000
+    CHAT_WRITE_BEHIND_INTERVAL = 0.005
+    CHAT_WRITE_BEHIND_BATCH_SIZE = 500
+    CHAT_WRITE_BEHIND_RETRIES = 3
 
 class DevelopmentConfig(BaseConfig):
     ENV = 'development'
@@ -30,5 +66,16 @@ class ProductionConfig(BaseConfig):
     ENV = 'production'
     SQLALCHEMY_DATABASE_URI = f'postgresql://{BaseConfig._SQLALCHEMY_DATABASE_USERNAME}:{BaseConfig._SQLALCHEMY_DATABASE_PASSWORD}@{BaseConfig._SQLALCHEMY_DATABASE_HOST}:{BaseConfig._SQLALCHEMY_DATABASE_PORT}/{BaseConfig._SQLALCHEMY_DATABASE_NAME}'
 
+class TestingConfig(BaseConfig):
+    ENV = 'test'
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    ACTIVITY_TRACKER = False
+    USER_CACHE_STRICT = True
+    SECRET_KEY = environ.get('SERVER_KEY', 'test')
+    SECURITY_PASSWORD_SALT = environ.get('PASSWORD_SALT', 'test')
+    SQLALCHEMY_DATABASE_URI = f'postgresql://{BaseConfig._SQLALCHEMY_DATABASE_USERNAME}:{BaseConfig._SQLALCHEMY_DATABASE_PASSWORD}@{BaseConfig._SQLALCHEMY_DATABASE_HOST}:{BaseConfig._SQLALCHEMY_DATABASE_PORT}/{BaseConfig._SQLALCHEMY_DATABASE_NAME}_test'
+
 config = {'development': DevelopmentConfig,
-          'production': ProductionConfig}
\ No newline at end of file
+          'production': ProductionConfig,
+          'test': TestingConfig}
\ No newline at end of file